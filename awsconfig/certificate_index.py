@@ -0,0 +1,221 @@
+"""Expiry-ordered index of cert-manager certificates
+
+Keeps a compact `CertificateRecord` per certificate (`notAfter`, issuer, namespace, readiness), with a heap keyed on the time of the
+certificate's next compliance transition: `notAfter - threshold`, when it starts expiring, then `notAfter`, when it
+expires. A run only has to re-evaluate the certificates popped from the heap, and the issuer and namespace indexes
+make per-issuer and per-namespace reports independent of the Kubernetes API.
+
+This module must be packaged next to the Lambda handler that imports it.
+
+"""
+import heapq
+from datetime import datetime, timezone
+
+
+def parse_time(value):
+    """Converts a Kubernetes RFC 3339 timestamp to epoch seconds; returns None for a missing value"""
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+def format_time(value):
+    """Converts epoch seconds to an RFC 3339 UTC timestamp"""
+    return datetime.fromtimestamp(value, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class CertificateRecord:
+    """The fields of a cert-manager Certificate that evaluation uses, and nothing else
+
+    Records are built straight from the listed objects, so the full objects (managedFields, annotations, status
+    history) can be dropped page by page; `__slots__` keeps each record to a few hundred bytes.
+
+    """
+    __slots__ = ('namespace', 'name', 'resource_version', 'issuer', 'not_after', 'ready', 'compliance')
+
+    def __init__(self, namespace, name, resource_version, issuer, not_after, ready, compliance=None):
+        self.namespace = namespace
+        self.name = name
+        self.resource_version = resource_version
+        self.issuer = issuer
+        self.not_after = not_after
+        self.ready = ready
+        self.compliance = compliance
+
+    @property
+    def resource_id(self):
+        return "%s/%s" % (self.namespace, self.name)
+
+    @classmethod
+    def from_object(cls, cert):
+        """Projects a Certificate object as returned by the Kubernetes API"""
+        metadata = cert['metadata']
+        status = cert.get('status') or {}
+        return cls(
+            metadata['namespace'],
+            metadata['name'],
+            metadata.get('resourceVersion'),
+            cert['spec']['issuerRef']['name'],
+            parse_time(status.get('notAfter')),
+            any(condition.get('type') == 'Ready' and condition.get('status') == 'True' for condition in status.get('conditions', [])),
+        )
+
+    @classmethod
+    def from_dict(cls, value):
+        return cls(**value)
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+def compliance(record, now, threshold):
+    """Evaluates a certificate record
+
+    Args:
+        record (CertificateRecord): The record
+
+        now (float): The evaluation time in epoch seconds
+
+        threshold (int): Seconds before `notAfter` from which a certificate counts as expiring
+
+    Returns:
+        tuple: (compliance type, annotation)
+
+    """
+    not_after = record.not_after
+    if not_after is not None and now >= not_after:
+        return 'NON_COMPLIANT', "Expired %s" % format_time(not_after)
+    if not record.ready or not_after is None:
+        return 'NON_COMPLIANT', "Not ready"
+    if now >= not_after - threshold:
+        return 'NON_COMPLIANT', "Expires in %.1f days" % ((not_after - now) / 86400)
+    return 'COMPLIANT', None
+
+
+class ExpiryIndex:
+    """Certificates ordered by their next compliance transition, with issuer and namespace indexes
+
+    Heap entries are invalidated lazily: updating or removing a certificate bumps its generation and stale entries are
+    skipped when they reach the top.
+
+    Args:
+        threshold (int): Seconds before `notAfter` from which a certificate counts as expiring
+
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.records = {}
+        self.by_issuer = {}
+        self.by_namespace = {}
+        self._heap = []
+        self._generations = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def next_transition(self, record, now):
+        """Returns the epoch time of the record's next compliance transition after `now`, or None"""
+        not_after = record.not_after
+        if not_after is None:
+            return None
+        for transition in (not_after - self.threshold, not_after):
+            if transition > now:
+                return transition
+        return None
+
+    def upsert(self, resource_id, record, now):
+        """Adds or replaces a certificate record
+
+        Args:
+            resource_id (string): `<namespace>/<name>`
+
+            record (CertificateRecord): The certificate record
+
+            now (float): The current time in epoch seconds
+
+        """
+        self.remove(resource_id)
+        self.records[resource_id] = record
+        self.by_issuer.setdefault(record.issuer, set()).add(resource_id)
+        self.by_namespace.setdefault(record.namespace, set()).add(resource_id)
+        self._schedule(resource_id, now)
+
+    def remove(self, resource_id):
+        record = self.records.pop(resource_id, None)
+        if record is None:
+            return
+        self._generations[resource_id] = self._generations.get(resource_id, 0) + 1
+        for index, key in ((self.by_issuer, record.issuer), (self.by_namespace, record.namespace)):
+            members = index.get(key)
+            members.discard(resource_id)
+            if not members:
+                del index[key]
+
+    def _schedule(self, resource_id, now):
+        transition = self.next_transition(self.records[resource_id], now)
+        if transition is not None:
+            heapq.heappush(self._heap, (transition, resource_id, self._generations.get(resource_id, 0)))
+
+    def _is_current(self, entry):
+        return entry[1] in self.records and entry[2] == self._generations.get(entry[1], 0)
+
+    def pop_due(self, now):
+        """Removes and returns the ids of certificates whose transition time has passed, rescheduling each
+
+        Costs O(log n) per certificate returned.
+        """
+        due = {}
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            if self._is_current(entry):
+                due[entry[1]] = True
+        for resource_id in due:
+            self._schedule(resource_id, now)
+        return list(due)
+
+    def issuer_report(self, now):
+        """Summarizes expiry per issuer
+
+        Returns:
+            dict: Issuer name to `total`, `expired`, `expiring`, `not_ready` and the earliest `notAfter` (ISO 8601)
+
+        """
+        report = {}
+        for issuer, members in self.by_issuer.items():
+            counts = {'total': len(members), 'expired': 0, 'expiring': 0, 'not_ready': 0, 'earliest_not_after': None}
+            earliest = None
+            for resource_id in members:
+                record = self.records[resource_id]
+                not_after = record.not_after
+                if not_after is not None:
+                    earliest = not_after if earliest is None else min(earliest, not_after)
+                    if now >= not_after:
+                        counts['expired'] += 1
+                        continue
+                    if now >= not_after - self.threshold:
+                        counts['expiring'] += 1
+                if not record.ready:
+                    counts['not_ready'] += 1
+            if earliest is not None:
+                counts['earliest_not_after'] = format_time(earliest)
+            report[issuer] = counts
+        return report
+
+    @classmethod
+    def from_records(cls, records, threshold, since):
+        """Builds an index from persisted records in O(n)
+
+        Transitions are scheduled from `since`, the time the records were last evaluated, so transitions that passed
+        in between are returned by the next `pop_due`.
+        """
+        index = cls(threshold)
+        for resource_id, record in records.items():
+            index.records[resource_id] = record
+            index.by_issuer.setdefault(record.issuer, set()).add(resource_id)
+            index.by_namespace.setdefault(record.namespace, set()).add(resource_id)
+            transition = index.next_transition(record, since)
+            if transition is not None:
+                index._heap.append((transition, resource_id, 0))
+        heapq.heapify(index._heap)
+        return index
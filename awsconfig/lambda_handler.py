@@ -1,70 +1,437 @@
+import base64
 import boto3
 import json
+import os
+import queue
+import random
+import tempfile
+import threading
+import time
 import kubernetes
+from botocore.exceptions import ClientError
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from kubernetes import client, config
+from kubernetes.client.rest import ApiException
 from datetime import datetime, timezone
+from certificate_index import CertificateRecord, ExpiryIndex, compliance
 
-def lambda_handler(event, context):
-    # Configure kubernetes client
-    config.load_incluster_config()
-    v1 = client.CoreV1Api()
-    
-    # List all namespaces
-    namespaces = v1.list_namespace()
-    
-    certificates = []
-    
-    for ns in namespaces.items:
-        # List certificates in each namespace
-        api_instance = client.CustomObjectsApi()
-        certs = api_instance.list_namespaced_custom_object(
-            group="cert-manager.io",
-            version="v1",
-            namespace=ns.metadata.name,
-            plural="certificates"
+CERT_GROUP = "cert-manager.io"
+CERT_VERSION = "v1"
+CERT_PLURAL = "certificates"
+
+# Objects per list call; each page is processed and dropped before the next one is requested
+LIST_PAGE_SIZE = int(os.environ.get('LIST_PAGE_SIZE', '500'))
+# Namespaced lists kept in flight when cluster-wide list permission is missing
+NAMESPACE_LIST_WORKERS = int(os.environ.get('NAMESPACE_LIST_WORKERS', '8'))
+
+# PutEvaluations accepts at most 100 evaluations per call
+EVALUATION_BATCH_SIZE = 100
+EVALUATION_SENDERS = int(os.environ.get('EVALUATION_SENDERS', '4'))
+EVALUATION_MAX_ATTEMPTS = int(os.environ.get('EVALUATION_MAX_ATTEMPTS', '6'))
+THROTTLING_ERROR_CODES = ('ThrottlingException', 'Throttling', 'TooManyRequestsException', 'RequestLimitExceeded')
+
+# Snapshot of each certificate's resourceVersion and last reported compliance, kept in S3 when SNAPSHOT_BUCKET is set
+# and in a local file otherwise. Only certificates that changed since the snapshot are reported, except on a full
+# resync every FULL_RESYNC_INTERVAL seconds.
+SNAPSHOT_BUCKET = os.environ.get('SNAPSHOT_BUCKET')
+SNAPSHOT_KEY = os.environ.get('SNAPSHOT_KEY', 'cert-manager-certificates/snapshot.json')
+SNAPSHOT_FILE = os.environ.get('SNAPSHOT_FILE', '/tmp/cert-manager-certificates-snapshot.json')
+FULL_RESYNC_INTERVAL = int(os.environ.get('FULL_RESYNC_INTERVAL', '86400'))
+SNAPSHOT_VERSION = 3
+# Certificates whose notAfter is closer than this are NON_COMPLIANT
+EXPIRY_THRESHOLD = int(os.environ.get('EXPIRY_THRESHOLD_DAYS', '14')) * 86400
+RESOURCE_TYPE = 'Custom::CertManagerCertificate'
+
+# Fleet mode: a JSON list of {"name", "region", "role_arn" (optional)} clusters listed concurrently, at most
+# CLUSTER_WORKERS at a time, instead of the cluster the function runs in. Resource ids are prefixed with the cluster.
+CLUSTERS = json.loads(os.environ.get('CLUSTERS') or '[]')
+CLUSTER_WORKERS = int(os.environ.get('CLUSTER_WORKERS', '8'))
+# EKS accepts a bearer token for 15 minutes; a cached one is replaced a minute before that
+TOKEN_LIFETIME = 14 * 60
+
+# Module-scoped so that warm containers reuse the tokens of every cluster. The shared lock only guards the dicts;
+# minting holds the cluster's own lock, so one cluster's STS round trip never stalls requests to the others.
+cluster_tokens = {}
+cluster_token_locks = {}
+cluster_tokens_lock = threading.Lock()
+
+
+def list_pages(list_call, project=None, **kwargs):
+    """Yield the item lists of a paginated Kubernetes list call, following `continue` tokens.
+
+    With `project`, the response body is not deserialized by the client: each raw JSON page is parsed, every item is
+    passed through `project`, and the page is dropped before the next one is requested.
+    """
+    continue_token = None
+    while True:
+        if continue_token:
+            kwargs['_continue'] = continue_token
+        if project:
+            page = json.loads(list_call(limit=LIST_PAGE_SIZE, _preload_content=False, **kwargs).data)
+            metadata = page.get('metadata', {})
+            items = [project(item) for item in page['items']]
+            del page
+            yield items
+        else:
+            response = list_call(limit=LIST_PAGE_SIZE, **kwargs)
+            yield response.items
+            metadata = response.metadata.to_dict()
+        continue_token = metadata.get('continue') or metadata.get('_continue')
+        if not continue_token:
+            return
+
+
+def list_namespace_certificates(api_instance, namespace):
+    """List every certificate of one namespace, page by page, as CertificateRecords."""
+    certs = []
+    for items in list_pages(api_instance.list_namespaced_custom_object, CertificateRecord.from_object, group=CERT_GROUP, version=CERT_VERSION, namespace=namespace, plural=CERT_PLURAL):
+        certs.extend(items)
+    return certs
+
+
+def iter_namespaced_certificates(v1, api_instance):
+    """Yield certificates namespace by namespace, with a bounded window of namespaced lists in flight."""
+    with ThreadPoolExecutor(max_workers=NAMESPACE_LIST_WORKERS) as executor:
+        in_flight = deque()
+        for namespaces in list_pages(v1.list_namespace):
+            for ns in namespaces:
+                in_flight.append(executor.submit(list_namespace_certificates, api_instance, ns.metadata.name))
+                # Results are consumed in submission order, so at most the window of namespaces is held in memory
+                if len(in_flight) >= NAMESPACE_LIST_WORKERS:
+                    yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+
+def iter_certificates(v1, api_instance):
+    """Yield a CertificateRecord for every cert-manager certificate in the cluster.
+
+    A single cluster-scoped list is paged through with limit/continue. If the role may not list certificates
+    cluster-wide (403), certificates are listed per namespace instead.
+    """
+    pages = list_pages(api_instance.list_cluster_custom_object, CertificateRecord.from_object, group=CERT_GROUP, version=CERT_VERSION, plural=CERT_PLURAL)
+    try:
+        first_page = next(pages)
+    except StopIteration:
+        return
+    except ApiException as e:
+        if e.status != 403:
+            raise
+        print(f"Cluster-wide certificate list forbidden, listing per namespace: {e.reason}")
+        yield from iter_namespaced_certificates(v1, api_instance)
+        return
+    yield from first_page
+    for items in pages:
+        yield from items
+
+
+def cluster_token(cluster):
+    """Return a bearer token for the cluster, minting a new one only when the cached one is about to expire."""
+    # Only fleet mode needs eks_token, so in-cluster deployments do not have to package it
+    from eks_token import get_token
+    key = (cluster['name'], cluster['region'], cluster.get('role_arn') or None)
+    with cluster_tokens_lock:
+        token, expires = cluster_tokens.get(key, (None, 0))
+        if time.time() < expires:
+            return token
+        key_lock = cluster_token_locks.setdefault(key, threading.Lock())
+    # Concurrent requests of the same cluster wait for a single mint
+    with key_lock:
+        with cluster_tokens_lock:
+            token, expires = cluster_tokens.get(key, (None, 0))
+        if time.time() >= expires:
+            token = get_token(cluster_name=cluster['name'], role_arn=key[2], region_name=cluster['region'])['status']['token']
+            with cluster_tokens_lock:
+                cluster_tokens[key] = (token, time.time() + TOKEN_LIFETIME)
+        return token
+
+
+def cluster_api_client(cluster):
+    """Build a Kubernetes API client for an EKS cluster from describe-cluster and an IAM token, as eks.py does.
+
+    The client asks for the token before every request, so long scans and warm containers get a fresh one before
+    the old one expires. Returns the client and the path of its temporary CA file, which the caller removes.
+    """
+    session = boto3.session.Session(region_name=cluster['region'])
+    if cluster.get('role_arn'):
+        credentials = session.client('sts').assume_role(RoleArn=cluster['role_arn'], RoleSessionName="CertComplianceSession")['Credentials']
+        session = boto3.session.Session(
+            aws_access_key_id=credentials['AccessKeyId'],
+            aws_secret_access_key=credentials['SecretAccessKey'],
+            aws_session_token=credentials['SessionToken'],
+            region_name=cluster['region']
         )
-        
-        for cert in certs['items']:
-            cert_data = {
-                "Name": cert['metadata']['name'],
-                "Namespace": cert['metadata']['namespace'],
-                "CommonName": cert['spec'].get('commonName', ''),
-                "DNSNames": cert['spec'].get('dnsNames', []),
-                "Issuer": cert['spec']['issuerRef']['name'],
-                "SecretName": cert['spec']['secretName'],
-                "RenewalTime": cert['status'].get('renewalTime', ''),
-                "Labels": cert['metadata'].get('labels', {})  # Add this line
-
-            }
-            certificates.append(cert_data)
-    
-    # Create AWS Config configuration items
+    desc = session.client('eks').describe_cluster(name=cluster['name'])['cluster']
+
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.crt') as ca_file:
+        ca_file.write(base64.b64decode(desc['certificateAuthority']['data']))
+    configuration = client.Configuration()
+    configuration.host = desc['endpoint']
+    configuration.ssl_ca_cert = ca_file.name
+    configuration.api_key = {'authorization': cluster_token(cluster)}
+    configuration.api_key_prefix = {'authorization': 'Bearer'}
+    configuration.refresh_api_key_hook = lambda configuration: configuration.api_key.update(authorization=cluster_token(cluster))
+    return client.ApiClient(configuration), ca_file.name
+
+
+def iter_fleet_certificates(clusters, failed_clusters):
+    """Yield (cluster name, CertificateRecord) for every certificate of every cluster, listing clusters concurrently.
+
+    Each cluster is listed by its own worker into a bounded queue, so the run takes as long as the slowest cluster
+    and memory does not depend on the fleet size. Clusters that cannot be listed are added to `failed_clusters`.
+    """
+    records = queue.Queue(maxsize=LIST_PAGE_SIZE * 2)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                records.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    def list_cluster(cluster):
+        try:
+            api_client, ca_path = cluster_api_client(cluster)
+            try:
+                for record in iter_certificates(client.CoreV1Api(api_client), client.CustomObjectsApi(api_client)):
+                    if stop.is_set():
+                        return
+                    put((cluster['name'], record))
+            finally:
+                os.remove(ca_path)
+        except Exception as e:
+            print(f"Listing certificates of cluster {cluster['name']} failed: {e}")
+            failed_clusters.add(cluster['name'])
+        finally:
+            put((cluster['name'], done))
+
+    with ThreadPoolExecutor(max_workers=min(CLUSTER_WORKERS, len(clusters)) or 1) as executor:
+        for cluster in clusters:
+            executor.submit(list_cluster, cluster)
+        try:
+            remaining = len(clusters)
+            while remaining:
+                cluster_name, record = records.get()
+                if record is done:
+                    remaining -= 1
+                    continue
+                yield cluster_name, record
+        finally:
+            # Unblocks the workers if the consumer stops early
+            stop.set()
+
+
+class FileSnapshotStore:
+    """Keeps the certificate snapshot in a local JSON file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as snapshot_file:
+                return json.load(snapshot_file)
+        except FileNotFoundError:
+            return None
+
+    def save(self, snapshot):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as snapshot_file:
+            json.dump(snapshot, snapshot_file)
+        os.replace(tmp_path, self.path)
+
+
+class S3SnapshotStore:
+    """Keeps the certificate snapshot as a JSON object in S3."""
+
+    def __init__(self, bucket, key, s3_client=None):
+        self.bucket = bucket
+        self.key = key
+        self.s3_client = s3_client or boto3.client('s3')
+
+    def load(self):
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self.key)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            raise
+        return json.loads(response['Body'].read())
+
+    def save(self, snapshot):
+        self.s3_client.put_object(Bucket=self.bucket, Key=self.key, Body=json.dumps(snapshot).encode('utf-8'), ContentType='application/json')
+
+
+def get_snapshot_store():
+    if SNAPSHOT_BUCKET:
+        return S3SnapshotStore(SNAPSHOT_BUCKET, SNAPSHOT_KEY)
+    return FileSnapshotStore(SNAPSHOT_FILE)
+
+
+def evaluation(resource_id, compliance_type, evaluated_at, annotation=None):
+    result = {
+        'ComplianceResourceType': RESOURCE_TYPE,
+        'ComplianceResourceId': resource_id,
+        'ComplianceType': compliance_type,
+        'OrderingTimestamp': evaluated_at
+    }
+    if annotation:
+        result['Annotation'] = annotation
+    return result
+
+
+class EvaluationSender:
+    """Accumulates AWS Config evaluations and sends them in batches of 100 from a small thread pool.
+
+    Throttled batches are retried with full-jitter exponential backoff. Use as a context manager; leaving the block
+    flushes the last partial batch, waits for every send and raises the first send error, if any.
+    """
+
+    def __init__(self, config_client, result_token, max_workers=EVALUATION_SENDERS, max_attempts=EVALUATION_MAX_ATTEMPTS, base_delay=0.2, max_delay=5.0):
+        self.config_client = config_client
+        self.result_token = result_token
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        # Bounds the batches queued in the executor so a fast producer cannot buffer every evaluation
+        self.slots = threading.BoundedSemaphore(max_workers * 2)
+        self.batch = []
+        self.futures = []
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.failed = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.flush()
+            for future in self.futures:
+                if exc_type is None:
+                    future.result()
+        finally:
+            self.executor.shutdown(wait=True)
+        return False
+
+    def add(self, evaluation):
+        self.batch.append(evaluation)
+        if len(self.batch) >= EVALUATION_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+        self.slots.acquire()
+        self.futures = [future for future in self.futures if not future.done() or future.exception()]
+        self.futures.append(self.executor.submit(self._send, batch))
+
+    def _send(self, batch):
+        try:
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    response = self.config_client.put_evaluations(Evaluations=batch, ResultToken=self.result_token)
+                    break
+                except ClientError as e:
+                    if e.response['Error']['Code'] not in THROTTLING_ERROR_CODES or attempt == self.max_attempts:
+                        raise
+                    time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1))))
+            with self.lock:
+                self.sent += len(batch)
+                self.failed.extend(response.get('FailedEvaluations', []))
+            if response.get('FailedEvaluations'):
+                print(f"PutEvaluations rejected {len(response['FailedEvaluations'])} of {len(batch)} evaluations")
+        finally:
+            self.slots.release()
+
+
+def lambda_handler(event, context):
+    # Configure kubernetes clients: every configured cluster, or the one the function runs in
+    failed_clusters = set()
+    if CLUSTERS:
+        listing = iter_fleet_certificates(CLUSTERS, failed_clusters)
+    else:
+        config.load_incluster_config()
+        listing = ((None, record) for record in iter_certificates(client.CoreV1Api(), client.CustomObjectsApi()))
+
+    # Compare against the snapshot of the last run; without one, or when it is due, resync everything
+    store = get_snapshot_store()
+    previous = store.load() or {}
+    now = time.time()
+    previous_records = {}
+    if previous.get('version') == SNAPSHOT_VERSION:
+        previous_records = {resource_id: CertificateRecord.from_dict(record) for resource_id, record in previous['certificates'].items()}
+    full_resync = (previous.get('version') != SNAPSHOT_VERSION
+                   or now - previous.get('last_full_sync', 0) >= FULL_RESYNC_INTERVAL)
+    known = {} if full_resync else previous_records
+
+    # Unchanged certificates are only re-evaluated when they cross an expiry transition since the last run
+    index = ExpiryIndex.from_records(known, EXPIRY_THRESHOLD, previous.get('last_run', now))
+    due = set(index.pop_due(now))
+
+    # Report added, changed and newly expiring certificates to AWS Config, and deleted ones as NOT_APPLICABLE
     config_client = boto3.client('config')
-    
-    for cert in certificates:
-        config_item = {
-            'configurationItemStatus': 'OK',
-            'resourceType': 'Custom::CertManagerCertificate',
-            'resourceId': f"{cert['Namespace']}/{cert['Name']}",
-            'resourceName': cert['Name'],
-            'ARN': f"arn:aws:eks::{context.invoked_function_arn.split(':')[4]}:certificate/{cert['Namespace']}/{cert['Name']}",
-            'configuration': json.dumps(cert),
-            'configurationItemCaptureTime': datetime.now(timezone.utc).isoformat()
-        }
-        
-        config_client.put_evaluations(
-            Evaluations=[
-                {
-                    'ComplianceResourceType': 'Custom::CertManagerCertificate',
-                    'ComplianceResourceId': f"{cert['Namespace']}/{cert['Name']}",
-                    'ComplianceType': 'COMPLIANT',
-                    'OrderingTimestamp': datetime.now(timezone.utc)
-                }
-            ],
-            ResultToken=event['resultToken']
-        )
-    
+    evaluated_at = datetime.now(timezone.utc)
+    seen = set()
+    processed = 0
+    reported = 0
+    with EvaluationSender(config_client, event['resultToken']) as sender:
+        for cluster_name, listed in listing:
+            processed += 1
+            resource_id = f"{cluster_name}/{listed.resource_id}" if cluster_name else listed.resource_id
+            seen.add(resource_id)
+            record = known.get(resource_id)
+            if record and record.resource_version == listed.resource_version:
+                if resource_id not in due:
+                    continue
+            else:
+                record = listed
+                index.upsert(resource_id, record, now)
+            compliance_type, annotation = compliance(record, now, EXPIRY_THRESHOLD)
+            record.compliance = compliance_type
+            sender.add(evaluation(resource_id, compliance_type, evaluated_at, annotation))
+            reported += 1
+        # Deletions are found against the previous snapshot even on a full resync, whatever its version
+        for resource_id in set(previous.get('certificates') or {}) - seen:
+            # Certificates of a cluster that could not be listed are kept, and still reported if their expiry changed
+            if failed_clusters and resource_id.split('/', 1)[0] in failed_clusters:
+                record = previous_records.get(resource_id)
+                if record is None:
+                    continue
+                if full_resync:
+                    index.upsert(resource_id, record, now)
+                if full_resync or resource_id in due:
+                    compliance_type, annotation = compliance(record, now, EXPIRY_THRESHOLD)
+                    record.compliance = compliance_type
+                    sender.add(evaluation(resource_id, compliance_type, evaluated_at, annotation))
+                    reported += 1
+                continue
+            index.remove(resource_id)
+            sender.add(evaluation(resource_id, 'NOT_APPLICABLE', evaluated_at))
+            reported += 1
+
+    # Only saved once every evaluation was accepted, so a failed run is retried against the old snapshot
+    if sender.failed:
+        raise RuntimeError(f"AWS Config rejected {len(sender.failed)} evaluations, first: {sender.failed[0]}")
+    issuer_report = index.issuer_report(now)
+    store.save({
+        'version': SNAPSHOT_VERSION,
+        'last_full_sync': now if full_resync else previous['last_full_sync'],
+        'last_run': now,
+        'certificates': {resource_id: record.to_dict() for resource_id, record in index.records.items()},
+        'issuer_report': issuer_report
+    })
+
     return {
         'statusCode': 200,
-        'body': json.dumps(f'Processed {len(certificates)} certificates')
+        'body': json.dumps(f"Processed {processed} certificates, reported {reported} evaluations{' (full resync)' if full_resync else ''}"),
+        'issuerReport': issuer_report,
+        'failedClusters': sorted(failed_clusters)
     }
@@ -0,0 +1,105 @@
+from certificate_index import CertificateRecord, ExpiryIndex, compliance
+
+THRESHOLD = 100
+NOW = 1000
+
+
+def record(name, not_after, ready=True, issuer='letsencrypt', namespace='default'):
+    return CertificateRecord(namespace, name, '1', issuer, not_after, ready)
+
+
+def index_of(*records):
+    index = ExpiryIndex(THRESHOLD)
+    for certificate in records:
+        index.upsert(certificate.resource_id, certificate, NOW)
+    return index
+
+
+def test_pop_due_returns_certificates_in_transition_order():
+    # 'default/b' starts expiring at 1020, 'default/a' at 1050
+    index = index_of(record('a', 1150), record('b', 1120))
+
+    assert index.pop_due(NOW) == []
+    assert index.pop_due(1030) == ['default/b']
+    assert index.pop_due(1060) == ['default/a']
+    assert index.pop_due(1130) == ['default/b']
+    assert index.pop_due(1200) == ['default/a']
+    assert index.pop_due(5000) == []
+
+
+def test_pop_due_returns_each_certificate_once_when_both_transitions_passed():
+    index = index_of(record('a', 1150), record('b', 1120))
+
+    assert index.pop_due(1200) == ['default/b', 'default/a']
+    assert index.pop_due(5000) == []
+
+
+def test_renewed_certificate_skips_its_superseded_heap_entry():
+    index = index_of(record('a', 1150))
+
+    index.upsert('default/a', record('a', 5000), 1010)
+
+    assert index.pop_due(1100) == []
+    assert index.pop_due(4900) == ['default/a']
+
+
+def test_removed_certificate_is_never_due():
+    index = index_of(record('a', 1150), record('b', 1120))
+
+    index.remove('default/b')
+
+    assert index.pop_due(1200) == ['default/a']
+    assert len(index) == 1
+    assert index.by_issuer == {'letsencrypt': {'default/a'}}
+
+
+def test_certificate_added_again_after_removal_is_scheduled_again():
+    index = index_of(record('a', 1150))
+
+    index.remove('default/a')
+    index.upsert('default/a', record('a', 1150), NOW)
+
+    assert index.pop_due(1060) == ['default/a']
+
+
+def test_certificate_without_not_after_is_never_scheduled():
+    index = index_of(record('a', None, ready=False))
+
+    assert index.pop_due(10 ** 10) == []
+    assert len(index) == 1
+
+
+def test_from_records_returns_transitions_passed_since_the_last_run():
+    records = {'default/a': record('a', 1150), 'default/b': record('b', 3000)}
+
+    index = ExpiryIndex.from_records(records, THRESHOLD, since=NOW)
+
+    assert index.pop_due(1100) == ['default/a']
+
+
+def test_compliance_at_the_renewal_threshold_and_at_expiry():
+    certificate = record('a', 1150)
+
+    assert compliance(certificate, 1049, THRESHOLD) == ('COMPLIANT', None)
+    assert compliance(certificate, 1050, THRESHOLD) == ('NON_COMPLIANT', "Expires in 0.0 days")
+    assert compliance(certificate, 1149, THRESHOLD)[0] == 'NON_COMPLIANT'
+    assert compliance(certificate, 1150, THRESHOLD) == ('NON_COMPLIANT', "Expired 1970-01-01T00:19:10Z")
+
+
+def test_compliance_of_certificates_that_are_not_ready():
+    assert compliance(record('a', 1150, ready=False), NOW, THRESHOLD) == ('NON_COMPLIANT', "Not ready")
+    assert compliance(record('a', None, ready=True), NOW, THRESHOLD) == ('NON_COMPLIANT', "Not ready")
+    # Expiry takes precedence over readiness
+    assert compliance(record('a', 900, ready=False), NOW, THRESHOLD) == ('NON_COMPLIANT', "Expired 1970-01-01T00:15:00Z")
+
+
+def test_transitions_line_up_with_compliance_changes():
+    index = index_of(record('a', 1150))
+    certificate = index.records['default/a']
+
+    seen = [compliance(certificate, NOW, THRESHOLD)[0]]
+    for now in range(NOW, 1300, 10):
+        if index.pop_due(now):
+            seen.append(compliance(certificate, now, THRESHOLD)[1].split()[0])
+
+    assert seen == ['COMPLIANT', 'Expires', 'Expired']
@@ -0,0 +1,161 @@
+"""Shared, concurrent role assumption for the inventory scripts
+
+`CredentialBroker` assumes roles in many accounts at once and hands out ready boto3 sessions per (role, region).
+Each role is assumed once; its credentials are botocore `RefreshableCredentials`, so every session built on them
+re-assumes the role by itself shortly before expiry instead of each caller repeating the STS round trip.
+
+    from credential_broker import CredentialBroker, role_arn
+
+    broker = CredentialBroker()
+    targets = [(role_arn(account, "inventory-read"), region) for account in accounts for region in regions]
+    sessions = broker.sessions(targets)
+    elbv2 = sessions[targets[0]].client('elbv2')
+
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import botocore.session
+from botocore.credentials import CredentialProvider, RefreshableCredentials
+
+DEFAULT_SESSION_NAME = "credential-broker"
+DEFAULT_DURATION = 3600
+DEFAULT_WORKERS = 16
+
+
+def role_arn(account_id, role_name, partition='aws'):
+    """Builds the ARN of a role from its account and name"""
+    return f"arn:{partition}:iam::{account_id}:role/{role_name}"
+
+
+class BrokerCredentialProvider(CredentialProvider):
+    """Puts credentials the broker already holds first in a botocore session's provider chain"""
+    METHOD = 'credential-broker'
+
+    def __init__(self, credentials):
+        super().__init__()
+        self.credentials = credentials
+
+    def load(self):
+        return self.credentials
+
+
+class CredentialBroker:
+    """Assumes roles concurrently and caches their credentials and sessions
+
+    Args:
+        base_session (Session): The boto3 session whose credentials assume the roles, defaults to a new one
+
+        session_name (string): The RoleSessionName used for every role
+
+        duration (int): DurationSeconds requested for each set of credentials
+
+        max_workers (int): Maximum concurrent AssumeRole calls in `sessions`
+
+        sts_region (string): Region of the STS endpoint, defaults to the base session's region
+
+    """
+
+    def __init__(self, base_session=None, session_name=DEFAULT_SESSION_NAME, duration=DEFAULT_DURATION, max_workers=DEFAULT_WORKERS, sts_region=None):
+        self.base_session = base_session or boto3.session.Session()
+        self.session_name = session_name
+        self.duration = duration
+        self.max_workers = max_workers
+        self.sts = self.base_session.client('sts', region_name=sts_region or self.base_session.region_name or 'us-east-1')
+        self._lock = threading.Lock()
+        self._role_locks = {}
+        self._credentials = {}
+        self._sessions = {}
+
+    def _assume(self, arn):
+        response = self.sts.assume_role(RoleArn=arn, RoleSessionName=self.session_name, DurationSeconds=self.duration)
+        credentials = response['Credentials']
+        return {
+            'access_key': credentials['AccessKeyId'],
+            'secret_key': credentials['SecretAccessKey'],
+            'token': credentials['SessionToken'],
+            'expiry_time': credentials['Expiration'].isoformat(),
+        }
+
+    def credentials(self, arn):
+        """Returns the refreshable credentials of a role, assuming it on first use
+
+        Concurrent callers for the same role wait for a single AssumeRole call.
+        """
+        with self._lock:
+            credentials = self._credentials.get(arn)
+            if credentials is not None:
+                return credentials
+            role_lock = self._role_locks.setdefault(arn, threading.Lock())
+        with role_lock:
+            with self._lock:
+                credentials = self._credentials.get(arn)
+            if credentials is None:
+                credentials = RefreshableCredentials.create_from_metadata(
+                    metadata=self._assume(arn),
+                    refresh_using=lambda: self._assume(arn),
+                    method='sts-assume-role',
+                )
+                with self._lock:
+                    self._credentials[arn] = credentials
+            return credentials
+
+    def session(self, arn, region):
+        """Returns a boto3 session for a role in a region
+
+        Args:
+            arn (string): The role ARN, or None for the base session's own credentials
+
+            region (string): The session's region
+
+        Returns:
+            Session: A session cached per (role, region) that refreshes its credentials by itself
+
+        """
+        key = (arn, region)
+        with self._lock:
+            session = self._sessions.get(key)
+        if session is not None:
+            return session
+        # Every (role, region) gets its own botocore session, since a session holds a single region
+        credentials = self.base_session.get_credentials() if arn is None else self.credentials(arn)
+        core_session = botocore.session.get_session()
+        core_session.get_component('credential_provider').insert_before('env', BrokerCredentialProvider(credentials))
+        session = boto3.session.Session(botocore_session=core_session, region_name=region)
+        with self._lock:
+            return self._sessions.setdefault(key, session)
+
+    def sessions(self, targets):
+        """Builds sessions for many (role ARN, region) pairs, assuming the distinct roles concurrently
+
+        Args:
+            targets (iterable): (role ARN, region) tuples
+
+        Returns:
+            dict: Each target tuple to its session
+
+        Raises:
+            Exception: The first AssumeRole failure, after every other role has been attempted
+
+        """
+        targets = list(targets)
+        arns = sorted(set(arn for arn, _ in targets if arn is not None))
+        if arns:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(arns))) as executor:
+                for future in [executor.submit(self.credentials, arn) for arn in arns]:
+                    future.result()
+        return {target: self.session(*target) for target in targets}
+
+
+_default_broker = None
+_default_broker_lock = threading.Lock()
+
+
+def default_broker():
+    """Returns a process-wide broker shared by every script that does not build its own"""
+    global _default_broker
+    with _default_broker_lock:
+        if _default_broker is None:
+            _default_broker = CredentialBroker()
+        return _default_broker
@@ -0,0 +1,595 @@
+"""Local fake of the Kubernetes API server for benchmarks
+
+Serves namespaces, pods and cert-manager Certificates generated at a configurable scale, over plain HTTP, with the
+list and watch semantics that `eks.py` and `awsconfig/lambda_handler.py` depend on:
+
+- `limit`/`continue` pagination, with continue tokens that expire (410 Gone) once the event log is compacted past them
+- PartialObjectMetadataList responses when the Accept header asks for them
+- equality `labelSelector`s and the `spec.nodeName` field selector for pods
+- watches from a `resourceVersion`, with bookmarks, `timeoutSeconds`, and an ERROR 410 event for a compacted version
+- an optional delay before every response, to model the distance to a real control plane
+
+Objects are generated from a seed and kept pre-serialized, so a page costs the server little more than a join. Every
+request is counted per verb and resource. `churn` modifies, deletes and adds pods to produce watch events, and
+`compact` drops the event log so watchers have to relist.
+
+    python fake_kube_apiserver.py --namespaces 5000 --pods 100000 --certificates 20000 --port 8001
+
+When run as a server, the same operations are available under /_fake/: GET stats, POST stats/reset, POST churn
+({"count": N}), POST compact and POST settings ({"latency": seconds, "forbid_cluster_certificates": bool}).
+
+"""
+import argparse
+import base64
+import binascii
+import bisect
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+DEFAULT_NAMESPACES = 500
+DEFAULT_PODS = 10000
+DEFAULT_CERTIFICATES = 2000
+PODS_PER_NODE = 30
+# Events kept for watchers resuming from a resourceVersion; older versions get 410 Gone
+EVENT_WINDOW = 100000
+BOOKMARK_INTERVAL = 5
+# Size of the last-applied-configuration annotation, which makes generated objects about as heavy as real ones
+ANNOTATION_PADDING = 256
+ISSUERS = ("letsencrypt-prod", "letsencrypt-staging", "internal-ca", "vault-issuer")
+POD_PHASES = ("Running",) * 16 + ("Pending", "Succeeded", "Failed")
+
+PATH_PATTERNS = (
+    (re.compile(r'^/api/v1/(?:namespaces/(?P<namespace>[^/]+)/)?(?P<resource>pods)(?:/(?P<name>[^/]+))?$'), 'pods'),
+    (re.compile(r'^/apis/cert-manager\.io/v1/(?:namespaces/(?P<namespace>[^/]+)/)?(?P<resource>certificates)(?:/(?P<name>[^/]+))?$'), 'certificates'),
+    (re.compile(r'^/api/v1/(?P<resource>namespaces)(?:/(?P<name>[^/]+))?$'), 'namespaces'),
+)
+LIST_KINDS = {
+    'namespaces': ('v1', 'NamespaceList'),
+    'pods': ('v1', 'PodList'),
+    'certificates': ('cert-manager.io/v1', 'CertificateList'),
+}
+
+
+class ApiError(Exception):
+    """Returned to the client as a Kubernetes Status object"""
+
+    def __init__(self, code, reason, message):
+        super().__init__(message)
+        self.code = code
+        self.reason = reason
+
+    def status(self):
+        return {'kind': 'Status', 'apiVersion': 'v1', 'metadata': {}, 'status': 'Failure', 'message': str(self), 'reason': self.reason, 'code': self.code}
+
+
+class StoredObject:
+    """One object, serialized once in full and as metadata only, with the fields selectors match on"""
+    __slots__ = ('namespace', 'labels', 'node', 'full', 'metadata')
+
+    def __init__(self, obj):
+        metadata = obj['metadata']
+        self.namespace = metadata.get('namespace', '')
+        self.labels = metadata.get('labels') or {}
+        self.node = (obj.get('spec') or {}).get('nodeName')
+        self.full = json.dumps(obj, separators=(',', ':')).encode()
+        self.metadata = json.dumps({'apiVersion': 'meta.k8s.io/v1', 'kind': 'PartialObjectMetadata', 'metadata': metadata}, separators=(',', ':')).encode()
+
+    def matches(self, namespace, labels, node):
+        if namespace and self.namespace != namespace:
+            return False
+        if node and self.node != node:
+            return False
+        return all(self.labels.get(key) == value for key, value in labels.items())
+
+
+def parse_selectors(query):
+    """Returns the equality label selector and the spec.nodeName field selector of a request"""
+    labels = {}
+    for term in filter(None, query.get('labelSelector', '').split(',')):
+        key, _, value = term.replace('==', '=').partition('=')
+        labels[key.strip()] = value.strip()
+    node = None
+    for term in filter(None, query.get('fieldSelector', '').split(',')):
+        key, _, value = term.replace('==', '=').partition('=')
+        if key.strip() != 'spec.nodeName':
+            raise ApiError(400, 'BadRequest', f"field selector {key} is not supported")
+        node = value.strip()
+    return labels, node
+
+
+def encode_continue(resource_version, key):
+    return base64.urlsafe_b64encode(json.dumps({'rv': resource_version, 'start': key}).encode()).decode()
+
+
+def decode_continue(token):
+    try:
+        value = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return value['rv'], value['start']
+    except (ValueError, KeyError, binascii.Error):
+        raise ApiError(400, 'BadRequest', "invalid continue token")
+
+
+class FakeCluster:
+    """The objects, resource versions and event log behind the fake API server
+
+    Keys are `<namespace>/<name>` (`<name>` for namespaces) kept sorted per resource, so a namespaced list is a range
+    of the cluster-wide one and continue tokens resume after the last key returned. Pages after the first see the
+    current objects rather than a snapshot, unlike etcd, which is close enough for measuring clients.
+
+    Args:
+        namespaces (int): Namespaces to generate
+
+        pods (int): Pods to generate, spread across the namespaces
+
+        certificates (int): Certificates to generate, spread across the namespaces
+
+        seed (int): Seed of the generator, so runs are comparable
+
+        event_window (int): Events kept for resuming watches
+
+        latency (float): Seconds to wait before every response
+
+    """
+
+    def __init__(self, namespaces=DEFAULT_NAMESPACES, pods=DEFAULT_PODS, certificates=DEFAULT_CERTIFICATES, seed=0, event_window=EVENT_WINDOW, latency=0.0):
+        self.random = random.Random(seed)
+        self.event_window = event_window
+        self.latency = latency
+        self.forbid_cluster_certificates = False
+        self.requests = Counter()
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._objects = {resource: {} for resource in LIST_KINDS}
+        self._keys = {resource: [] for resource in LIST_KINDS}
+        self._resource_version = 0
+        self._events = []
+        self._event_versions = []
+        self._next_pod = 0
+        self._namespaces = [f"ns-{index:05d}" for index in range(max(namespaces, 1))]
+        self._nodes = [f"ip-10-{index // 250}-{index % 250}-{index % 7 + 10}.ec2.internal" for index in range(max(pods // PODS_PER_NODE, 1))]
+        self._now = datetime.now(timezone.utc)
+        for name in self._namespaces:
+            self._store('namespaces', self._namespace(name))
+        for _ in range(pods):
+            self._store('pods', self._pod())
+        for index in range(certificates):
+            self._store('certificates', self._certificate(index))
+        for resource in LIST_KINDS:
+            self._keys[resource].sort()
+        # Generated objects have no events, so watches must start from a list
+        self.compacted_version = self._resource_version
+
+    # --- generation ---
+
+    def _next_version(self):
+        self._resource_version += 1
+        return str(self._resource_version)
+
+    def _metadata(self, name, namespace=None, labels=None):
+        metadata = {
+            'name': name,
+            'uid': f"{self.random.getrandbits(64):016x}-{self._resource_version:08x}",
+            'resourceVersion': self._next_version(),
+            'creationTimestamp': (self._now - timedelta(days=self.random.randint(0, 400))).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'labels': labels or {},
+            'annotations': {'kubectl.kubernetes.io/last-applied-configuration': 'x' * ANNOTATION_PADDING},
+        }
+        if namespace:
+            metadata['namespace'] = namespace
+        return metadata
+
+    def _namespace(self, name):
+        return {
+            'apiVersion': 'v1',
+            'kind': 'Namespace',
+            'metadata': self._metadata(name, labels={'kubernetes.io/metadata.name': name}),
+            'spec': {'finalizers': ['kubernetes']},
+            'status': {'phase': 'Active'},
+        }
+
+    def _pod(self):
+        index = self._next_pod
+        self._next_pod += 1
+        app = f"app-{index % 97}"
+        phase = self.random.choice(POD_PHASES)
+        return {
+            'apiVersion': 'v1',
+            'kind': 'Pod',
+            'metadata': self._metadata(f"{app}-{index:07d}", self._namespaces[index % len(self._namespaces)], {'app': app, 'tier': ('web', 'worker', 'batch')[index % 3]}),
+            'spec': {
+                'nodeName': self.random.choice(self._nodes),
+                'containers': [{'name': app, 'image': f"registry.example.com/{app}:1.{index % 13}", 'resources': {'requests': {'cpu': '100m', 'memory': '128Mi'}}}],
+            },
+            'status': {
+                'phase': phase,
+                'conditions': [{'type': 'Ready', 'status': 'True' if phase == 'Running' else 'False'}],
+                'podIP': f"10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}",
+            },
+        }
+
+    def _certificate(self, index):
+        namespace = self._namespaces[index % len(self._namespaces)]
+        not_after = self._now + timedelta(days=self.random.uniform(-10, 90))
+        ready = self.random.random() > 0.02
+        return {
+            'apiVersion': 'cert-manager.io/v1',
+            'kind': 'Certificate',
+            'metadata': self._metadata(f"cert-{index:06d}", namespace),
+            'spec': {
+                'secretName': f"cert-{index:06d}-tls",
+                'dnsNames': [f"svc-{index}.{namespace}.example.com"],
+                'issuerRef': {'name': ISSUERS[index % len(ISSUERS)], 'kind': 'ClusterIssuer'},
+            },
+            'status': {
+                'notAfter': not_after.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'conditions': [{'type': 'Ready', 'status': 'True' if ready else 'False'}],
+            },
+        }
+
+    @staticmethod
+    def _key(obj):
+        metadata = obj['metadata']
+        return f"{metadata['namespace']}/{metadata['name']}" if 'namespace' in metadata else metadata['name']
+
+    def _store(self, resource, obj):
+        key = self._key(obj)
+        if key not in self._objects[resource]:
+            self._keys[resource].append(key)
+        self._objects[resource][key] = StoredObject(obj)
+        return key
+
+    # --- changes ---
+
+    def _record(self, resource, event_type, stored):
+        self._events.append((self._resource_version, resource, event_type, stored))
+        self._event_versions.append(self._resource_version)
+        if len(self._events) > 2 * self.event_window:
+            drop = len(self._events) - self.event_window
+            self.compacted_version = self._event_versions[drop - 1]
+            del self._events[:drop]
+            del self._event_versions[:drop]
+
+    def churn(self, count):
+        """Applies `count` pod changes: mostly phase flips, some deletions and creations
+
+        Returns:
+            int: The resourceVersion after the last change
+
+        """
+        with self._lock:
+            keys = self._keys['pods']
+            for _ in range(count):
+                roll = self.random.random()
+                if roll < 0.1 and keys:
+                    key = keys.pop(self.random.randrange(len(keys)))
+                    stored = self._objects['pods'].pop(key)
+                    obj = json.loads(stored.full)
+                    obj['metadata']['resourceVersion'] = self._next_version()
+                    self._record('pods', 'DELETED', StoredObject(obj))
+                elif roll < 0.2 or not keys:
+                    obj = self._pod()
+                    bisect.insort(keys, self._key(obj))
+                    self._objects['pods'][self._key(obj)] = stored = StoredObject(obj)
+                    self._record('pods', 'ADDED', stored)
+                else:
+                    key = keys[self.random.randrange(len(keys))]
+                    obj = json.loads(self._objects['pods'][key].full)
+                    obj['metadata']['resourceVersion'] = self._next_version()
+                    obj['status']['phase'] = self.random.choice(POD_PHASES)
+                    self._objects['pods'][key] = stored = StoredObject(obj)
+                    self._record('pods', 'MODIFIED', stored)
+            self._changed.notify_all()
+            return self._resource_version
+
+    def compact(self):
+        """Drops the event log past a change no watcher has seen, so every open watch and continue token gets 410
+
+        Returns:
+            int: The compacted resourceVersion
+
+        """
+        with self._lock:
+            self.compacted_version = int(self._next_version())
+            self._events = []
+            self._event_versions = []
+            self._changed.notify_all()
+            return self.compacted_version
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests': dict(self.requests),
+                'bytes_sent': self.bytes_sent,
+                'resource_version': self._resource_version,
+                'objects': {resource: len(objects) for resource, objects in self._objects.items()},
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self.requests.clear()
+            self.bytes_sent = 0
+
+    def count(self, verb, resource, sent=0):
+        with self._lock:
+            if verb:
+                self.requests[f"{verb} {resource}"] += 1
+            self.bytes_sent += sent
+
+    # --- reads ---
+
+    def get(self, resource, namespace, name):
+        with self._lock:
+            stored = self._objects[resource].get(f"{namespace}/{name}" if namespace else name)
+        if stored is None:
+            raise ApiError(404, 'NotFound', f"{resource} \"{name}\" not found")
+        return stored.full
+
+    def list(self, resource, namespace, query, metadata_only):
+        """Returns one page of a list as JSON bytes
+
+        Raises:
+            ApiError: 410 for a continue token older than the event log, 403 when cluster-wide certificate lists are
+                forbidden
+
+        """
+        if resource == 'certificates' and not namespace and self.forbid_cluster_certificates:
+            raise ApiError(403, 'Forbidden', "certificates.cert-manager.io is forbidden: cannot list resource \"certificates\" at the cluster scope")
+        labels, node = parse_selectors(query)
+        limit = int(query.get('limit') or 0)
+        with self._lock:
+            keys = self._keys[resource]
+            if query.get('continue'):
+                list_version, start_key = decode_continue(query['continue'])
+                if list_version < self.compacted_version:
+                    raise ApiError(410, 'Expired', "The provided continue parameter is too old to display a consistent list result")
+                position = bisect.bisect_right(keys, start_key)
+            else:
+                list_version = self._resource_version
+                position = bisect.bisect_left(keys, f"{namespace}/") if namespace else 0
+            end = bisect.bisect_left(keys, f"{namespace}0") if namespace else len(keys)
+            items = []
+            last_key = None
+            while position < end and (not limit or len(items) < limit):
+                key = keys[position]
+                stored = self._objects[resource][key]
+                if stored.matches(namespace, labels, node):
+                    items.append(stored.metadata if metadata_only else stored.full)
+                    last_key = key
+                position += 1
+        api_version, kind = LIST_KINDS[resource]
+        list_metadata = {'resourceVersion': str(list_version)}
+        if position < end:
+            list_metadata['continue'] = encode_continue(list_version, last_key)
+        if metadata_only:
+            api_version, kind = 'meta.k8s.io/v1', 'PartialObjectMetadataList'
+        head = json.dumps({'apiVersion': api_version, 'kind': kind, 'metadata': list_metadata}, separators=(',', ':')).encode()
+        return head[:-1] + b',"items":[' + b','.join(items) + b']}'
+
+    def watch(self, resource, namespace, query, stop):
+        """Yields the watch events of a resource as JSON lines until `timeoutSeconds` or `stop`
+
+        Without a resourceVersion (or with "0") the current objects are sent as ADDED events first, as the API server
+        does. A version older than the event log gets a single ERROR event with code 410.
+        """
+        labels, node = parse_selectors(query)
+        bookmarks = query.get('allowWatchBookmarks') in ('true', '1')
+        deadline = time.time() + float(query.get('timeoutSeconds') or 1800)
+        requested = query.get('resourceVersion')
+        with self._lock:
+            if requested in (None, '', '0'):
+                version = self._resource_version
+                initial = [stored.full for stored in self._objects[resource].values() if stored.matches(namespace, labels, node)]
+            elif int(requested) < self.compacted_version:
+                initial = None
+            else:
+                version = int(requested)
+                initial = []
+        if initial is None:
+            error = ApiError(410, 'Expired', f"too old resource version: {requested} ({self.compacted_version})")
+            yield json.dumps({'type': 'ERROR', 'object': error.status()}).encode() + b'\n'
+            return
+        for full in initial:
+            yield b'{"type":"ADDED","object":' + full + b'}\n'
+        next_bookmark = time.time() + BOOKMARK_INTERVAL if bookmarks else deadline
+        while not stop.is_set():
+            now = time.time()
+            if now >= deadline:
+                return
+            with self._lock:
+                if version < self.compacted_version:
+                    events = None
+                else:
+                    position = bisect.bisect_right(self._event_versions, version)
+                    events = self._events[position:]
+                    if not events and now < next_bookmark:
+                        self._changed.wait(min(deadline, next_bookmark) - now)
+                        continue
+            if events is None:
+                error = ApiError(410, 'Expired', f"too old resource version: {version} ({self.compacted_version})")
+                yield json.dumps({'type': 'ERROR', 'object': error.status()}).encode() + b'\n'
+                return
+            for event_version, event_resource, event_type, stored in events:
+                version = event_version
+                if event_resource == resource and stored.matches(namespace, labels, node):
+                    yield f'{{"type":"{event_type}","object":'.encode() + stored.full + b'}\n'
+            if bookmarks and time.time() >= next_bookmark:
+                next_bookmark = time.time() + BOOKMARK_INTERVAL
+                api_version, kind = LIST_KINDS[resource]
+                yield json.dumps({'type': 'BOOKMARK', 'object': {'kind': kind[:-4], 'apiVersion': api_version, 'metadata': {'resourceVersion': str(version)}}}).encode() + b'\n'
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; with Nagle's algorithm every small response would wait for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, code, body, content_type='application/json'):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return len(body)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def do_POST(self):
+        cluster = self.server.cluster
+        path = urlsplit(self.path).path
+        if path == '/_fake/stats/reset':
+            cluster.reset_stats()
+            result = {}
+        elif path == '/_fake/churn':
+            result = {'resource_version': cluster.churn(int(self.read_json().get('count', 1)))}
+        elif path == '/_fake/compact':
+            result = {'resource_version': cluster.compact()}
+        elif path == '/_fake/settings':
+            settings = self.read_json()
+            cluster.latency = float(settings.get('latency', cluster.latency))
+            cluster.forbid_cluster_certificates = bool(settings.get('forbid_cluster_certificates', cluster.forbid_cluster_certificates))
+            result = {}
+        else:
+            self.send_body(404, json.dumps(ApiError(404, 'NotFound', "unknown path").status()).encode())
+            return
+        self.send_body(200, json.dumps(result).encode())
+
+    def do_GET(self):
+        cluster = self.server.cluster
+        url = urlsplit(self.path)
+        if url.path == '/_fake/stats':
+            self.send_body(200, json.dumps(cluster.stats()).encode())
+            return
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if cluster.latency:
+            time.sleep(cluster.latency)
+        for pattern, resource in PATH_PATTERNS:
+            match = pattern.match(url.path)
+            if match:
+                break
+        else:
+            cluster.count('GET', 'unknown')
+            self.send_body(404, json.dumps(ApiError(404, 'NotFound', f"the server could not find the requested resource {url.path}").status()).encode())
+            return
+        namespace, name = match.groupdict().get('namespace'), match.group('name')
+        try:
+            if name:
+                verb, body = 'GET', cluster.get(resource, namespace, name)
+            elif query.get('watch') in ('true', '1'):
+                cluster.count('WATCH', resource)
+                self.stream(cluster.watch(resource, namespace, query, self.server.stopping))
+                return
+            else:
+                verb = 'LIST'
+                body = cluster.list(resource, namespace, query, 'as=PartialObjectMetadataList' in self.headers.get('Accept', ''))
+        except ApiError as error:
+            cluster.count('ERROR', f"{resource} {error.code}")
+            self.send_body(error.code, json.dumps(error.status()).encode())
+            return
+        cluster.count(verb, resource, self.send_body(200, body))
+
+    def stream(self, lines):
+        """Writes watch events with chunked transfer encoding, one chunk per event"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        sent = 0
+        try:
+            for line in lines:
+                self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+                self.wfile.flush()
+                sent += len(line)
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        finally:
+            lines.close()
+            self.server.cluster.count(None, None, sent)
+
+
+class FakeKubeApiServer:
+    """Serves a FakeCluster over HTTP on a background thread
+
+        with FakeKubeApiServer(FakeCluster(pods=5000)) as server:
+            eks = EksClient("fake", "us-east-1", endpoint=server.url, token="fake")
+
+    Args:
+        cluster (FakeCluster): The cluster to serve
+
+        host (string): Address to bind
+
+        port (int): Port to bind, 0 for any free port
+
+    """
+
+    def __init__(self, cluster, host='127.0.0.1', port=0):
+        self.cluster = cluster
+        self.httpd = ThreadingHTTPServer((host, port), FakeApiHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.cluster = cluster
+        self.httpd.stopping = threading.Event()
+        self.url = f"http://{host}:{self.httpd.server_address[1]}"
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-kube-apiserver", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.stopping.set()
+        with self.cluster._lock:
+            self.cluster._changed.notify_all()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a generated cluster with a fake Kubernetes API server.")
+    parser.add_argument('--namespaces', type=int, default=DEFAULT_NAMESPACES, help="Namespaces to generate")
+    parser.add_argument('--pods', type=int, default=DEFAULT_PODS, help="Pods to generate")
+    parser.add_argument('--certificates', type=int, default=DEFAULT_CERTIFICATES, help="cert-manager Certificates to generate")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the generator")
+    parser.add_argument('--event-window', type=int, default=EVENT_WINDOW, help="Watch events kept for resuming")
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="Delay before every response")
+    parser.add_argument('--host', default='127.0.0.1', help="Address to bind")
+    parser.add_argument('--port', type=int, default=8001, help="Port to bind, 0 for any free port")
+    args = parser.parse_args(argv)
+
+    cluster = FakeCluster(args.namespaces, args.pods, args.certificates, args.seed, args.event_window, args.latency_ms / 1000)
+    server = FakeKubeApiServer(cluster, args.host, args.port)
+    print(f"Serving {args.namespaces} namespaces, {args.pods} pods and {args.certificates} certificates on {server.url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
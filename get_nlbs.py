@@ -0,0 +1,132 @@
+"""Terraform external data source listing the tagged Network Load Balancers of an account
+
+Reads the query from stdin and writes `{"nlb_arns": "<arn>,<arn>,..."}`, like get_nlbs.sh did:
+
+    {"account_id": "111122223333", "role_name": "nlb-discovery", "tag_key": "monitoring", "tag_value": "enabled", "region": "us-west-2"}
+
+`region` may be a comma-separated list: every region is queried concurrently with the role's credentials assumed
+once through `credential_broker`. `tag_value` is a single value, matched as a whole even if it contains commas.
+GetResources is paged through, so large accounts are not truncated. An empty `role_name` uses the caller's own
+credentials.
+
+Results are cached on disk per query and caller identity for NLB_DISCOVERY_CACHE_TTL seconds (default 300, 0 disables
+it, or `cache_ttl` in the query), so repeated `terraform plan` runs skip the discovery, while another profile or role
+never reads a result it may not be allowed to see. The cache lives in NLB_DISCOVERY_CACHE_DIR,
+by default a directory under the system temporary directory.
+
+"""
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from credential_broker import CredentialBroker, role_arn
+
+SESSION_NAME = "terraform-nlb-discovery"
+RESOURCE_TYPE = "elasticloadbalancing:loadbalancer"
+NLB_ARN_MARKER = "loadbalancer/net/"
+PAGE_SIZE = 100
+CACHE_TTL = int(os.environ.get('NLB_DISCOVERY_CACHE_TTL', '300'))
+CACHE_DIR = os.environ.get('NLB_DISCOVERY_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'nlb-discovery-cache')
+
+
+def split_list(value):
+    return [item.strip() for item in (value or '').split(',') if item.strip()]
+
+
+def list_nlb_arns(session, tag_key, tag_value):
+    """Returns the ARNs of the Network Load Balancers carrying the tag in the session's region
+
+    Args:
+        session (Session): A boto3 session for the account and region
+
+        tag_key (string): The tag key
+
+        tag_value (string): The tag value
+
+    """
+    paginator = session.client('resourcegroupstaggingapi').get_paginator('get_resources')
+    pages = paginator.paginate(
+        ResourceTypeFilters=[RESOURCE_TYPE],
+        TagFilters=[{'Key': tag_key, 'Values': [tag_value]}],
+        ResourcesPerPage=PAGE_SIZE,
+    )
+    return [resource['ResourceARN'] for page in pages for resource in page['ResourceTagMappingList'] if NLB_ARN_MARKER in resource['ResourceARN']]
+
+
+def discover(query, broker=None):
+    """Lists the tagged NLBs of every region of the query concurrently
+
+    Returns:
+        dict: `nlb_arns`, the sorted ARNs joined with commas
+
+    """
+    regions = split_list(query['region'])
+    arn = role_arn(query['account_id'], query['role_name']) if query.get('role_name') else None
+    broker = broker or CredentialBroker(session_name=SESSION_NAME)
+    sessions = broker.sessions([(arn, region) for region in regions])
+    with ThreadPoolExecutor(max_workers=max(1, len(regions))) as executor:
+        found = executor.map(lambda region: list_nlb_arns(sessions[(arn, region)], query['tag_key'], query['tag_value']), regions)
+        arns = sorted(set(nlb_arn for region_arns in found for nlb_arn in region_arns))
+    return {'nlb_arns': ','.join(arns)}
+
+
+def caller_identity(broker):
+    """Returns the ARN of the credentials running the discovery, which scope its cache entries"""
+    return broker.sts.get_caller_identity()['Arn']
+
+
+def cache_path(query, identity):
+    key = hashlib.sha256(json.dumps({'query': query, 'identity': identity}, sort_keys=True).encode()).hexdigest()
+    return os.path.join(CACHE_DIR, f"{key}.json")
+
+
+def load_cached(query, identity, ttl):
+    try:
+        with open(cache_path(query, identity)) as cache_file:
+            cached = json.load(cache_file)
+    except (OSError, ValueError):
+        return None
+    if time.time() - cached.get('created', 0) >= ttl:
+        return None
+    return cached.get('result')
+
+
+def save_cached(query, identity, result):
+    os.makedirs(CACHE_DIR, mode=0o700, exist_ok=True)
+    path = cache_path(query, identity)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as cache_file:
+        json.dump({'created': time.time(), 'result': result}, cache_file)
+    os.replace(tmp_path, path)
+
+
+def main():
+    query = json.load(sys.stdin)
+    ttl = query.pop('cache_ttl', None)
+    ttl = CACHE_TTL if ttl in (None, '') else int(ttl)
+    broker = CredentialBroker(session_name=SESSION_NAME)
+    # AWS_PROFILE and the environment credentials decide who the caller is, so the identity is resolved every run
+    identity = caller_identity(broker) if ttl > 0 else None
+    result = load_cached(query, identity, ttl) if ttl > 0 else None
+    if result is None:
+        result = discover(query, broker)
+        if ttl > 0:
+            try:
+                save_cached(query, identity, result)
+            except OSError as e:
+                print(f"Could not cache the NLB discovery: {e}", file=sys.stderr)
+    json.dump(result, sys.stdout)
+    return 0
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    except Exception as e:
+        # Terraform shows stderr when the program exits non-zero
+        print(f"NLB discovery failed: {type(e).__name__}: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,374 @@
+"""Benchmarks the EKS-facing scripts against the fake Kubernetes API server
+
+Starts `fake_kube_apiserver.py` in a child process with the requested scale and latency, then runs the listing and
+evaluation paths of `eks.py` and `awsconfig/lambda_handler.py` against it. For every scenario it reports wall time,
+API requests by verb and resource, bytes received and the peak Python memory of the client (tracemalloc), so a
+change that makes a path issue more requests or hold more of the cluster in memory shows up before production.
+
+    python kube_benchmark.py --namespaces 5000 --pods 100000 --certificates 20000 --latency-ms 5
+    python kube_benchmark.py --scenarios eks-inventory,awsconfig-evaluate --json report.json
+
+The server runs in its own process, so its objects do not count towards the peak memory. tracemalloc slows
+allocation-heavy code down; use --no-memory for wall times without it. AWS Config is replaced by an in-process fake
+that counts PutEvaluations calls; the scenarios whose dependencies (requests, boto3, kubernetes, eks_token) are not
+installed are reported as skipped.
+
+"""
+import argparse
+import importlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.request
+from collections import Counter
+from types import SimpleNamespace
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FAKE_SERVER = os.path.join(HERE, 'fake_kube_apiserver.py')
+AWSCONFIG_DIR = os.path.join(HERE, 'awsconfig')
+CATCH_UP_TIMEOUT = 120
+SCENARIOS = (
+    'eks-namespaces',
+    'eks-pods',
+    'eks-inventory',
+    'eks-informer',
+    'awsconfig-list',
+    'awsconfig-evaluate',
+)
+
+
+class FakeServerProcess:
+    """Runs fake_kube_apiserver.py in a child process and drives its /_fake/ control endpoints
+
+    Args:
+        namespaces (int): Namespaces to generate
+
+        pods (int): Pods to generate
+
+        certificates (int): Certificates to generate
+
+        latency (float): Seconds the server waits before every response
+
+    """
+
+    def __init__(self, namespaces, pods, certificates, latency=0.0):
+        self.command = [
+            sys.executable, FAKE_SERVER, '--port', '0',
+            '--namespaces', str(namespaces), '--pods', str(pods), '--certificates', str(certificates),
+            '--latency-ms', str(latency * 1000),
+        ]
+        self.process = None
+        self.url = None
+
+    def __enter__(self):
+        self.process = subprocess.Popen(self.command, stdout=subprocess.PIPE, text=True)
+        banner = self.process.stdout.readline()
+        if not banner:
+            raise RuntimeError(f"Fake API server exited with {self.process.wait()}")
+        self.url = banner.split()[-1]
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.process.terminate()
+        self.process.wait()
+        return False
+
+    def call(self, method, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(self.url + path, data=data, method=method, headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request) as response:
+            return json.load(response)
+
+    def stats(self):
+        return self.call('GET', '/_fake/stats')
+
+    def reset_stats(self):
+        self.call('POST', '/_fake/stats/reset', {})
+
+    def churn(self, count):
+        return self.call('POST', '/_fake/churn', {'count': count})['resource_version']
+
+    def compact(self):
+        return self.call('POST', '/_fake/compact', {})['resource_version']
+
+    def settings(self, **settings):
+        self.call('POST', '/_fake/settings', settings)
+
+
+class FakeConfigService:
+    """Stands in for the boto3 AWS Config client; counts PutEvaluations calls and evaluations"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self.evaluations = Counter()
+        self._lock = threading.Lock()
+
+    def put_evaluations(self, Evaluations, ResultToken):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+            self.evaluations.update(evaluation['ComplianceType'] for evaluation in Evaluations)
+        return {'FailedEvaluations': []}
+
+
+class FakeBoto3:
+    """Replaces the `boto3` module of the Lambda handler, returning the fake AWS Config client"""
+
+    def __init__(self, config_service):
+        self.config_service = config_service
+
+    def client(self, service_name, **kwargs):
+        if service_name != 'config':
+            raise ValueError(f"No fake for {service_name}")
+        return self.config_service
+
+
+def measure(server, run, trace_memory=True):
+    """Runs one scenario and measures it
+
+    Args:
+        server (FakeServerProcess): The server the scenario talks to
+
+        run (callable): The scenario; its return value is reported as `result`
+
+        trace_memory (boolean): Record the peak Python memory with tracemalloc
+
+    Returns:
+        dict: `wall_s`, `requests` by verb and resource, `request_count`, `bytes_received`, `peak_memory_mb` and
+        `result`
+
+    """
+    server.reset_stats()
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        result = run()
+    finally:
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        if trace_memory:
+            tracemalloc.stop()
+    stats = server.stats()
+    return {
+        'wall_s': elapsed,
+        'requests': stats['requests'],
+        'request_count': sum(stats['requests'].values()),
+        'bytes_received': stats['bytes_sent'],
+        'peak_memory_mb': peak / 1048576.0 if peak is not None else None,
+        'result': result,
+    }
+
+
+def wait_for_version(informer, resource_version, timeout=CATCH_UP_TIMEOUT):
+    """Waits until the informer has applied every event up to `resource_version`; returns the seconds it took"""
+    started = time.perf_counter()
+    while int(informer.resource_version or 0) < resource_version:
+        if time.perf_counter() - started > timeout:
+            raise RuntimeError(f"Informer stuck at resourceVersion {informer.resource_version}, expected {resource_version}")
+        time.sleep(0.005)
+    return time.perf_counter() - started
+
+
+def eks_scenarios(server, concurrency, churn):
+    """Builds the eks.py scenarios: name to a callable returning the scenario result"""
+    import eks
+
+    def client():
+        return eks.EksClient("fake", "us-east-1", endpoint=server.url, token="fake")
+
+    def namespaces():
+        with client() as eks_client:
+            return {'namespaces': sum(1 for _ in eks_client.iter_list("/api/v1/namespaces", metadata_only=True))}
+
+    def pods():
+        with client() as eks_client:
+            return {'pods': sum(1 for _ in eks_client.iter_list("/api/v1/pods"))}
+
+    def inventory(workers):
+        def run():
+            with client() as eks_client:
+                counts = eks_client.pod_inventory(concurrency=workers)
+            return {'namespaces': len(counts), 'pods': sum(sum(phases.values()) for phases in counts.values())}
+        return run
+
+    def informer():
+        with client() as eks_client:
+            pods = eks.Informer(eks_client, "/api/v1/pods")
+            started = time.perf_counter()
+            pods.start()
+            try:
+                pods.wait_synced()
+                synced = time.perf_counter() - started
+                catch_up = wait_for_version(pods, server.churn(churn))
+                relist = wait_for_version(pods, server.compact())
+                return {'objects': len(pods), 'sync_s': synced, 'events': churn, 'catch_up_s': catch_up, 'relist_s': relist, 'relists': pods.relists}
+            finally:
+                pods.stop()
+
+    return {
+        'eks-namespaces': namespaces,
+        'eks-pods': pods,
+        'eks-inventory serial': inventory(1),
+        f"eks-inventory concurrency {concurrency}": inventory(concurrency),
+        'eks-informer': informer,
+    }
+
+
+def load_lambda_handler():
+    """Imports awsconfig/lambda_handler.py as the Lambda runtime would, with its directory on the path"""
+    if AWSCONFIG_DIR not in sys.path:
+        sys.path.insert(0, AWSCONFIG_DIR)
+    return importlib.import_module('lambda_handler')
+
+
+def awsconfig_scenarios(server, config_latency):
+    """Builds the awsconfig/lambda_handler.py scenarios: name to a callable returning the scenario result"""
+    module = load_lambda_handler()
+    from kubernetes import client
+    # The client imports its API classes on first use, which would otherwise dominate the first listing
+    client.CoreV1Api, client.CustomObjectsApi
+
+    def api_client():
+        configuration = client.Configuration()
+        configuration.host = server.url
+        return client.ApiClient(configuration)
+
+    def fake_cluster_api_client(cluster):
+        # The handler removes the CA file once the cluster is listed
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.crt') as ca_file:
+            pass
+        return api_client(), ca_file.name
+
+    def list_certificates(forbid_cluster_scope):
+        def run():
+            server.settings(forbid_cluster_certificates=forbid_cluster_scope)
+            try:
+                kube = api_client()
+                return {'certificates': sum(1 for _ in module.iter_certificates(client.CoreV1Api(kube), client.CustomObjectsApi(kube)))}
+            finally:
+                server.settings(forbid_cluster_certificates=False)
+        return run
+
+    snapshot_dir = tempfile.mkdtemp(prefix='kube-benchmark-')
+    module.CLUSTERS = [{'name': 'fake', 'region': 'us-east-1'}]
+    module.cluster_api_client = fake_cluster_api_client
+    module.SNAPSHOT_BUCKET = None
+    module.SNAPSHOT_FILE = os.path.join(snapshot_dir, 'snapshot.json')
+
+    def evaluate():
+        config_service = FakeConfigService(config_latency)
+        module.boto3 = FakeBoto3(config_service)
+        response = module.lambda_handler({'resultToken': 'benchmark'}, SimpleNamespace(function_name='benchmark'))
+        return {'message': json.loads(response['body']), 'put_evaluations': config_service.calls, 'evaluations': dict(config_service.evaluations)}
+
+    return {
+        'awsconfig-list': list_certificates(False),
+        'awsconfig-list per namespace': list_certificates(True),
+        'awsconfig-evaluate full': evaluate,
+        'awsconfig-evaluate incremental': evaluate,
+    }
+
+
+def run_benchmark(namespaces, pods, certificates, latency=0.0, scenarios=SCENARIOS, concurrency=8, churn=1000, config_latency=0.0, trace_memory=True):
+    """Runs the selected scenarios against a fresh fake API server
+
+    Args:
+        namespaces (int): Namespaces to generate
+
+        pods (int): Pods to generate
+
+        certificates (int): Certificates to generate
+
+        latency (float): Seconds the API server waits before every response
+
+        scenarios (iterable): Scenario groups to run, from SCENARIOS
+
+        concurrency (int): Namespaces listed in parallel by the concurrent pod inventory
+
+        churn (int): Pod changes the informer has to catch up with
+
+        config_latency (float): Seconds every PutEvaluations call takes
+
+        trace_memory (boolean): Record peak memory with tracemalloc
+
+    Returns:
+        dict: The report
+
+    """
+    report = {
+        'namespaces': namespaces,
+        'pods': pods,
+        'certificates': certificates,
+        'latency_ms': latency * 1000,
+        'trace_memory': trace_memory,
+        'scenarios': {},
+        'skipped': {},
+    }
+    with FakeServerProcess(namespaces, pods, certificates, latency) as server:
+        builders = (('eks-', lambda: eks_scenarios(server, concurrency, churn)), ('awsconfig-', lambda: awsconfig_scenarios(server, config_latency)))
+        for prefix, build in builders:
+            selected = [scenario for scenario in scenarios if scenario.startswith(prefix)]
+            if not selected:
+                continue
+            try:
+                runs = build()
+            except ImportError as e:
+                for scenario in selected:
+                    report['skipped'][scenario] = f"{type(e).__name__}: {e}"
+                continue
+            for name, run in runs.items():
+                if name.split(' ')[0] in selected:
+                    report['scenarios'][name] = measure(server, run, trace_memory)
+    return report
+
+
+def print_report(report):
+    print("%d namespaces, %d pods, %d certificates, API latency %.0fms%s" % (
+        report['namespaces'], report['pods'], report['certificates'], report['latency_ms'],
+        "" if report['trace_memory'] else ", memory not traced"))
+    for name, measured in report['scenarios'].items():
+        peak = "%8.1fMB" % measured['peak_memory_mb'] if measured['peak_memory_mb'] is not None else "       -  "
+        print("  %-36s wall %8.3fs  requests %6d  received %9.1fMB  peak %s  %s" % (
+            name, measured['wall_s'], measured['request_count'], measured['bytes_received'] / 1048576.0, peak,
+            json.dumps(measured['result'], sort_keys=True)))
+    for name, reason in report['skipped'].items():
+        print("  %-36s skipped, %s" % (name, reason))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark eks.py and the cert-manager Config rule against a fake Kubernetes API server.")
+    parser.add_argument('--namespaces', type=int, default=500, help="Namespaces to generate")
+    parser.add_argument('--pods', type=int, default=10000, help="Pods to generate")
+    parser.add_argument('--certificates', type=int, default=2000, help="cert-manager Certificates to generate")
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="Delay of the API server before every response")
+    parser.add_argument('--config-latency-ms', type=float, default=0.0, help="Duration of every PutEvaluations call")
+    parser.add_argument('--concurrency', type=int, default=8, help="Namespaces listed in parallel by the concurrent pod inventory")
+    parser.add_argument('--churn', type=int, default=1000, help="Pod changes the informer has to catch up with")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="Comma-separated scenarios, from: %s" % ', '.join(SCENARIOS))
+    parser.add_argument('--no-memory', action='store_true', help="Do not trace memory, for undisturbed wall times")
+    parser.add_argument('--json', help="Also write the report to this file")
+    args = parser.parse_args(argv)
+
+    scenarios = [scenario.strip() for scenario in args.scenarios.split(',') if scenario.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error("unknown scenarios: %s" % ', '.join(sorted(unknown)))
+    report = run_benchmark(args.namespaces, args.pods, args.certificates, args.latency_ms / 1000, scenarios,
+                           args.concurrency, args.churn, args.config_latency_ms / 1000, not args.no_memory)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
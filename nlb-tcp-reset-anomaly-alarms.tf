@@ -18,7 +18,7 @@ locals {
 data "external" "nlbs_by_account" {
   for_each = toset(local.source_account_ids)
   
-  program = ["bash", "${path.module}/get_nlbs.sh"]
+  program = ["python3", "${path.module}/get_nlbs.py"]
   
   query = {
     account_id         = each.key
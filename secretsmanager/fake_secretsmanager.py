@@ -0,0 +1,251 @@
+import copy
+import json
+import secrets
+import string
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+
+class ResourceNotFoundException(Exception):
+    """Raised when a secret, version or stage cannot be found"""
+
+
+class InvalidRequestException(Exception):
+    """Raised when a request conflicts with the state of the secret"""
+
+
+class FakeExceptions:
+    """Mirrors the `client.exceptions` namespace of a boto3 Secrets Manager client"""
+    ResourceNotFoundException = ResourceNotFoundException
+    InvalidRequestException = InvalidRequestException
+
+
+class FakeSecretsManager:
+    """In-process stand-in for the boto3 Secrets Manager client
+
+    Implements the subset of the API used by the rotation Lambdas and tools in this directory, with the same
+    staging label semantics: putting or moving a label takes it away from whichever version held it, and moving
+    AWSCURRENT marks the version that held it AWSPREVIOUS. Every call is counted in `call_counts` and can be
+    delayed by `latency` seconds to model a remote endpoint. The client is safe to share between threads.
+
+    """
+    exceptions = FakeExceptions
+
+    def __init__(self, region='us-east-1', account_id='123456789012', latency=0.0):
+        self.region = region
+        self.account_id = account_id
+        self.latency = latency
+        self.call_counts = Counter()
+        self._secrets = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        """Builds a fake seeded from a JSON file
+
+        The file maps secret names to either a secret dictionary, or an object with `SecretString` (dict or string),
+        optional `Tags` and optional `RotationEnabled`.
+
+        Args:
+            path (string): Path to the seed file
+
+        Returns:
+            FakeSecretsManager: The seeded fake
+
+        """
+        with open(path) as seed_file:
+            seeds = json.load(seed_file)
+        fake = cls(**kwargs)
+        for name, seed in seeds.items():
+            if 'SecretString' not in seed:
+                seed = {'SecretString': seed}
+            secret_string = seed['SecretString']
+            if not isinstance(secret_string, str):
+                secret_string = json.dumps(secret_string)
+            fake.create_secret(Name=name, SecretString=secret_string, Tags=seed.get('Tags', []))
+            fake._resolve(name)['RotationEnabled'] = seed.get('RotationEnabled', True)
+        fake.call_counts.clear()
+        return fake
+
+    def _call(self, operation):
+        self.call_counts[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _resolve(self, secret_id):
+        secret = self._secrets.get(secret_id)
+        if secret is None:
+            for candidate in self._secrets.values():
+                if candidate['ARN'] == secret_id:
+                    return candidate
+            raise ResourceNotFoundException("Secrets Manager can't find the specified secret %s." % secret_id)
+        return secret
+
+    def _move_stage(self, secret, stage, version_id):
+        for stages in secret['Versions'].values():
+            if stage in stages['VersionStages']:
+                stages['VersionStages'].remove(stage)
+        secret['Versions'][version_id]['VersionStages'].append(stage)
+
+    def create_secret(self, Name, SecretString, Tags=None, ClientRequestToken=None, **kwargs):
+        self._call('CreateSecret')
+        with self._lock:
+            if Name in self._secrets:
+                raise InvalidRequestException("A secret with the name %s already exists." % Name)
+            suffix = ''.join(secrets.choice(string.ascii_letters) for _ in range(6))
+            arn = "arn:aws:secretsmanager:%s:%s:secret:%s-%s" % (self.region, self.account_id, Name, suffix)
+            version_id = ClientRequestToken or str(uuid.uuid4())
+            self._secrets[Name] = {
+                'ARN': arn,
+                'Name': Name,
+                'RotationEnabled': False,
+                'Tags': list(Tags or []),
+                'Versions': {version_id: {'SecretString': SecretString, 'VersionStages': ['AWSCURRENT'], 'CreatedDate': datetime.now(timezone.utc)}},
+            }
+            return {'ARN': arn, 'Name': Name, 'VersionId': version_id}
+
+    def describe_secret(self, SecretId):
+        self._call('DescribeSecret')
+        with self._lock:
+            secret = self._resolve(SecretId)
+            response = {
+                'ARN': secret['ARN'],
+                'Name': secret['Name'],
+                'RotationEnabled': secret['RotationEnabled'],
+                'VersionIdsToStages': {version_id: list(version['VersionStages']) for version_id, version in secret['Versions'].items() if version['VersionStages']},
+            }
+            if secret['Tags']:
+                response['Tags'] = copy.deepcopy(secret['Tags'])
+            return response
+
+    def get_secret_value(self, SecretId, VersionId=None, VersionStage=None):
+        self._call('GetSecretValue')
+        with self._lock:
+            secret = self._resolve(SecretId)
+            if VersionId is None and VersionStage is None:
+                VersionStage = 'AWSCURRENT'
+            for version_id, version in secret['Versions'].items():
+                if VersionId is not None and version_id != VersionId:
+                    continue
+                if VersionStage is not None and VersionStage not in version['VersionStages']:
+                    continue
+                if version['SecretString'] is None:
+                    break
+                return {
+                    'ARN': secret['ARN'],
+                    'Name': secret['Name'],
+                    'VersionId': version_id,
+                    'SecretString': version['SecretString'],
+                    'VersionStages': list(version['VersionStages']),
+                    'CreatedDate': version['CreatedDate'],
+                }
+            raise ResourceNotFoundException("Secrets Manager can't find the specified secret value for VersionId: %s, VersionStage: %s" % (VersionId, VersionStage))
+
+    def put_secret_value(self, SecretId, ClientRequestToken, SecretString, VersionStages=None):
+        self._call('PutSecretValue')
+        with self._lock:
+            secret = self._resolve(SecretId)
+            existing = secret['Versions'].get(ClientRequestToken)
+            if existing is not None and existing['SecretString'] is None:
+                existing['SecretString'] = SecretString
+            elif existing is not None:
+                if existing['SecretString'] != SecretString:
+                    raise InvalidRequestException("Version %s already exists with a different value." % ClientRequestToken)
+            else:
+                secret['Versions'][ClientRequestToken] = {'SecretString': SecretString, 'VersionStages': [], 'CreatedDate': datetime.now(timezone.utc)}
+            for stage in VersionStages or ['AWSCURRENT']:
+                if stage == 'AWSCURRENT':
+                    self._promote(secret, ClientRequestToken)
+                else:
+                    self._move_stage(secret, stage, ClientRequestToken)
+            return {'ARN': secret['ARN'], 'Name': secret['Name'], 'VersionId': ClientRequestToken, 'VersionStages': list(secret['Versions'][ClientRequestToken]['VersionStages'])}
+
+    def _promote(self, secret, version_id):
+        for other_id, other in secret['Versions'].items():
+            if other_id != version_id and 'AWSCURRENT' in other['VersionStages']:
+                self._move_stage(secret, 'AWSPREVIOUS', other_id)
+        self._move_stage(secret, 'AWSCURRENT', version_id)
+
+    def update_secret_version_stage(self, SecretId, VersionStage, MoveToVersionId=None, RemoveFromVersionId=None):
+        self._call('UpdateSecretVersionStage')
+        with self._lock:
+            secret = self._resolve(SecretId)
+            if RemoveFromVersionId is not None:
+                stages = secret['Versions'].get(RemoveFromVersionId, {}).get('VersionStages', [])
+                if VersionStage not in stages:
+                    raise InvalidRequestException("Version %s does not have stage %s." % (RemoveFromVersionId, VersionStage))
+                if MoveToVersionId is None:
+                    stages.remove(VersionStage)
+            if MoveToVersionId is not None:
+                if MoveToVersionId not in secret['Versions']:
+                    raise ResourceNotFoundException("Version %s not found for secret %s." % (MoveToVersionId, SecretId))
+                if VersionStage == 'AWSCURRENT':
+                    self._promote(secret, MoveToVersionId)
+                else:
+                    self._move_stage(secret, VersionStage, MoveToVersionId)
+            return {'ARN': secret['ARN'], 'Name': secret['Name']}
+
+    def list_secret_version_ids(self, SecretId, IncludeDeprecated=False, **kwargs):
+        self._call('ListSecretVersionIds')
+        with self._lock:
+            secret = self._resolve(SecretId)
+            versions = [
+                {'VersionId': version_id, 'VersionStages': list(version['VersionStages']), 'CreatedDate': version['CreatedDate']}
+                for version_id, version in secret['Versions'].items()
+                if IncludeDeprecated or version['VersionStages']
+            ]
+            return {'ARN': secret['ARN'], 'Name': secret['Name'], 'Versions': versions}
+
+    def list_secrets(self, **kwargs):
+        self._call('ListSecrets')
+        with self._lock:
+            return {'SecretList': [{'ARN': secret['ARN'], 'Name': secret['Name'], 'RotationEnabled': secret['RotationEnabled']} for secret in self._secrets.values()]}
+
+    def tag_resource(self, SecretId, Tags):
+        self._call('TagResource')
+        with self._lock:
+            secret = self._resolve(SecretId)
+            keys = set(tag['Key'] for tag in Tags)
+            secret['Tags'] = [tag for tag in secret['Tags'] if tag['Key'] not in keys] + list(Tags)
+
+    def rotate_secret(self, SecretId, ClientRequestToken=None, **kwargs):
+        """Starts a rotation the way Secrets Manager does before invoking the rotation Lambda
+
+        A new version without a value is staged AWSPENDING, so the Lambda's version checks pass and its createSecret
+        step finds no pending value yet. The rotation Lambda itself is not invoked.
+
+        """
+        self._call('RotateSecret')
+        with self._lock:
+            secret = self._resolve(SecretId)
+            secret['RotationEnabled'] = True
+            version_id = ClientRequestToken or str(uuid.uuid4())
+            if version_id not in secret['Versions']:
+                secret['Versions'][version_id] = {'SecretString': None, 'VersionStages': [], 'CreatedDate': datetime.now(timezone.utc)}
+                self._move_stage(secret, 'AWSPENDING', version_id)
+            return {'ARN': secret['ARN'], 'Name': secret['Name'], 'VersionId': version_id}
+
+    def get_random_password(self, PasswordLength=32, ExcludeCharacters='', ExcludeNumbers=False, ExcludePunctuation=False,
+                            ExcludeUppercase=False, ExcludeLowercase=False, IncludeSpace=False, RequireEachIncludedType=True):
+        self._call('GetRandomPassword')
+        classes = []
+        if not ExcludeLowercase:
+            classes.append(string.ascii_lowercase)
+        if not ExcludeUppercase:
+            classes.append(string.ascii_uppercase)
+        if not ExcludeNumbers:
+            classes.append(string.digits)
+        if not ExcludePunctuation:
+            classes.append(string.punctuation)
+        if IncludeSpace:
+            classes.append(' ')
+        classes = [''.join(c for c in chars if c not in ExcludeCharacters) for chars in classes]
+        classes = [chars for chars in classes if chars]
+        alphabet = ''.join(classes)
+        while True:
+            password = ''.join(secrets.choice(alphabet) for _ in range(PasswordLength))
+            if not RequireEachIncludedType or all(any(c in chars for c in password) for chars in classes):
+                return {'RandomPassword': password}
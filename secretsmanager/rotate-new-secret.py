@@ -1,23 +1,68 @@
 import logging
 import json
+import os
 import boto3
 import sys
-import psycopg2  # Example for PostgreSQL; change to your DB driver as needed
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+import threading
+from contextlib import closing
 from botocore.exceptions import ClientError
+from rotation_tracing import tracer
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# The DB driver is imported on the first connection, so createSecret and warm invocations that never reach the
+# database do not pay for it. 'psycopg2' needs libpq in the deployment package; 'pg8000' is pure Python.
+DB_DRIVER = os.environ.get('DB_DRIVER', 'psycopg2')
+
+# Module-scoped so that warm containers reuse the driver and the Secrets Manager client with its connection pool
+db_connect = None
+service_client = None
+service_client_lock = threading.Lock()
+
+def get_service_client():
+    """Return the Secrets Manager client for the Lambda's region, creating it on first use."""
+    global service_client
+    with service_client_lock:
+        if service_client is None:
+            # SECRETS_MANAGER_ENDPOINT overrides the regional endpoint, e.g. with a VPC endpoint
+            service_client = tracer.instrument_client(boto3.client(
+                'secretsmanager',
+                endpoint_url=os.environ.get('SECRETS_MANAGER_ENDPOINT'),
+                region_name=os.environ.get('AWS_REGION')
+            ))
+    return service_client
+
+def get_db_connect():
+    """Import the driver selected by DB_DRIVER on first use and return its connect function."""
+    global db_connect
+    if db_connect is None:
+        if DB_DRIVER == 'psycopg2':
+            import psycopg2
+            db_connect = lambda host, port, dbname, user, password: psycopg2.connect(host=host, port=port, dbname=dbname, user=user, password=password)
+        elif DB_DRIVER == 'pg8000':
+            import pg8000.dbapi
+            db_connect = lambda host, port, dbname, user, password: pg8000.dbapi.connect(host=host, port=int(port), database=dbname, user=user, password=password, ssl_context=True)
+        else:
+            raise ValueError(f"Unsupported DB_DRIVER {DB_DRIVER}, expected 'psycopg2' or 'pg8000'")
+    return db_connect
+
+def quote_identifier(name):
+    """Quote a PostgreSQL identifier."""
+    return '"%s"' % name.replace('"', '""')
+
+def quote_literal(value):
+    """Quote a PostgreSQL string literal, independently of standard_conforming_strings."""
+    return "E'%s'" % value.replace('\\', '\\\\').replace("'", "''")
+
 def get_secret_dict(service_client, arn, stage, token=None):
     """Retrieve the secret dictionary for a given stage."""
     required_fields = ['host', 'port', 'dbname', 'username', 'password']
     try:
-        secret_value = service_client.get_secret_value(
-            SecretId=arn,
-            VersionId=token if token else None,
-            VersionStage=stage
-        ) if token or stage != 'AWSCURRENT' else service_client.get_secret_value(SecretId=arn)
+        kwargs = {'SecretId': arn, 'VersionStage': stage}
+        if token:
+            kwargs['VersionId'] = token
+        secret_value = service_client.get_secret_value(**kwargs)
         secret = json.loads(secret_value['SecretString'])
         for field in required_fields:
             if field not in secret:
@@ -30,34 +75,48 @@ def get_secret_dict(service_client, arn, stage, token=None):
 def get_connection(secret_dict):
     """Establish a database connection using the secret dictionary."""
     try:
-        conn = psycopg2.connect(
-            host=secret_dict['host'],
-            port=secret_dict['port'],
-            dbname=secret_dict['dbname'],
-            user=secret_dict['username'],
-            password=secret_dict['password']
-        )
-        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-        return conn
+        connect = get_db_connect()
+        with tracer.span('db.connect'):
+            conn = connect(
+                host=secret_dict['host'],
+                port=secret_dict['port'],
+                dbname=secret_dict['dbname'],
+                user=secret_dict['username'],
+                password=secret_dict['password']
+            )
+        conn.autocommit = True
+        return tracer.wrap_connection(conn)
     except Exception as e:
         logger.error(f"get_connection: Failed to connect to database: {str(e)}")
         raise
 
+# Creates the user only if it is missing. The values travel as transaction-local settings of the same implicit
+# transaction, so the check, the quoting and the CREATE USER all happen server-side in a single round trip. The
+# settings are inlined as quoted literals rather than bound: pg8000 cannot bind parameters in a multi-statement
+# query, and without parameters neither driver %-formats the query.
+CREATE_USER_SQL = """
+SELECT set_config('rotation.username', {username}, true), set_config('rotation.password', {password}, true), set_config('rotation.privileges', {privileges}, true);
+DO $create_user$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_roles WHERE rolname = current_setting('rotation.username')) THEN
+        EXECUTE format('CREATE USER %I WITH PASSWORD %L ', current_setting('rotation.username'), current_setting('rotation.password'))
+            || current_setting('rotation.privileges');
+    END IF;
+END
+$create_user$;
+"""
+
 def create_user(conn, username, password, privileges='LOGIN'):
-    """Create a new database user."""
-    with conn.cursor() as cur:
-        cur.execute("SELECT 1 FROM pg_user WHERE usename = %s", (username,))
-        if cur.fetchone():
-            logger.info(f"User {username} already exists")
-            return
-        cur.execute(f"CREATE USER {username} WITH PASSWORD %s {privileges}", (password,))
-        logger.info(f"Created user {username}")
+    """Create a new database user if it does not exist yet."""
+    with closing(conn.cursor()) as cur:
+        cur.execute(CREATE_USER_SQL.format(username=quote_literal(username), password=quote_literal(password), privileges=quote_literal(privileges)))
+        logger.info(f"Ensured user {username} exists")
 
 def drop_user(conn, username):
     """Drop a database user, ignoring if they don't exist."""
     try:
-        with conn.cursor() as cur:
-            cur.execute("DROP USER IF EXISTS %s", (username,))
+        with closing(conn.cursor()) as cur:
+            cur.execute(f"DROP USER IF EXISTS {quote_identifier(username)}")
             logger.info(f"Dropped user {username}")
     except Exception as e:
         logger.error(f"Failed to drop user {username}: {str(e)}")
@@ -91,7 +150,7 @@ def test_secret(service_client, arn, token):
         try:
             secret_dict = get_secret_dict(service_client, arn, stage)
             with get_connection(secret_dict) as conn:
-                with conn.cursor() as cur:
+                with closing(conn.cursor()) as cur:
                     cur.execute("SELECT 1")
                     logger.info(f"testSecret: Successfully tested {stage} credentials")
         except Exception as e:
@@ -109,11 +168,13 @@ def finish_secret(service_client, arn, token):
     # Here, we assume the previous username is stored in the secret or can be derived
     previous_username = current_dict['username']
     # Promote pending to current
+    versions = service_client.describe_secret(SecretId=arn)['VersionIdsToStages']
+    current_version = next(version for version, stages in versions.items() if "AWSCURRENT" in stages)
     service_client.update_secret_version_stage(
         SecretId=arn,
         VersionStage="AWSCURRENT",
         MoveToVersionId=token,
-        RemoveFromVersionId=service_client.describe_secret(SecretId=arn)['VersionIdsToStages'][arn][0]
+        RemoveFromVersionId=current_version
     )
     # Remove previous user
     try:
@@ -134,9 +195,9 @@ def lambda_handler(event, context):
     step = event['Step']
     rotation_token = event.get('RotationToken', None)  # For cross-account rotation support
 
-    service_client = boto3.client('secretsmanager', endpoint_url="https://secretsmanager.us-east-1.amazonaws.com")
-    # Adjust region as needed
+    service_client = get_service_client()
 
+    tracer.start_step(step, arn)
     try:
         if step == "createSecret":
             # For createSecret step, you might generate a new password and put it in AWSPENDING
@@ -154,3 +215,5 @@ def lambda_handler(event, context):
     except Exception as e:
         logger.error(f"lambda_handler: Error during rotation step {step}: {str(e)}")
         raise
+    finally:
+        tracer.emit()
@@ -1,23 +1,142 @@
 import boto3
+import collections
 import json
 import logging
 import os
-import pg
-import pgdb
+import re
 import time
 import random
+import secrets
+import socket
 import string
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from rotation_tracing import tracer
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 MAX_RDS_DB_INSTANCE_ARN_LENGTH = 256
 
+# The PostgreSQL driver is imported on the first connection, so steps and warm invocations that never reach the
+# database do not pay for it. 'pgdb' (PyGreSQL) needs libpq in the deployment package; 'pg8000' is pure Python.
+DB_DRIVER = os.environ.get('DB_DRIVER', 'pgdb')
+# pg8000 only: whether connections must use TLS
+DB_SSL = os.environ.get('DB_SSL', 'true').lower() in ('1', 'true', 'yes')
+# pg8000 only: the server ends any statement running longer than this many seconds. pg8000 applies one socket timeout
+# to the whole connection, so it is set above this bound and a long statement fails with a server error, not a hang.
+DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', '300'))
+
+# RDS endpoint discovery is cached per DB Instance/Cluster ARN, both in memory and in /tmp so that warm
+# containers skip the DescribeDBInstances/DescribeDBClusters calls on every rotation step.
+RDS_ENDPOINT_CACHE_FILE = os.environ.get('RDS_ENDPOINT_CACHE_FILE', '/tmp/rds_endpoint_cache.json')
+RDS_ENDPOINT_CACHE_TTL = int(os.environ.get('RDS_ENDPOINT_CACHE_TTL', '300'))
+
+# Privilege revocation and cloning run as batched statements in a single transaction; the lock timeout keeps a busy
+# table from stalling the rotation step until the Lambda times out.
+PRIVILEGE_LOCK_TIMEOUT = os.environ.get('PRIVILEGE_LOCK_TIMEOUT', '5s')
+PRIVILEGE_BATCH_SIZE = int(os.environ.get('PRIVILEGE_BATCH_SIZE', '500'))
+
+# Every privilege held directly by a role, read from the catalogs in a single round trip. Each row is
+# (object_type, scope, object_name, privilege_type, is_grantable). Object names are already quoted; for default
+# privileges the scope holds the `FOR ROLE ... IN SCHEMA ...` clause and the object name the object kind.
+ROLE_PRIVILEGES_QUERY = """
+WITH grantee AS (SELECT oid FROM pg_roles WHERE rolname = %s)
+SELECT CASE WHEN c.relkind = 'S' THEN 'SEQUENCE' ELSE 'TABLE' END, NULL,
+       quote_ident(n.nspname) || '.' || quote_ident(c.relname), a.privilege_type, a.is_grantable
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+CROSS JOIN LATERAL aclexplode(c.relacl) a
+JOIN grantee g ON a.grantee = g.oid
+WHERE c.relkind IN ('r', 'p', 'v', 'm', 'f', 'S')
+UNION ALL
+SELECT 'SCHEMA', NULL, quote_ident(n.nspname), a.privilege_type, a.is_grantable
+FROM pg_namespace n
+CROSS JOIN LATERAL aclexplode(n.nspacl) a
+JOIN grantee g ON a.grantee = g.oid
+UNION ALL
+SELECT CASE WHEN p.prokind = 'p' THEN 'PROCEDURE' ELSE 'FUNCTION' END, NULL,
+       quote_ident(n.nspname) || '.' || quote_ident(p.proname) || '(' || pg_get_function_identity_arguments(p.oid) || ')',
+       a.privilege_type, a.is_grantable
+FROM pg_proc p
+JOIN pg_namespace n ON n.oid = p.pronamespace
+CROSS JOIN LATERAL aclexplode(p.proacl) a
+JOIN grantee g ON a.grantee = g.oid
+UNION ALL
+SELECT 'DEFAULT', 'FOR ROLE ' || quote_ident(pg_get_userbyid(d.defaclrole)) || COALESCE(' IN SCHEMA ' || quote_ident(n.nspname), ''),
+       CASE d.defaclobjtype WHEN 'r' THEN 'TABLES' WHEN 'S' THEN 'SEQUENCES' WHEN 'f' THEN 'FUNCTIONS' WHEN 'T' THEN 'TYPES' ELSE 'SCHEMAS' END,
+       a.privilege_type, a.is_grantable
+FROM pg_default_acl d
+LEFT JOIN pg_namespace n ON n.oid = d.defaclnamespace
+CROSS JOIN LATERAL aclexplode(d.defaclacl) a
+JOIN grantee g ON a.grantee = g.oid
+"""
+
+# testSecret logs into every available instance of an Aurora cluster concurrently, each within this many seconds
+TEST_ENDPOINT_TIMEOUT = int(os.environ.get('TEST_ENDPOINT_TIMEOUT', '5'))
+AURORA_CLUSTER_HOST_PATTERN = re.compile(r'^([^.]+)\.cluster-(?:ro-)?[^.]+\.')
+
+# Password policy knobs accepted in the secret's `passwordpolicy`, named after the GetRandomPassword parameters
+DEFAULT_PASSWORD_POLICY = {
+    'PasswordLength': 16,
+    'ExcludeCharacters': '',
+    'ExcludeNumbers': False,
+    'ExcludePunctuation': False,
+    'ExcludeUppercase': False,
+    'ExcludeLowercase': False,
+    'IncludeSpace': False,
+    'RequireEachIncludedType': True,
+    'UseSecretsManager': False,
+}
+# The punctuation set used by GetRandomPassword
+PASSWORD_PUNCTUATION = '!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~'
+
+# Whether the alternating user already exists, checked before its password is changed
+ROLE_EXISTS_QUERY = "SELECT 1 FROM pg_roles WHERE rolname = %s"
+
+# setSecret's server-side block: creates the pending user if missing (or resets its password on a retry) and grants it
+# the current user. Its inputs are passed through transaction-local settings, so no value is spliced into the body.
+SET_SECRET_BLOCK = """DO $set_secret$
+DECLARE
+    pending_username text := current_setting('rotation.pending_username');
+    pending_password text := current_setting('rotation.pending_password');
+    current_username text := current_setting('rotation.current_username');
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_roles WHERE rolname = pending_username) THEN
+        EXECUTE format('ALTER ROLE %I WITH LOGIN PASSWORD %L', pending_username, pending_password);
+    ELSE
+        EXECUTE format('CREATE ROLE %I WITH LOGIN PASSWORD %L', pending_username, pending_password);
+    END IF;
+    IF NOT pg_has_role(pending_username, current_username, 'MEMBER') THEN
+        EXECUTE format('GRANT %I TO %I', current_username, pending_username);
+    END IF;
+END
+$set_secret$"""
+
+# Rotation strategies, chosen per secret with its `rotationstrategy` key. 'newuser' creates a new role on every
+# rotation; 'alternating' flips between two fixed roles, `<username>` and `<username>_clone`, and only resets the
+# password of the one being staged, so every rotation after the first costs a single ALTER ROLE.
+NEWUSER_STRATEGY = 'newuser'
+ALTERNATING_STRATEGY = 'alternating'
+ROTATION_STRATEGIES = (NEWUSER_STRATEGY, ALTERNATING_STRATEGY)
+CLONE_SUFFIX = '_clone'
+MAX_USERNAME_LENGTH = 63
+
+DatabaseDriver = collections.namedtuple('DatabaseDriver', ['name', 'connect', 'errors', 'formats_bare_queries'])
+
+# Module-scoped so that warm containers reuse the driver, the AWS clients and their connection pools
+db_driver = None
+service_clients = {}
+service_clients_lock = threading.Lock()
+rds_endpoint_cache = None
+
 
 def lambda_handler(event, context):
     """Secrets Manager RDS PostgreSQL Handler
 
-    This handler uses the master-user rotation scheme to rotate an RDS PostgreSQL user credential. This rotation
-    scheme creates a new user on every rotation.
+    This handler uses the master-user rotation scheme to rotate an RDS PostgreSQL user credential. By default this
+    rotation scheme creates a new user on every rotation; with the alternating strategy it instead switches between
+    the user and a `_clone` of it, resetting the password of the one not currently in use.
 
     The Secret SecretString is expected to be a JSON string with the following format:
     {
@@ -27,7 +146,9 @@ def lambda_handler(event, context):
         'password': <required: password>,
         'dbname': <optional: database name, default to 'postgres'>,
         'port': <optional: if not specified, default to 5432>,
-        'masterarn': <required: the arn of the master secret which will be used to create users/change passwords>
+        'masterarn': <required: the arn of the master secret which will be used to create users/change passwords>,
+        'passwordpolicy': <optional: password generation settings, see get_random_password>,
+        'rotationstrategy': <optional: 'newuser' (default) or 'alternating'>
     }
 
     Args:
@@ -46,37 +167,41 @@ def lambda_handler(event, context):
     token = event['ClientRequestToken']
     step = event['Step']
 
-    # Setup the client
-    service_client = boto3.client('secretsmanager', endpoint_url=os.environ['SECRETS_MANAGER_ENDPOINT'])
-
-    # Make sure the version is staged correctly
-    metadata = service_client.describe_secret(SecretId=arn)
-    if "RotationEnabled" in metadata and not metadata['RotationEnabled']:
-        logger.error("Secret %s is not enabled for rotation" % arn)
-        raise ValueError("Secret %s is not enabled for rotation" % arn)
-    versions = metadata['VersionIdsToStages']
-    if token not in versions:
-        logger.error("Secret version %s has no stage for rotation of secret %s." % (token, arn))
-        raise ValueError("Secret version %s has no stage for rotation of secret %s." % (token, arn))
-    if "AWSCURRENT" in versions[token]:
-        logger.info("Secret version %s already set as AWSCURRENT for secret %s." % (token, arn))
-        return
-    elif "AWSPENDING" not in versions[token]:
-        logger.error("Secret version %s not set as AWSPENDING for rotation of secret %s." % (token, arn))
-        raise ValueError("Secret version %s not set as AWSPENDING for rotation of secret %s." % (token, arn))
-
-    # Call the appropriate step
-    if step == "createSecret":
-        create_secret(service_client, arn, token)
-    elif step == "setSecret":
-        set_secret(service_client, arn, token)
-    elif step == "testSecret":
-        test_secret(service_client, arn, token)
-    elif step == "finishSecret":
-        finish_secret(service_client, arn, token)
-    else:
-        logger.error("lambda_handler: Invalid step parameter %s for secret %s" % (step, arn))
-        raise ValueError("Invalid step parameter %s for secret %s" % (step, arn))
+    tracer.start_step(step, arn)
+    try:
+        # Setup the client
+        service_client = get_service_client('secretsmanager', os.environ.get('SECRETS_MANAGER_ENDPOINT'))
+
+        # Make sure the version is staged correctly
+        metadata = service_client.describe_secret(SecretId=arn)
+        if "RotationEnabled" in metadata and not metadata['RotationEnabled']:
+            logger.error("Secret %s is not enabled for rotation" % arn)
+            raise ValueError("Secret %s is not enabled for rotation" % arn)
+        versions = metadata['VersionIdsToStages']
+        if token not in versions:
+            logger.error("Secret version %s has no stage for rotation of secret %s." % (token, arn))
+            raise ValueError("Secret version %s has no stage for rotation of secret %s." % (token, arn))
+        if "AWSCURRENT" in versions[token]:
+            logger.info("Secret version %s already set as AWSCURRENT for secret %s." % (token, arn))
+            return
+        elif "AWSPENDING" not in versions[token]:
+            logger.error("Secret version %s not set as AWSPENDING for rotation of secret %s." % (token, arn))
+            raise ValueError("Secret version %s not set as AWSPENDING for rotation of secret %s." % (token, arn))
+
+        # Call the appropriate step
+        if step == "createSecret":
+            create_secret(service_client, arn, token)
+        elif step == "setSecret":
+            set_secret(service_client, arn, token)
+        elif step == "testSecret":
+            test_secret(service_client, arn, token)
+        elif step == "finishSecret":
+            finish_secret(service_client, arn, token)
+        else:
+            logger.error("lambda_handler: Invalid step parameter %s for secret %s" % (step, arn))
+            raise ValueError("Invalid step parameter %s for secret %s" % (step, arn))
+    finally:
+        tracer.emit()
 
 def create_secret(service_client, arn, token):
     """Create the secret
@@ -103,9 +228,12 @@ def create_secret(service_client, arn, token):
         get_secret_dict(service_client, arn, "AWSPENDING", token)
         logger.info("createSecret: Successfully retrieved secret for %s." % arn)
     except service_client.exceptions.ResourceNotFoundException:
-        # Generate a new username
-        current_dict['username'] = generate_new_username()
-        current_dict['password'] = get_random_password(service_client)
+        # Generate a new username, or switch to the other user of the pair
+        if get_rotation_strategy(current_dict) == ALTERNATING_STRATEGY:
+            current_dict['username'] = get_alternate_username(current_dict['username'])
+        else:
+            current_dict['username'] = generate_new_username()
+        current_dict['password'] = get_random_password(service_client, current_dict.get('passwordpolicy'))
         
         # Put the secret
         service_client.put_secret_value(SecretId=arn, ClientRequestToken=token, SecretString=json.dumps(current_dict), VersionStages=['AWSPENDING'])
@@ -115,7 +243,8 @@ def set_secret(service_client, arn, token):
     """Set the pending secret in the database
 
     This method tries to login to the database with the AWSPENDING secret and creates the user if it doesn't exist.
-    It then grants all privileges from the current user to the new user.
+    It then grants all privileges from the current user to the new user. With the alternating strategy the pending
+    user already exists after the first rotation, so only its password is reset.
 
     Args:
         service_client (client): The secrets manager service client
@@ -131,38 +260,37 @@ def set_secret(service_client, arn, token):
     current_dict = get_secret_dict(service_client, arn, "AWSCURRENT")
     pending_dict = get_secret_dict(service_client, arn, "AWSPENDING", token)
 
-    # Use the master arn from the current secret to fetch master secret contents
-    master_arn = current_dict['masterarn']
-    master_dict = get_secret_dict(service_client, master_arn, "AWSCURRENT", None, True)
-
-    # Fetch dbname from the Child User
-    master_dict['dbname'] = current_dict.get('dbname', 'postgres')
-
     # Now log into the database with the master credentials
-    conn = get_connection(master_dict)
+    master_arn = current_dict['masterarn']
+    conn = get_master_connection(service_client, current_dict)
     if not conn:
         logger.error("setSecret: Unable to log into database using credentials in master secret %s" % master_arn)
         raise ValueError("Unable to log into database using credentials in master secret %s" % master_arn)
 
-    # Now set the password to the pending password
     try:
-        with conn.cursor() as cur:
-
-            # Get escaped usernames via quote_ident
-            cur.execute("SELECT quote_ident(%s)", (pending_dict['username'],))
-            pending_username = cur.fetchone()[0]
-            cur.execute("SELECT quote_ident(%s)", (current_dict['username'],))
-            current_username = cur.fetchone()[0]
-
-            # Create the new user
-            create_role = "CREATE ROLE %s" % pending_username
-            cur.execute(create_role + " WITH LOGIN PASSWORD %s", (pending_dict['password'],))
-            
-            # Grant permissions from the current user to the new user
-            cur.execute("GRANT %s TO %s" % (current_username, pending_username))
-            
-        conn.commit()
-        logger.info("setSecret: Successfully created new user %s and granted permissions." % pending_dict['username'])
+        if get_rotation_strategy(current_dict) == ALTERNATING_STRATEGY:
+            with closing(conn.cursor()) as cur:
+                cur.execute(ROLE_EXISTS_QUERY, (pending_dict['username'],))
+                exists = cur.fetchone() is not None
+            if exists:
+                run_in_transaction(conn, ["ALTER ROLE %s WITH LOGIN PASSWORD %s" % (quote_identifier(pending_dict['username']), quote_literal(pending_dict['password']))])
+                logger.info("setSecret: Successfully set password for alternating user %s." % pending_dict['username'])
+                return
+            # First rotation of the pair: the clone is created below just like a new user
+            logger.info("setSecret: Alternating user %s does not exist yet, creating it from %s." % (pending_dict['username'], current_dict['username']))
+
+        # Now create the new user and set its password, grant it the current user and clone the current user's direct
+        # privileges, so the new user keeps them once finishSecret revokes them from the current user. The privileges
+        # are read first; everything else runs as a single transaction in one round trip.
+        with closing(conn.cursor()) as cur:
+            privileges = fetch_role_privileges(cur, current_dict['username'])
+        statements = [
+            "SELECT set_config('rotation.pending_username', %s, true), set_config('rotation.pending_password', %s, true), set_config('rotation.current_username', %s, true)"
+            % (quote_literal(pending_dict['username']), quote_literal(pending_dict['password']), quote_literal(current_dict['username'])),
+            SET_SECRET_BLOCK,
+        ] + build_privilege_statements(privileges, 'GRANT', pending_dict['username'])
+        run_in_transaction(conn, statements)
+        logger.info("setSecret: Successfully created new user %s and granted permissions (%d privileges cloned in %d statements)." % (pending_dict['username'], len(privileges), len(statements) - 2))
     finally:
         conn.close()
 
@@ -185,23 +313,84 @@ def test_secret(service_client, arn, token):
         ValueError: If the secret is not valid
 
     """
-    # Try to login with the pending secret, if it succeeds, return
+    # Try to login with the pending secret on every endpoint of the cluster at once, if they all succeed, return
     pending_dict = get_secret_dict(service_client, arn, "AWSPENDING", token)
-    conn = get_connection(pending_dict)
-    if conn:
-        # This is where the lambda will validate the user's permissions. Modify this part to check for
-        # your desired permissions.
-        try:
-            with conn.cursor() as cur:
-                cur.execute("SELECT NOW()")
-                conn.commit()
-        finally:
-            conn.close()
-        logger.info("testSecret: Successfully signed into PostgreSQL DB with AWSPENDING secret in %s." % arn)
-        return
-    else:
-        logger.error("testSecret: Unable to log into database with pending secret of secret ARN %s" % arn)
-        raise ValueError("Unable to log into database with pending secret of secret ARN %s" % arn)
+    endpoints = get_test_endpoints(service_client, pending_dict)
+    with ThreadPoolExecutor(max_workers=len(endpoints)) as executor:
+        errors = list(executor.map(lambda endpoint: check_endpoint_login(pending_dict, endpoint[0], endpoint[1]), endpoints))
+
+    failed = ["%s:%s (%s)" % (host, port, error) for (host, port), error in zip(endpoints, errors) if error]
+    if failed:
+        logger.error("testSecret: Unable to log into database with pending secret of secret ARN %s on %s" % (arn, ', '.join(failed)))
+        raise ValueError("Unable to log into database with pending secret of secret ARN %s on %s" % (arn, ', '.join(failed)))
+    logger.info("testSecret: Successfully signed into PostgreSQL DB with AWSPENDING secret in %s on %d endpoints." % (arn, len(endpoints)))
+
+def check_endpoint_login(secret_dict, host, port):
+    """Logs into a single endpoint with a secret and runs the permissions check
+
+    Args:
+        secret_dict (dict): The Secret Dictionary
+
+        host (string): The endpoint address to use instead of the secret's host
+
+        port (int): The endpoint port to use instead of the secret's port
+
+    Returns:
+        string: None if the check passed, else a description of the failure
+
+    """
+    conn = get_connection(dict(secret_dict, host=host, port=port), TEST_ENDPOINT_TIMEOUT)
+    if not conn:
+        return "login failed"
+    # This is where the lambda will validate the user's permissions. Modify this part to check for
+    # your desired permissions.
+    try:
+        with closing(conn.cursor()) as cur:
+            cur.execute("SET statement_timeout = %d" % (TEST_ENDPOINT_TIMEOUT * 1000))
+            cur.execute("SELECT NOW()")
+            conn.commit()
+        return None
+    except Exception as err:
+        return str(err)
+    finally:
+        conn.close()
+
+def get_test_endpoints(service_client, secret_dict):
+    """Lists the endpoints testSecret must be able to log into
+
+    For an Aurora cluster these are the secret's host plus the endpoint of every available instance in the cluster,
+    so a new role that has not reached a reader yet fails the test. The cluster is identified from a cluster endpoint
+    host name, or else from the system tags of the master secret. Any error while describing the cluster falls back
+    to testing the secret's host alone.
+
+    Args:
+        service_client (client): The secrets manager service client
+
+        secret_dict (dict): The Secret Dictionary
+
+    Returns:
+        list: (host, port) tuples, the secret's own host first
+
+    """
+    port = int(secret_dict['port']) if 'port' in secret_dict else 5432
+    endpoints = [(secret_dict['host'], port)]
+    try:
+        match = AURORA_CLUSTER_HOST_PATTERN.match(secret_dict['host'])
+        if match:
+            cluster_id = match.group(1)
+        elif 'masterarn' in secret_dict:
+            db_instance_info = fetch_instance_arn_from_system_tags(service_client, secret_dict['masterarn'])
+            if db_instance_info.get('ARN_SYSTEM_TAG') != 'aws:rds:primarydbclusterarn':
+                return endpoints
+            cluster_id = db_instance_info['ARN']
+        else:
+            return endpoints
+        for endpoint in get_cluster_instance_endpoints(cluster_id):
+            if endpoint not in endpoints:
+                endpoints.append(endpoint)
+    except Exception as err:
+        logger.warning("testSecret: Unable to list cluster instance endpoints for %s, testing it alone: %s" % (secret_dict['host'], err))
+    return endpoints
 
 def finish_secret(service_client, arn, token):
     """Finish the rotation by marking the pending secret as current
@@ -228,36 +417,48 @@ def finish_secret(service_client, arn, token):
             current_version = version
             break
 
-    # Revoke permissions from the old user and optionally delete it
+    # Revoke permissions from the old user and optionally delete it. Alternating users keep their privileges, since
+    # the old user becomes the pending user of the next rotation.
     current_dict = get_secret_dict(service_client, arn, "AWSCURRENT")
-    pending_dict = get_secret_dict(service_client, arn, "AWSPENDING", token)
+    get_secret_dict(service_client, arn, "AWSPENDING", token)
+    if get_rotation_strategy(current_dict) != ALTERNATING_STRATEGY:
+        revoke_previous_user(service_client, current_dict)
 
-    # Use the master arn from the current secret to fetch master secret contents
-    master_arn = current_dict['masterarn']
-    master_dict = get_secret_dict(service_client, master_arn, "AWSCURRENT", None, True)
+    # Finalize by staging the secret version current
+    service_client.update_secret_version_stage(SecretId=arn, VersionStage="AWSCURRENT", MoveToVersionId=token, RemoveFromVersionId=current_version)
+    logger.info("finishSecret: Successfully set AWSCURRENT stage to version %s for secret %s." % (token, arn))
+
+def revoke_previous_user(service_client, current_dict):
+    """Revokes every privilege the outgoing user holds directly, in every schema
+
+    The user is not dropped here since clients may still hold the AWSPREVIOUS credentials. Superseded users are
+    dropped in batches by rotated_role_sweeper.py.
+
+    Args:
+        service_client (client): The secrets manager service client
 
-    # Fetch dbname from the Child User
-    master_dict['dbname'] = current_dict.get('dbname', 'postgres')
+        current_dict (dict): The secret dictionary of the outgoing AWSCURRENT version
+
+    Raises:
+        ValueError: If the database cannot be reached with the master secret
 
-    conn = get_connection(master_dict)
+    """
+    # Log into the database with the master credentials
+    master_arn = current_dict['masterarn']
+    conn = get_master_connection(service_client, current_dict)
+    if not conn:
+        logger.error("finishSecret: Unable to log into database using credentials in master secret %s" % master_arn)
+        raise ValueError("Unable to log into database using credentials in master secret %s" % master_arn)
     try:
-        with conn.cursor() as cur:
-            # Revoke permissions
-            cur.execute("REVOKE ALL PRIVILEGES ON ALL TABLES IN SCHEMA public FROM %s" % current_dict['username'])
-            
-            # Optionally, drop the old user 
-            #cur.execute("DROP USER IF EXISTS %s" % current_dict['username'])
-        
-        conn.commit()
-        logger.info("finishSecret: Successfully revoked permissions from old user %s and dropped it." % current_dict['username'])
+        with closing(conn.cursor()) as cur:
+            privileges = fetch_role_privileges(cur, current_dict['username'])
+        statements = build_privilege_statements(privileges, 'REVOKE', current_dict['username'])
+        run_in_transaction(conn, statements)
+        logger.info("finishSecret: Successfully revoked %d privileges from old user %s in %d statements." % (len(privileges), current_dict['username'], len(statements)))
     finally:
         conn.close()
 
-    # Finalize by staging the secret version current
-    service_client.update_secret_version_stage(SecretId=arn, VersionStage="AWSCURRENT", MoveToVersionId=token, RemoveFromVersionId=current_version)
-    logger.info("finishSecret: Successfully set AWSCURRENT stage to version %s for secret %s." % (token, arn))
-
-def get_connection(secret_dict):
+def get_connection(secret_dict, connect_timeout=5):
     """Gets a connection to PostgreSQL DB from a secret dictionary
 
     This helper function tries to connect to the database grabbing connection info
@@ -266,8 +467,10 @@ def get_connection(secret_dict):
     Args:
         secret_dict (dict): The Secret Dictionary
 
+        connect_timeout (int): Seconds to wait for the connection to be established
+
     Returns:
-        Connection: The pgdb.Connection object if successful. None otherwise
+        Connection: A DB-API connection from the configured driver if successful. None otherwise
 
     Raises:
         KeyError: If the secret json does not contain the expected keys
@@ -278,24 +481,244 @@ def get_connection(secret_dict):
     dbname = secret_dict['dbname'] if 'dbname' in secret_dict else "postgres"
 
     # Try to obtain a connection to the db
-
+    driver = get_db_driver()
     try:
-        conn = pgdb.connect(host=secret_dict['host'], user=secret_dict['username'], password=secret_dict['password'], database=dbname, port=port, connect_timeout=5)
-        return conn
-    except pg.InternalError:
+        with tracer.span('db.connect'):
+            conn = driver.connect(secret_dict['host'], secret_dict['username'], secret_dict['password'], dbname, port, connect_timeout)
+        # Transactions are opened explicitly by run_in_transaction, so they cost no extra round trips
+        conn.autocommit = True
+        return tracer.wrap_connection(conn)
+    except driver.errors:
+        # An unreachable endpoint may have moved (e.g. after a failover), so stop trusting any cached discovery for
+        # it. A server that answers but rejects the login has not moved, and keeps its cache entry.
+        if is_cached_rds_endpoint(secret_dict['host']) and not is_endpoint_reachable(secret_dict['host'], port, connect_timeout):
+            invalidate_rds_endpoint_cache(secret_dict['host'])
         return None
-    # try:
-    #     conn = pg8000.connect(
-    #         host=secret_dict['host'],
-    #         user=secret_dict['username'],
-    #         password=secret_dict['password'],
-    #         database=dbname,
-    #         port=port,
-    #         ssl_context=True
-    #     )
-    #     return conn
-    # except pg8000.Error:
-    #     return None
+
+
+def is_endpoint_reachable(host, port, timeout):
+    """Checks whether a TCP connection to the endpoint can be opened, telling network failures from refused logins
+
+    Args:
+        host (string): The endpoint address
+
+        port (int): The endpoint port
+
+        timeout (int): Seconds to wait for the connection
+
+    Returns:
+        bool: True if the endpoint accepted a TCP connection
+
+    """
+    try:
+        socket.create_connection((host, port), timeout).close()
+        return True
+    except OSError:
+        return False
+
+
+def get_db_driver():
+    """Imports the PostgreSQL driver selected by DB_DRIVER on first use
+
+    Returns:
+        DatabaseDriver: The driver name, a `connect(host, user, password, database, port, connect_timeout)` function,
+        the tuple of exceptions raised by a failed login, and whether the driver %-formats queries sent without
+        parameters (so literal percent signs in them must be doubled)
+
+    Raises:
+        ValueError: If DB_DRIVER names an unsupported driver
+
+    """
+    global db_driver
+    if db_driver is not None:
+        return db_driver
+
+    if DB_DRIVER == 'pgdb':
+        import pg
+        import pgdb
+
+        def connect(host, user, password, database, port, connect_timeout):
+            return pgdb.connect(host=host, user=user, password=password, database=database, port=port, connect_timeout=connect_timeout)
+
+        db_driver = DatabaseDriver('pgdb', connect, (pg.InternalError, pgdb.OperationalError), True)
+    elif DB_DRIVER == 'pg8000':
+        import pg8000.dbapi
+
+        def connect(host, user, password, database, port, connect_timeout):
+            # The TCP connect is bounded by connect_timeout so an unreachable endpoint fails fast; the socket then gets
+            # the longer timeout, since pg8000 would otherwise keep connect_timeout for every query on the connection
+            sock = socket.create_connection((host, port), connect_timeout)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            sock.settimeout(DB_STATEMENT_TIMEOUT + connect_timeout)
+            try:
+                return pg8000.dbapi.connect(
+                    host=host, user=user, password=password, database=database, sock=sock, ssl_context=True if DB_SSL else None,
+                    startup_params={'statement_timeout': str(DB_STATEMENT_TIMEOUT * 1000)},
+                )
+            except Exception:
+                sock.close()
+                raise
+
+        # OSError covers the refused or timed out socket, which pg8000 does not wrap once it is handed one
+        db_driver = DatabaseDriver('pg8000', connect, (pg8000.dbapi.InterfaceError, pg8000.dbapi.DatabaseError, OSError), False)
+    else:
+        raise ValueError("Unsupported DB_DRIVER %s, expected 'pgdb' or 'pg8000'" % DB_DRIVER)
+    return db_driver
+
+def fetch_role_privileges(cur, rolename):
+    """Reads every privilege granted directly to a role
+
+    This helper function runs ROLE_PRIVILEGES_QUERY, which covers tables, views, sequences, schemas, functions,
+    procedures and default privileges across all schemas of the connected database in one catalog query.
+
+    Args:
+        cur (Cursor): A cursor on a connection with the master credentials
+
+        rolename (string): The role whose privileges are read
+
+    Returns:
+        list: Tuples of (object_type, scope, object_name, privilege_type, is_grantable)
+
+    """
+    cur.execute(ROLE_PRIVILEGES_QUERY, (rolename,))
+    return [tuple(row) for row in cur.fetchall()]
+
+def build_privilege_statements(privileges, action, rolename):
+    """Builds batched GRANT or REVOKE statements for a set of privileges
+
+    Objects of the same type are combined into a single statement of up to PRIVILEGE_BATCH_SIZE objects. Grants are
+    additionally grouped by their exact privilege list and grant option, so cloning reproduces the privileges exactly.
+    Revocations use ALL PRIVILEGES, which also removes grant options.
+
+    Args:
+        privileges (list): Tuples as returned by fetch_role_privileges
+
+        action (string): Either 'GRANT' or 'REVOKE'
+
+        rolename (string): The role the privileges are granted to or revoked from
+
+    Returns:
+        list: The SQL statements to run
+
+    """
+    role = quote_identifier(rolename)
+    per_object = {}
+    for object_type, scope, object_name, privilege_type, is_grantable in privileges:
+        per_object.setdefault((object_type, scope, object_name), {})[privilege_type] = is_grantable
+
+    groups = {}
+    for (object_type, scope, object_name), object_privileges in per_object.items():
+        if action == 'REVOKE':
+            groups.setdefault((object_type, scope, 'ALL PRIVILEGES', False), []).append(object_name)
+            continue
+        for with_grant_option in (False, True):
+            names = sorted(p for p, grantable in object_privileges.items() if bool(grantable) == with_grant_option)
+            if names:
+                groups.setdefault((object_type, scope, ', '.join(names), with_grant_option), []).append(object_name)
+
+    statements = []
+    for (object_type, scope, privilege_list, with_grant_option), object_names in sorted(groups.items(), key=lambda item: tuple(str(part) for part in item[0])):
+        object_names.sort()
+        suffix = " WITH GRANT OPTION" if with_grant_option else ""
+        if object_type == 'DEFAULT':
+            # Default privileges take a single object kind per statement
+            for object_kind in object_names:
+                if action == 'REVOKE':
+                    statements.append("ALTER DEFAULT PRIVILEGES %s REVOKE %s ON %s FROM %s" % (scope, privilege_list, object_kind, role))
+                else:
+                    statements.append("ALTER DEFAULT PRIVILEGES %s GRANT %s ON %s TO %s%s" % (scope, privilege_list, object_kind, role, suffix))
+            continue
+        for start in range(0, len(object_names), PRIVILEGE_BATCH_SIZE):
+            batch = ', '.join(object_names[start:start + PRIVILEGE_BATCH_SIZE])
+            if action == 'REVOKE':
+                statements.append("REVOKE %s ON %s %s FROM %s" % (privilege_list, object_type, batch, role))
+            else:
+                statements.append("GRANT %s ON %s %s TO %s%s" % (privilege_list, object_type, batch, role, suffix))
+    return statements
+
+def run_in_transaction(conn, statements, lock_timeout=PRIVILEGE_LOCK_TIMEOUT):
+    """Runs statements as one transaction in a single round trip
+
+    The statements are sent as one script wrapped in BEGIN/COMMIT, with a lock_timeout so a busy table cannot stall
+    the rotation step until the Lambda times out. If any statement fails the transaction is rolled back.
+
+    Args:
+        conn (Connection): An autocommit connection as returned by get_connection
+
+        statements (list): Complete SQL statements without trailing semicolons
+
+        lock_timeout (string): The lock_timeout for the transaction, e.g. '5s'
+
+    """
+    if not statements:
+        return
+    script = ["BEGIN", "SET LOCAL lock_timeout = %s" % quote_literal(lock_timeout)] + statements + ["COMMIT"]
+    with closing(conn.cursor()) as cur:
+        try:
+            script = ";\n".join(script)
+            # pgdb applies %-formatting to parameterless queries too, so literal percent signs must be doubled
+            if get_db_driver().formats_bare_queries:
+                script = script.replace('%', '%%')
+            cur.execute(script)
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+
+def quote_identifier(name):
+    """Quotes a PostgreSQL identifier
+
+    Args:
+        name (string): The identifier, e.g. a role name
+
+    Returns:
+        string: The identifier in double quotes with embedded double quotes doubled
+
+    """
+    return '"%s"' % name.replace('"', '""')
+
+def quote_literal(value):
+    """Quotes a PostgreSQL string literal
+
+    The escape string syntax is used so the result does not depend on standard_conforming_strings.
+
+    Args:
+        value (string): The string value
+
+    Returns:
+        string: The value as an E'...' literal
+
+    """
+    return "E'%s'" % value.replace('\\', '\\\\').replace("'", "''")
+
+def get_master_connection(service_client, user_dict):
+    """Gets a connection to PostgreSQL DB using the master secret referenced by a user secret
+
+    This helper function fetches the master secret named by `masterarn` in the user secret and logs into the user's
+    database with it. If the endpoint came from the RDS endpoint cache and turns out to be unreachable, the cache
+    entry is dropped and the master secret is resolved once more against the RDS API before giving up. An endpoint
+    that was just described, or a login that is refused, is not retried.
+
+    Args:
+        user_dict (dict): The user secret dictionary containing `masterarn` and optionally `dbname`
+
+    Returns:
+        Connection: A DB-API connection from the configured driver if successful. None otherwise
+
+    """
+    master_arn = user_dict['masterarn']
+    for attempt in range(2):
+        master_dict = get_secret_dict(service_client, master_arn, "AWSCURRENT", None, True)
+
+        # Fetch dbname from the Child User
+        master_dict['dbname'] = user_dict.get('dbname', 'postgres')
+
+        # get_connection drops the cache entry when the endpoint is unreachable; only then is a fresh lookup worth it
+        from_cache = master_dict.pop('endpointfromcache', False) and attempt == 0
+        conn = get_connection(master_dict)
+        if conn or not from_cache or is_cached_rds_endpoint(master_dict['host']):
+            return conn
+        logger.warning("Cached endpoint %s for master secret %s is unreachable, refreshing it from the RDS API." % (master_dict['host'], master_arn))
+    return None
 
 def get_secret_dict(service_client, arn, stage, token=None, master=False):
     """Gets the secret dictionary corresponding for the secret arn, stage, and token
@@ -359,25 +782,142 @@ def get_secret_dict(service_client, arn, stage, token=None, master=False):
     # Parse and return the secret JSON string
     return secret_dict
 
-def get_random_password(service_client):
+def get_random_password(service_client, policy=None):
     """Generates a random password
 
-    This helper function generates a random password using AWS Secrets Manager
+    This helper function generates a random password in-process from the operating system CSPRNG. The policy accepts
+    the same knobs as the Secrets Manager GetRandomPassword API; setting 'UseSecretsManager' to true in the policy
+    generates the password with that API instead.
 
     Args:
         service_client (client): The secrets manager service client
 
+        policy (dict): Optional overrides of DEFAULT_PASSWORD_POLICY, typically the secret's `passwordpolicy`
+
     Returns:
         string: A randomly generated password
 
+    Raises:
+        ValueError: If the policy contains unknown keys or cannot be satisfied
+
     """
-    password_params = {
-        'IncludeSpace': False,
-        'RequireEachIncludedType': True,
-        'PasswordLength': 16
-    }
-    response = service_client.get_random_password(**password_params)
-    return response['RandomPassword']
+    policy = get_password_policy(policy)
+    if policy.pop('UseSecretsManager'):
+        response = service_client.get_random_password(**policy)
+        return response['RandomPassword']
+    return generate_password(policy)
+
+def get_password_policy(policy=None):
+    """Merges a password policy with DEFAULT_PASSWORD_POLICY and validates it
+
+    Args:
+        policy (dict): Policy overrides, or None for the defaults
+
+    Returns:
+        dict: The complete policy
+
+    Raises:
+        ValueError: If the policy contains unknown keys or an invalid length
+
+    """
+    unknown = set(policy or {}) - set(DEFAULT_PASSWORD_POLICY)
+    if unknown:
+        raise ValueError("Unknown password policy keys: %s" % ', '.join(sorted(unknown)))
+    merged = dict(DEFAULT_PASSWORD_POLICY, **(policy or {}))
+    if not 1 <= int(merged['PasswordLength']) <= 4096:
+        raise ValueError("PasswordLength must be between 1 and 4096")
+    return merged
+
+def get_password_character_classes(policy):
+    """Lists the character classes a password policy allows
+
+    Args:
+        policy (dict): A complete password policy
+
+    Returns:
+        list: One string of allowed characters per included class, with excluded characters removed
+
+    """
+    classes = []
+    if not policy['ExcludeLowercase']:
+        classes.append(string.ascii_lowercase)
+    if not policy['ExcludeUppercase']:
+        classes.append(string.ascii_uppercase)
+    if not policy['ExcludeNumbers']:
+        classes.append(string.digits)
+    if not policy['ExcludePunctuation']:
+        classes.append(PASSWORD_PUNCTUATION)
+    if policy['IncludeSpace']:
+        classes.append(' ')
+    classes = [''.join(c for c in chars if c not in policy['ExcludeCharacters']) for chars in classes]
+    return [chars for chars in classes if chars]
+
+def generate_password(policy):
+    """Generates a password from the operating system CSPRNG
+
+    Every character is drawn uniformly from the allowed alphabet. When each included type is required, candidates
+    missing a class are discarded and redrawn, which keeps the result uniform over all compliant passwords.
+
+    Args:
+        policy (dict): A complete password policy
+
+    Returns:
+        string: The password
+
+    Raises:
+        ValueError: If no characters are allowed or the length is shorter than the number of required classes
+
+    """
+    classes = get_password_character_classes(policy)
+    if not classes:
+        raise ValueError("Password policy excludes every character")
+    length = int(policy['PasswordLength'])
+    if policy['RequireEachIncludedType'] and length < len(classes):
+        raise ValueError("PasswordLength %d is too short to include all %d character types" % (length, len(classes)))
+    alphabet = ''.join(classes)
+    while True:
+        password = ''.join(secrets.choice(alphabet) for _ in range(length))
+        if not policy['RequireEachIncludedType'] or all(any(c in chars for c in password) for chars in classes):
+            return password
+
+def get_rotation_strategy(secret_dict):
+    """Gets the rotation strategy of a secret
+
+    Args:
+        secret_dict (dict): The secret dictionary
+
+    Returns:
+        string: NEWUSER_STRATEGY or ALTERNATING_STRATEGY
+
+    Raises:
+        ValueError: If the secret names an unknown strategy
+
+    """
+    strategy = secret_dict.get('rotationstrategy', NEWUSER_STRATEGY)
+    if strategy not in ROTATION_STRATEGIES:
+        raise ValueError("Unknown rotationstrategy %s, expected one of %s" % (strategy, ', '.join(ROTATION_STRATEGIES)))
+    return strategy
+
+
+def get_alternate_username(username):
+    """Gets the other user of an alternating pair
+
+    Args:
+        username (string): The current username, either the base user or its clone
+
+    Returns:
+        string: `<username>_clone` for the base user, the base user for the clone
+
+    Raises:
+        ValueError: If the clone name would exceed the PostgreSQL identifier length
+
+    """
+    if username.endswith(CLONE_SUFFIX):
+        return username[:-len(CLONE_SUFFIX)]
+    if len(username) + len(CLONE_SUFFIX) > MAX_USERNAME_LENGTH:
+        raise ValueError("Unable to clone user %s, the username with %s appended would exceed %d characters" % (username, CLONE_SUFFIX, MAX_USERNAME_LENGTH))
+    return username + CLONE_SUFFIX
+
 
 def generate_new_username(prefix='pgsqlnewuser'):
     """Generates a new username based on the current timestamp
@@ -442,6 +982,7 @@ def get_connection_params_from_rds_api(master_dict, master_instance_info):
     """Fetches connection parameters (`host`, `port`, etc.) from the DescribeDBInstances/DescribeDBClusters RDS API using `master_instance_arn` in the master secret metadata as a filter.
 
     This helper function fetches connection parameters from the DescribeDBInstances/DescribeDBClusters RDS API using `master_instance_arn` in the master secret metadata as a filter.
+    Results are cached per ARN for RDS_ENDPOINT_CACHE_TTL seconds and the cache is consulted before calling the RDS API.
 
     Args:
         master_dict (dictionary): The master secret dictionary that will be updated with connection parameters.
@@ -451,15 +992,23 @@ def get_connection_params_from_rds_api(master_dict, master_instance_info):
             - The 'ARN' value is the DB Instance/Cluster ARN from master secret System Tags that will be used as a filter in DescribeDBInstances/DescribeDBClusters RDS API calls.
 
     Returns:
-        master_dict (dictionary): An updated master secret dictionary that now contains connection parameters such as `host`, `port`, etc.
+        master_dict (dictionary): An updated master secret dictionary that now contains connection parameters such as `host`, `port`, etc.,
+            and `endpointfromcache` set to True when they came from the cache rather than the RDS API.
 
     Raises:
         Exception: If there is some error/throttling when calling the DescribeDBInstances/DescribeDBClusters RDS API
 
         ValueError: If the DescribeDBInstances/DescribeDBClusters RDS API Response contains no Instances
     """
-    # Setup the client
-    rds_client = boto3.client('rds')
+    cached = get_cached_rds_endpoint(master_instance_info['ARN'])
+    if cached:
+        master_dict['host'] = cached['host']
+        master_dict['port'] = cached['port']
+        master_dict['engine'] = cached['engine']
+        master_dict['endpointfromcache'] = True
+        return master_dict
+
+    rds_client = get_service_client('rds')
 
     if master_instance_info['ARN_SYSTEM_TAG'] == 'aws:rds:primarydbinstancearn':
         # Call DescribeDBInstances RDS API
@@ -499,4 +1048,171 @@ def get_connection_params_from_rds_api(master_dict, master_instance_info):
         master_dict['port'] = primary_instance['Port']
         master_dict['engine'] = primary_instance['Engine']
 
+    if 'host' in master_dict:
+        put_cached_rds_endpoint(master_instance_info['ARN'], master_dict['host'], master_dict['port'], master_dict['engine'])
+
     return master_dict
+
+
+def get_service_client(service_name, endpoint_url=None):
+    """Gets a module-level AWS service client, creating it on first use
+
+    Clients are created for the Lambda's own region (AWS_REGION) and shared across invocations of a warm container,
+    so their credentials and HTTPS connection pools are reused instead of rebuilt on every rotation step.
+
+    Args:
+        service_name (string): The service name, e.g. 'secretsmanager' or 'rds'
+
+        endpoint_url (string): An optional endpoint override, e.g. a VPC endpoint
+
+    Returns:
+        client: The shared service client
+
+    """
+    key = (service_name, endpoint_url)
+    client = service_clients.get(key)
+    if client is None:
+        with service_clients_lock:
+            client = service_clients.get(key)
+            if client is None:
+                client = service_clients[key] = tracer.instrument_client(boto3.client(service_name, endpoint_url=endpoint_url, region_name=os.environ.get('AWS_REGION')))
+    return client
+
+
+def load_rds_endpoint_cache():
+    """Loads the RDS endpoint cache, reading the /tmp copy on the first call in a container
+
+    Returns:
+        dict: A mapping of DB Instance/Cluster ARN to a dictionary with `host`, `port`, `engine` and `expires`
+
+    """
+    global rds_endpoint_cache
+    if rds_endpoint_cache is None:
+        try:
+            with open(RDS_ENDPOINT_CACHE_FILE) as cache_file:
+                rds_endpoint_cache = json.load(cache_file)
+        except (OSError, ValueError):
+            rds_endpoint_cache = {}
+    return rds_endpoint_cache
+
+
+def save_rds_endpoint_cache():
+    """Persists the RDS endpoint cache to /tmp
+
+    The file is replaced atomically so a concurrent reader never sees a partial write. Failures are only logged
+    since the cache is an optimization.
+
+    """
+    tmp_path = "%s.%d.%d" % (RDS_ENDPOINT_CACHE_FILE, os.getpid(), threading.get_ident())
+    try:
+        with open(tmp_path, 'w') as cache_file:
+            json.dump(dict(rds_endpoint_cache), cache_file)
+        os.replace(tmp_path, RDS_ENDPOINT_CACHE_FILE)
+    except OSError as err:
+        logger.warning("Unable to persist RDS endpoint cache to %s: %s" % (RDS_ENDPOINT_CACHE_FILE, err))
+
+
+def get_cached_rds_endpoint(db_arn):
+    """Gets the cached connection parameters for a DB Instance/Cluster ARN
+
+    Args:
+        db_arn (string): The DB Instance/Cluster ARN
+
+    Returns:
+        dict: The cached `host`, `port` and `engine`, or None if there is no entry or it has expired
+
+    """
+    entry = load_rds_endpoint_cache().get(db_arn)
+    if entry and entry['expires'] > time.time():
+        return entry
+    return None
+
+
+def put_cached_rds_endpoint(db_arn, host, port, engine):
+    """Caches the connection parameters for a DB Instance/Cluster ARN for RDS_ENDPOINT_CACHE_TTL seconds
+
+    Args:
+        db_arn (string): The DB Instance/Cluster ARN
+
+        host (string): The endpoint address
+
+        port (int): The endpoint port
+
+        engine (string): The DB engine
+
+    """
+    load_rds_endpoint_cache()[db_arn] = {'host': host, 'port': port, 'engine': engine, 'expires': time.time() + RDS_ENDPOINT_CACHE_TTL}
+    save_rds_endpoint_cache()
+
+
+def get_cluster_instance_endpoints(cluster_id):
+    """Lists the endpoints of the available instances of an Aurora cluster
+
+    The result is cached for RDS_ENDPOINT_CACHE_TTL seconds alongside the cluster endpoint cache.
+
+    Args:
+        cluster_id (string): The DB Cluster identifier or ARN
+
+    Returns:
+        list: (host, port) tuples of every instance whose status is 'available'
+
+    """
+    cache_key = "instances:%s" % cluster_id
+    cached = load_rds_endpoint_cache().get(cache_key)
+    if cached and cached['expires'] > time.time():
+        return [tuple(endpoint) for endpoint in cached['endpoints']]
+
+    endpoints = []
+    kwargs = {'Filters': [{'Name': 'db-cluster-id', 'Values': [cluster_id]}]}
+    while True:
+        describe_response = get_service_client('rds').describe_db_instances(**kwargs)
+        for instance in describe_response['DBInstances']:
+            if instance.get('DBInstanceStatus') == 'available' and 'Endpoint' in instance:
+                endpoints.append((instance['Endpoint']['Address'], instance['Endpoint']['Port']))
+        if 'Marker' not in describe_response:
+            break
+        kwargs['Marker'] = describe_response['Marker']
+
+    load_rds_endpoint_cache()[cache_key] = {'endpoints': endpoints, 'expires': time.time() + RDS_ENDPOINT_CACHE_TTL}
+    save_rds_endpoint_cache()
+    return endpoints
+
+
+def cached_hosts(entry):
+    """Returns the hosts an RDS endpoint cache entry points at"""
+    if 'endpoints' in entry:
+        return [endpoint[0] for endpoint in entry['endpoints']]
+    return [entry['host']]
+
+
+def is_cached_rds_endpoint(host):
+    """Checks whether a host was resolved from a live RDS endpoint cache entry
+
+    Args:
+        host (string): The endpoint address
+
+    Returns:
+        bool: True if an unexpired cache entry points at the host
+
+    """
+    now = time.time()
+    return any(host in cached_hosts(entry) and entry['expires'] > now for entry in list(load_rds_endpoint_cache().values()))
+
+
+def invalidate_rds_endpoint_cache(host):
+    """Drops every RDS endpoint cache entry pointing at a host
+
+    This is called when a connection to the host fails, so the next lookup goes back to the RDS API and picks up
+    the endpoint after a failover.
+
+    Args:
+        host (string): The endpoint address that could not be reached
+
+    """
+    cache = load_rds_endpoint_cache()
+    stale = [key for key, entry in list(cache.items()) if host in cached_hosts(entry)]
+    if stale:
+        for key in stale:
+            cache.pop(key, None)
+        save_rds_endpoint_cache()
+        logger.info("Invalidated cached RDS endpoint %s for %s" % (host, ', '.join(stale)))
@@ -0,0 +1,327 @@
+"""Sweeper for superseded roles left behind by the new-user rotation scheme
+
+Every rotation by `rotate-secret-newuser.py` creates a `pgsqlnewuser_<timestamp>_<suffix>` role and grants it
+membership in the role it replaces, and nothing ever drops the old roles. For each secret, this sweeper collects the
+roles named by the secret's version history plus the chain of rotated roles the current role is a member of, keeps
+every role still referenced by a staged version (AWSCURRENT, AWSPENDING, AWSPREVIOUS), and drops the rest with
+REASSIGN OWNED/DROP OWNED/DROP ROLE in bounded batches, each in its own transaction under a lock timeout. A batch
+that fails is retried role by role so one blocked role does not hold back the others.
+
+Rotation clones a role's privileges but not its memberships, so the protected roles may inherit roles only through
+the rotated roles about to be dropped. Before anything is dropped, those roles are granted to the protected roles
+directly.
+
+Without --execute it only reports what it would drop:
+
+    python rotated_role_sweeper.py arn:aws:secretsmanager:...:secret:app-user
+    python rotated_role_sweeper.py --execute --batch-size 50 arn:aws:secretsmanager:...:secret:app-user
+
+"""
+import argparse
+import json
+import logging
+import re
+import sys
+import time
+from contextlib import closing
+
+from rotation_orchestrator import DEFAULT_ROTATION_MODULE, load_rotation_module
+
+logger = logging.getLogger(__name__)
+
+ROTATED_ROLE_PATTERN = r'^pgsqlnewuser_([0-9]+)_[a-z0-9]{4}$'
+PROTECTED_STAGES = ('AWSCURRENT', 'AWSPENDING', 'AWSPREVIOUS')
+
+# Rotated roles that belong to a secret: those named in its version history, and every role reachable from the
+# protected roles through pg_auth_members, since each rotated role is a member of the one it replaced.
+CANDIDATE_ROLES_QUERY = """
+WITH RECURSIVE lineage(oid) AS (
+    SELECT oid FROM pg_roles WHERE rolname = ANY(%s)
+    UNION
+    SELECT m.roleid FROM pg_auth_members m JOIN lineage l ON m.member = l.oid
+)
+SELECT r.rolname
+FROM pg_roles r
+WHERE r.rolname ~ %s
+  AND (r.oid IN (SELECT oid FROM lineage) OR r.rolname = ANY(%s))
+ORDER BY r.rolname
+"""
+
+# Every membership (member, role) on the paths from the protected roles through pg_auth_members
+MEMBERSHIP_EDGES_QUERY = """
+WITH RECURSIVE lineage(oid) AS (
+    SELECT oid FROM pg_roles WHERE rolname = ANY(%s)
+    UNION
+    SELECT m.roleid FROM pg_auth_members m JOIN lineage l ON m.member = l.oid
+)
+SELECT member.rolname, role.rolname
+FROM pg_auth_members m
+JOIN pg_roles member ON member.oid = m.member
+JOIN pg_roles role ON role.oid = m.roleid
+WHERE m.member IN (SELECT oid FROM lineage)
+"""
+
+
+def get_version_usernames(service_client, arn):
+    """Reads the username of every staged version of a secret
+
+    Versions without a staging label are deprecated and not read, nor are versions without a value, such as an
+    AWSPENDING version whose createSecret step has not run yet.
+
+    Args:
+        service_client (client): The secrets manager service client
+
+        arn (string): The secret ARN or other identifier
+
+    Returns:
+        tuple: (protected, history) where `protected` is the set of usernames of versions holding a protected
+        stage and `history` the set of usernames of the versions holding only other stages
+
+    """
+    protected = set()
+    history = set()
+    kwargs = {'SecretId': arn}
+    while True:
+        response = service_client.list_secret_version_ids(**kwargs)
+        for version in response['Versions']:
+            stages = set(version.get('VersionStages') or [])
+            if not stages:
+                continue
+            try:
+                secret = service_client.get_secret_value(SecretId=arn, VersionId=version['VersionId'])
+            except service_client.exceptions.ResourceNotFoundException:
+                continue
+            if not secret.get('SecretString'):
+                continue
+            username = json.loads(secret['SecretString']).get('username')
+            if not username:
+                continue
+            if stages & set(PROTECTED_STAGES):
+                protected.add(username)
+            else:
+                history.add(username)
+        if not response.get('NextToken'):
+            break
+        kwargs['NextToken'] = response['NextToken']
+    return protected, history - protected
+
+
+def find_superseded_roles(cur, protected, history, min_age):
+    """Lists the rotated roles of a secret that are safe to drop
+
+    Args:
+        cur (Cursor): A cursor on a connection with the master credentials
+
+        protected (set): Usernames of versions holding a protected stage
+
+        history (set): Usernames of the other retained versions
+
+        min_age (int): Roles whose name timestamp is younger than this many seconds are kept
+
+    Returns:
+        list: Role names, oldest first
+
+    """
+    cur.execute(CANDIDATE_ROLES_QUERY, (sorted(protected), ROTATED_ROLE_PATTERN, sorted(history)))
+    cutoff = time.time() - min_age
+    roles = []
+    for (rolname,) in cur.fetchall():
+        match = re.match(ROTATED_ROLE_PATTERN, rolname)
+        if rolname in protected or int(match.group(1)) > cutoff:
+            continue
+        roles.append(rolname)
+    return sorted(roles, key=lambda rolname: int(re.match(ROTATED_ROLE_PATTERN, rolname).group(1)))
+
+
+def reachable_roles(role, memberships, excluded=()):
+    """Returns the roles `role` is a member of, directly or transitively, without passing through `excluded`"""
+    reached = set()
+    pending = [role]
+    while pending:
+        for granted in memberships.get(pending.pop(), ()):
+            if granted not in reached and granted not in excluded:
+                reached.add(granted)
+                pending.append(granted)
+    return reached
+
+
+def inherited_memberships(edges, protected, doomed):
+    """Finds the memberships the protected roles would lose when the doomed roles are dropped
+
+    A protected role that reaches a role only through doomed roles loses it with them, since dropping a role removes
+    its own memberships.
+
+    Args:
+        edges (iterable): (member, role) pairs from pg_auth_members
+
+        protected (iterable): Roles that must keep what they inherit
+
+        doomed (iterable): Roles about to be dropped
+
+    Returns:
+        dict: Protected role to the sorted roles to grant it directly, for those that lose any
+
+    """
+    memberships = {}
+    for member, role in edges:
+        memberships.setdefault(member, set()).add(role)
+    doomed = set(doomed)
+    lost = {}
+    for role in sorted(set(protected) - doomed):
+        missing = reachable_roles(role, memberships) - reachable_roles(role, memberships, doomed) - doomed - {role}
+        if missing:
+            lost[role] = sorted(missing)
+    return lost
+
+
+def find_lost_memberships(cur, protected, roles):
+    """Reads the memberships of the protected roles' lineage and returns those dropping `roles` would lose"""
+    cur.execute(MEMBERSHIP_EDGES_QUERY, (sorted(protected),))
+    return inherited_memberships(cur.fetchall(), protected, roles)
+
+
+def preserve_memberships(conn, rotation_module, lost, lock_timeout):
+    """Grants the protected roles the roles they would otherwise only inherit through the roles to drop
+
+    Args:
+        conn (Connection): A connection with the master credentials
+
+        rotation_module (module): The rotation module, for identifier quoting and transaction handling
+
+        lost (dict): Protected role to the roles to grant it, from find_lost_memberships
+
+        lock_timeout (string): The lock_timeout for the transaction
+
+    """
+    statements = [
+        "GRANT %s TO %s" % (', '.join(rotation_module.quote_identifier(granted) for granted in granted_roles), rotation_module.quote_identifier(role))
+        for role, granted_roles in lost.items()
+    ]
+    if statements:
+        rotation_module.run_in_transaction(conn, statements, lock_timeout)
+
+
+def drop_roles(conn, rotation_module, roles, lock_timeout):
+    """Drops a batch of roles in a single transaction
+
+    Objects owned by the roles are reassigned to the connected (master) user first, then their remaining
+    privileges and the roles themselves are dropped.
+
+    Args:
+        conn (Connection): A connection with the master credentials
+
+        rotation_module (module): The rotation module, for identifier quoting and transaction handling
+
+        roles (list): Role names to drop
+
+        lock_timeout (string): The lock_timeout for the transaction, e.g. '5s'
+
+    """
+    role_list = ', '.join(rotation_module.quote_identifier(role) for role in roles)
+    rotation_module.run_in_transaction(conn, [
+        "REASSIGN OWNED BY %s TO CURRENT_USER" % role_list,
+        "DROP OWNED BY %s" % role_list,
+        "DROP ROLE %s" % role_list,
+    ], lock_timeout)
+
+
+def sweep_secret(service_client, rotation_module, arn, batch_size=20, lock_timeout='5s', min_age=86400, dry_run=True):
+    """Drops the superseded rotated roles of one secret
+
+    Args:
+        service_client (client): The secrets manager service client
+
+        rotation_module (module): The loaded `rotate-secret-newuser.py` module
+
+        arn (string): The secret ARN or other identifier
+
+        batch_size (int): Maximum number of roles dropped per transaction
+
+        lock_timeout (string): The lock_timeout for each transaction
+
+        min_age (int): Roles created less than this many seconds ago are kept
+
+        dry_run (boolean): Only report the roles that would be dropped
+
+    Returns:
+        dict: A report with `arn`, `protected`, `candidates`, `regranted` (protected role to the roles granted, or
+        to be granted, to it directly), `dropped` and `failed` (role name to error)
+
+    Raises:
+        ValueError: If the database cannot be reached with the master secret
+
+    """
+    protected, history = get_version_usernames(service_client, arn)
+    current_dict = rotation_module.get_secret_dict(service_client, arn, "AWSCURRENT")
+    report = {'arn': arn, 'protected': sorted(protected), 'candidates': [], 'regranted': {}, 'dropped': [], 'failed': {}}
+
+    conn = rotation_module.get_master_connection(service_client, current_dict)
+    if not conn:
+        raise ValueError("Unable to log into database using credentials in master secret %s" % current_dict['masterarn'])
+    try:
+        with closing(conn.cursor()) as cur:
+            report['candidates'] = find_superseded_roles(cur, protected, history, min_age)
+            if report['candidates']:
+                report['regranted'] = find_lost_memberships(cur, protected, report['candidates'])
+        if dry_run or not report['candidates']:
+            return report
+
+        # Nothing is dropped unless every inherited membership is preserved first
+        preserve_memberships(conn, rotation_module, report['regranted'], lock_timeout)
+        for start in range(0, len(report['candidates']), batch_size):
+            batch = report['candidates'][start:start + batch_size]
+            try:
+                drop_roles(conn, rotation_module, batch, lock_timeout)
+                report['dropped'].extend(batch)
+            except Exception as err:
+                logger.warning("Dropping batch of %d roles for %s failed, retrying one by one: %s" % (len(batch), arn, err))
+                for role in batch:
+                    try:
+                        drop_roles(conn, rotation_module, [role], lock_timeout)
+                        report['dropped'].append(role)
+                    except Exception as role_err:
+                        report['failed'][role] = str(role_err)
+        logger.info("Dropped %d of %d superseded roles for %s" % (len(report['dropped']), len(report['candidates']), arn))
+    finally:
+        conn.close()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Drop superseded pgsqlnewuser_* roles left behind by rotation.")
+    parser.add_argument('secret_ids', nargs='+', help="Secret ARNs or names rotated by rotate-secret-newuser.py")
+    parser.add_argument('--execute', action='store_true', help="Drop the roles; without it only a dry-run report is printed")
+    parser.add_argument('--batch-size', type=int, default=20, help="Maximum roles dropped per transaction")
+    parser.add_argument('--lock-timeout', default='5s', help="lock_timeout for each transaction")
+    parser.add_argument('--min-age', type=int, default=86400, help="Keep roles created less than this many seconds ago")
+    parser.add_argument('--module', default=DEFAULT_ROTATION_MODULE, help="Path to the rotation Lambda module")
+    parser.add_argument('--fake-secrets', help="Use an in-process Secrets Manager seeded from this JSON file")
+    parser.add_argument('--endpoint-url', help="Secrets Manager endpoint URL")
+    parser.add_argument('--region', help="AWS region")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    if args.fake_secrets:
+        from fake_secretsmanager import FakeSecretsManager
+        service_client = FakeSecretsManager.from_file(args.fake_secrets)
+    else:
+        import boto3
+        service_client = boto3.client('secretsmanager', endpoint_url=args.endpoint_url, region_name=args.region)
+    rotation_module = load_rotation_module(args.module)
+
+    failed = False
+    for arn in args.secret_ids:
+        report = sweep_secret(service_client, rotation_module, arn, args.batch_size, args.lock_timeout, args.min_age, dry_run=not args.execute)
+        print("%s: %d protected, %d superseded%s" % (arn, len(report['protected']), len(report['candidates']), "" if args.execute else " (dry run)"))
+        for role, granted_roles in report['regranted'].items():
+            print("  %s %s to %s" % ("granted" if args.execute else "would grant", ', '.join(granted_roles), role))
+        for role in report['candidates']:
+            status = "would drop" if not args.execute else ("FAILED: %s" % report['failed'][role] if role in report['failed'] else "dropped")
+            print("  %s %s" % (role, status))
+        failed = failed or bool(report['failed'])
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,430 @@
+"""Offline benchmark harness for the rotation Lambdas
+
+Replays the createSecret/setSecret/testSecret/finishSecret event sequence against `lambda_handler` of
+`rotate-secret-newuser.py` or `rotate-new-secret.py`, with Secrets Manager replaced by the in-process fake from
+`fake_secretsmanager.py` and the database by a throwaway local PostgreSQL (initdb/pg_ctl from PATH or PG_BIN), or an
+existing server given with --pg-host. All database traffic goes through a local TCP proxy that counts connections
+and can delay every packet to model a cross-region link; the fake Secrets Manager can be delayed the same way.
+
+    python rotation_benchmark.py --secrets 50 --db-latency-ms 35 --sm-latency-ms 20
+    python rotation_benchmark.py --module rotate-new-secret.py --secrets 20 --json report.json
+
+The report has per-step latency percentiles, Secrets Manager calls by operation and database connections, both
+in total and per rotation. It also reports the fixed costs every invocation sits on: the module load, the first
+(cold) and subsequent (warm) invocations of a step that does no work, the import of the configured DB driver
+(DB_DRIVER) and, when boto3 is installed, the construction of a real Secrets Manager client.
+
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import closing
+from types import SimpleNamespace
+
+from fake_secretsmanager import FakeSecretsManager
+from rotation_orchestrator import ROTATION_STEPS, load_rotation_module, percentiles
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+NEWUSER_MODULE = os.path.join(HERE, 'rotate-secret-newuser.py')
+NEWSECRET_MODULE = os.path.join(HERE, 'rotate-new-secret.py')
+SUPERUSER_PASSWORD = 'benchmark-superuser'
+OVERHEAD_INVOCATIONS = 50
+
+# Imports timed in a fresh interpreter to measure the cold cost of each DB driver
+DRIVER_IMPORTS = {
+    'pgdb': 'import pg, pgdb',
+    'pg8000': 'import pg8000.dbapi',
+    'psycopg2': 'import psycopg2',
+}
+
+
+def free_port():
+    """Returns a TCP port that is currently free on the loopback interface"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class ThrowawayPostgres:
+    """A temporary PostgreSQL cluster, removed again on exit
+
+    Args:
+        pg_bin (string): Directory with initdb and pg_ctl, defaults to PG_BIN or the PATH
+
+    """
+
+    def __init__(self, pg_bin=None):
+        self.pg_bin = pg_bin or os.environ.get('PG_BIN', '')
+        self.host = '127.0.0.1'
+        self.port = free_port()
+        self.user = 'postgres'
+        self.password = SUPERUSER_PASSWORD
+
+    def _tool(self, name):
+        path = os.path.join(self.pg_bin, name) if self.pg_bin else shutil.which(name)
+        if not path:
+            raise RuntimeError("%s not found, set PG_BIN or use --pg-host" % name)
+        return path
+
+    def __enter__(self):
+        self.directory = tempfile.mkdtemp(prefix='rotation-bench-pg-')
+        data_dir = os.path.join(self.directory, 'data')
+        pwfile = os.path.join(self.directory, 'pwfile')
+        with open(pwfile, 'w') as f:
+            f.write(self.password)
+        subprocess.run([self._tool('initdb'), '-D', data_dir, '-U', self.user, '--pwfile', pwfile,
+                        '--auth-host=scram-sha-256', '--auth-local=trust'], check=True, stdout=subprocess.DEVNULL)
+        options = "-p %d -k %s -c listen_addresses=%s -c max_connections=500" % (self.port, self.directory, self.host)
+        subprocess.run([self._tool('pg_ctl'), '-D', data_dir, '-o', options, '-l', os.path.join(self.directory, 'log'), '-w', 'start'],
+                       check=True, stdout=subprocess.DEVNULL)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        subprocess.run([self._tool('pg_ctl'), '-D', os.path.join(self.directory, 'data'), '-m', 'immediate', '-w', 'stop'],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        shutil.rmtree(self.directory, ignore_errors=True)
+        return False
+
+
+class LatencyProxy:
+    """TCP proxy that counts connections and delays every forwarded chunk by `latency` seconds
+
+    Args:
+        target_host (string): The upstream host
+
+        target_port (int): The upstream port
+
+        latency (float): One-way delay in seconds applied in both directions
+
+    """
+
+    def __init__(self, target_host, target_port, latency=0.0):
+        self.target = (target_host, target_port)
+        self.latency = latency
+        self.connections = 0
+        self._server = socket.socket()
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(('127.0.0.1', 0))
+        self._server.listen(128)
+        self.host, self.port = self._server.getsockname()
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._server.close()
+        return False
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self._server.accept()
+            except OSError:
+                return
+            self.connections += 1
+            upstream = socket.create_connection(self.target)
+            for source, sink in ((client, upstream), (upstream, client)):
+                threading.Thread(target=self._pump, args=(source, sink), daemon=True).start()
+
+    def _pump(self, source, sink):
+        try:
+            while True:
+                data = source.recv(65536)
+                if not data:
+                    break
+                if self.latency:
+                    time.sleep(self.latency)
+                sink.sendall(data)
+        except OSError:
+            pass
+        finally:
+            for sock in (source, sink):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+
+class FakeBoto3:
+    """Replaces the `boto3` module inside a loaded rotation module"""
+
+    def __init__(self, service_client):
+        self.service_client = service_client
+
+    def client(self, service_name, *args, **kwargs):
+        if service_name != 'secretsmanager':
+            raise RuntimeError("The benchmark does not fake the %s API" % service_name)
+        return self.service_client
+
+
+def cold_import_time(statement):
+    """Times `statement` in a fresh interpreter; returns seconds, or None if it fails"""
+    code = "import time; started = time.perf_counter(); %s; print(time.perf_counter() - started)" % statement
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return float(result.stdout.strip())
+
+
+def client_init_time():
+    """Times the construction of a real Secrets Manager client, as the handlers once did on every invocation"""
+    return cold_import_time("import boto3; started = time.perf_counter(); boto3.client('secretsmanager', region_name='us-east-1')")
+
+
+def measure_invocation_overhead(module, service_client, name, invocations=OVERHEAD_INVOCATIONS):
+    """Times lambda_handler on an event that reaches no database: the first (cold) call and the mean warm call
+
+    The event names the AWSCURRENT version as a createSecret step, which rotate-secret-newuser.py returns from after
+    its staging check and rotate-new-secret.py does nothing for, so only client setup, tracing and the staging
+    check are measured.
+
+    """
+    # Enable rotation on the secret without leaving a pending version behind
+    pending = service_client.rotate_secret(SecretId=name)['VersionId']
+    service_client.update_secret_version_stage(SecretId=name, VersionStage='AWSPENDING', RemoveFromVersionId=pending)
+    versions = service_client.describe_secret(SecretId=name)['VersionIdsToStages']
+    token = next(version for version, stages in versions.items() if 'AWSCURRENT' in stages)
+    event = {'SecretId': name, 'ClientRequestToken': token, 'Step': 'createSecret'}
+    context = SimpleNamespace(function_name='benchmark')
+
+    started = time.perf_counter()
+    module.lambda_handler(event, context)
+    cold = time.perf_counter() - started
+    started = time.perf_counter()
+    for _ in range(invocations):
+        module.lambda_handler(event, context)
+    return cold, (time.perf_counter() - started) / invocations
+
+
+def admin_connect(host, port, user, password, dbname='postgres'):
+    """Opens an autocommit connection for setting up the benchmark database with whichever driver is installed"""
+    try:
+        import pgdb
+        conn = pgdb.connect(host=host, port=port, user=user, password=password, database=dbname)
+    except ImportError:
+        try:
+            import psycopg2
+            conn = psycopg2.connect(host=host, port=port, user=user, password=password, dbname=dbname)
+        except ImportError:
+            import pg8000.dbapi
+            conn = pg8000.dbapi.connect(host=host, port=int(port), user=user, password=password, database=dbname)
+    conn.autocommit = True
+    return conn
+
+
+class Scenario:
+    """Seeds the fake Secrets Manager and the database for one rotation module
+
+    Args:
+        module_path (string): Path of the rotation module
+
+        secret_count (int): Number of user secrets to rotate
+
+        table_count (int): Tables each user is granted SELECT on, to give the privilege engine work
+
+        superuser_password (string): Password of the `postgres` superuser
+
+    """
+
+    def __init__(self, module_path, secret_count, table_count, superuser_password=SUPERUSER_PASSWORD):
+        self.module_path = module_path
+        self.superuser_password = superuser_password
+        self.newuser = os.path.basename(module_path) == os.path.basename(NEWUSER_MODULE)
+        self.secret_count = secret_count
+        self.table_count = table_count
+
+    def seed(self, service_client, db_host, db_port, admin):
+        """Creates the users, tables and secrets; returns the secret names to rotate"""
+        run_id = uuid.uuid4().hex[:6]
+        with closing(admin.cursor()) as cur:
+            cur.execute("CREATE SCHEMA IF NOT EXISTS bench")
+            for table in range(self.table_count):
+                cur.execute("CREATE TABLE IF NOT EXISTS bench.t%d (id int)" % table)
+        base = {'engine': 'postgres', 'host': db_host, 'port': db_port, 'dbname': 'postgres'}
+        if self.newuser:
+            service_client.create_secret(Name='bench-master', SecretString=json.dumps(dict(base, username='postgres', password=self.superuser_password)))
+        names = []
+        for index in range(self.secret_count):
+            username = "bench_%s_%d" % (run_id, index)
+            password = uuid.uuid4().hex
+            with closing(admin.cursor()) as cur:
+                cur.execute("CREATE ROLE %s WITH LOGIN PASSWORD '%s'%s" % (username, password, '' if self.newuser else ' CREATEROLE'))
+                cur.execute("GRANT USAGE ON SCHEMA bench TO %s" % username)
+                if self.table_count:
+                    cur.execute("GRANT SELECT ON ALL TABLES IN SCHEMA bench TO %s" % username)
+            secret = dict(base, username=username, password=password)
+            if self.newuser:
+                secret['masterarn'] = 'bench-master'
+            name = "bench-user-%d" % index
+            service_client.create_secret(Name=name, SecretString=json.dumps(secret))
+            names.append(name)
+        return names
+
+    def after_create_secret(self, service_client, arn, token):
+        """Stands in for the password generation rotate-new-secret.py leaves to Secrets Manager"""
+        if self.newuser:
+            return
+        current = json.loads(service_client.get_secret_value(SecretId=arn)['SecretString'])
+        pending = dict(current, username="%s_r%s" % (current['username'].split('_r')[0], uuid.uuid4().hex[:6]), password=uuid.uuid4().hex)
+        service_client.put_secret_value(SecretId=arn, ClientRequestToken=token, SecretString=json.dumps(pending), VersionStages=['AWSPENDING'])
+
+
+def run_benchmark(scenario, db_host, db_port, secret_count, concurrency=1, db_latency=0.0, sm_latency=0.0):
+    """Rotates `secret_count` secrets through lambda_handler and measures every step
+
+    Args:
+        scenario (Scenario): The module and seeding to benchmark
+
+        db_host (string): The PostgreSQL host to proxy to
+
+        db_port (int): The PostgreSQL port to proxy to
+
+        secret_count (int): Number of secrets to rotate
+
+        concurrency (int): Number of secrets rotated in parallel
+
+        db_latency (float): One-way latency in seconds added to database traffic
+
+        sm_latency (float): Latency in seconds added to every Secrets Manager call
+
+    Returns:
+        dict: The report
+
+    """
+    service_client = FakeSecretsManager()
+    os.environ.setdefault('SECRETS_MANAGER_ENDPOINT', 'https://secretsmanager.fake.invalid')
+
+    load_started = time.perf_counter()
+    module = load_rotation_module(scenario.module_path)
+    module_load = time.perf_counter() - load_started
+    module.boto3 = FakeBoto3(service_client)
+
+    admin = admin_connect(db_host, db_port, 'postgres', scenario.superuser_password)
+    with LatencyProxy(db_host, db_port, db_latency) as proxy:
+        try:
+            names = scenario.seed(service_client, proxy.host, proxy.port, admin)
+        finally:
+            admin.close()
+        cold_invocation, warm_invocation = measure_invocation_overhead(module, service_client, names[0])
+        service_client.call_counts.clear()
+        service_client.latency = sm_latency
+        connections_before = proxy.connections
+
+        step_latencies = {step: [] for step in ROTATION_STEPS}
+        errors = []
+        lock = threading.Lock()
+
+        def rotate(name):
+            token = service_client.rotate_secret(SecretId=name)['VersionId']
+            for step in ROTATION_STEPS:
+                started = time.perf_counter()
+                try:
+                    module.lambda_handler({'SecretId': name, 'ClientRequestToken': token, 'Step': step}, SimpleNamespace(function_name='benchmark'))
+                    if step == 'createSecret':
+                        scenario.after_create_secret(service_client, name, token)
+                except Exception as err:
+                    with lock:
+                        errors.append({'secret': name, 'step': step, 'error': "%s: %s" % (type(err).__name__, err)})
+                    return
+                finally:
+                    with lock:
+                        step_latencies[step].append(time.perf_counter() - started)
+            service_client.update_secret_version_stage(SecretId=name, VersionStage='AWSPENDING', RemoveFromVersionId=token)
+
+        started = time.perf_counter()
+        if concurrency > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(rotate, names))
+        else:
+            for name in names:
+                rotate(name)
+        elapsed = time.perf_counter() - started
+        connections = proxy.connections - connections_before
+
+    api_calls = dict(service_client.call_counts)
+    driver = module.DB_DRIVER
+    return {
+        'module': os.path.basename(scenario.module_path),
+        'secrets': secret_count,
+        'concurrency': concurrency,
+        'db_latency_ms': db_latency * 1000,
+        'sm_latency_ms': sm_latency * 1000,
+        'module_load_s': module_load,
+        'cold_invocation_s': cold_invocation,
+        'warm_invocation_s': warm_invocation,
+        'db_driver': driver,
+        'driver_import_s': cold_import_time(DRIVER_IMPORTS[driver]) if driver in DRIVER_IMPORTS else None,
+        'client_init_s': client_init_time(),
+        'elapsed_s': elapsed,
+        'step_latency_s': {step: percentiles(values) for step, values in step_latencies.items()},
+        'api_calls': api_calls,
+        'api_calls_per_rotation': sum(api_calls.values()) / float(secret_count),
+        'db_connections': connections,
+        'db_connections_per_rotation': connections / float(secret_count),
+        'errors': errors,
+    }
+
+
+def print_report(report):
+    print("%s: %d secrets, concurrency %d, db latency %.0fms, Secrets Manager latency %.0fms" % (
+        report['module'], report['secrets'], report['concurrency'], report['db_latency_ms'], report['sm_latency_ms']))
+    print("  module load %.3fs, wall time %.2fs" % (report['module_load_s'], report['elapsed_s']))
+    print("  invocation overhead: cold %.2fms, warm %.3fms" % (report['cold_invocation_s'] * 1000, report['warm_invocation_s'] * 1000))
+    print("  %s import %s, Secrets Manager client construction %s" % (
+        report['db_driver'],
+        "%.1fms" % (report['driver_import_s'] * 1000) if report['driver_import_s'] is not None else "unavailable",
+        "%.1fms" % (report['client_init_s'] * 1000) if report['client_init_s'] is not None else "unavailable (boto3 not installed)"))
+    for step in ROTATION_STEPS:
+        stats = report['step_latency_s'][step]
+        if stats['count']:
+            print("  %-13s n=%-5d p50=%7.1fms p95=%7.1fms p99=%7.1fms max=%7.1fms" % (
+                step, stats['count'], stats['p50'] * 1000, stats['p95'] * 1000, stats['p99'] * 1000, stats['max'] * 1000))
+    print("  Secrets Manager calls: %d (%.1f per rotation) %s" % (
+        sum(report['api_calls'].values()), report['api_calls_per_rotation'], json.dumps(report['api_calls'], sort_keys=True)))
+    print("  database connections: %d (%.1f per rotation)" % (report['db_connections'], report['db_connections_per_rotation']))
+    if report['errors']:
+        print("  %d rotations failed, first error at %s: %s" % (len(report['errors']), report['errors'][0]['step'], report['errors'][0]['error']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the rotation Lambdas against local stand-ins.")
+    parser.add_argument('--module', default=NEWUSER_MODULE, help="Path to the rotation Lambda module")
+    parser.add_argument('--secrets', type=int, default=20, help="Number of secrets to rotate")
+    parser.add_argument('--tables', type=int, default=10, help="Tables each user holds privileges on")
+    parser.add_argument('--concurrency', type=int, default=1, help="Secrets rotated in parallel")
+    parser.add_argument('--db-latency-ms', type=float, default=0.0, help="One-way latency added to database traffic")
+    parser.add_argument('--sm-latency-ms', type=float, default=0.0, help="Latency added to each Secrets Manager call")
+    parser.add_argument('--pg-host', help="Use an existing PostgreSQL instead of a throwaway one")
+    parser.add_argument('--pg-port', type=int, default=5432, help="Port of the existing PostgreSQL")
+    parser.add_argument('--pg-password', default=SUPERUSER_PASSWORD, help="Password of the postgres user on the existing PostgreSQL")
+    parser.add_argument('--json', help="Also write the report to this file")
+    args = parser.parse_args(argv)
+
+    if args.pg_host:
+        scenario = Scenario(args.module, args.secrets, args.tables, args.pg_password)
+        report = run_benchmark(scenario, args.pg_host, args.pg_port, args.secrets, args.concurrency, args.db_latency_ms / 1000, args.sm_latency_ms / 1000)
+    else:
+        scenario = Scenario(args.module, args.secrets, args.tables)
+        with ThrowawayPostgres() as postgres:
+            report = run_benchmark(scenario, postgres.host, postgres.port, args.secrets, args.concurrency, args.db_latency_ms / 1000, args.sm_latency_ms / 1000)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+    return 1 if report['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
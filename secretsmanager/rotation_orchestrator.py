@@ -0,0 +1,305 @@
+"""Fleet rotation orchestrator for the PostgreSQL user rotation Lambda
+
+Drives the createSecret/setSecret/testSecret/finishSecret steps of `rotate-secret-newuser.py` for many secrets at
+once, the way Secrets Manager would drive them one secret at a time. Global concurrency is bounded by a thread pool,
+the database steps of each secret are additionally bounded per database host so a single writer never sees more
+than `per_host_limit` concurrent CREATE ROLE/GRANT sessions, and failed steps are retried with jittered exponential
+backoff (every step is idempotent).
+
+Example, against a local PostgreSQL and an in-process Secrets Manager seeded from a JSON file:
+
+    python rotation_orchestrator.py --fake-secrets seeds.json --all --concurrency 32 --per-host 4
+
+"""
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROTATION_MODULE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rotate-secret-newuser.py')
+ROTATION_STEPS = ('createSecret', 'setSecret', 'testSecret', 'finishSecret')
+DATABASE_STEPS = ('setSecret', 'testSecret', 'finishSecret')
+
+# Errors that retrying cannot fix, e.g. a secret missing required keys
+NON_RETRYABLE_ERRORS = (KeyError,)
+
+
+def load_rotation_module(path=DEFAULT_ROTATION_MODULE, name=None):
+    """Loads a rotation Lambda module from its file
+
+    The rotation Lambdas are named after their deployment artifacts (with dashes), so they cannot be imported by name.
+
+    Args:
+        path (string): Path to the rotation module source file
+
+        name (string): The module name to register, defaults to the file name with dashes replaced
+
+    Returns:
+        module: The loaded module
+
+    """
+    name = name or os.path.splitext(os.path.basename(path))[0].replace('-', '_')
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class HostLimiter:
+    """Hands out a bounded semaphore per database host"""
+
+    def __init__(self, per_host_limit):
+        self.per_host_limit = per_host_limit
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, host):
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = self._semaphores[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return semaphore
+
+
+class RotationOrchestrator:
+    """Rotates many secrets concurrently with per-host limits and retries
+
+    Args:
+        service_client (client): A Secrets Manager client, real or fake, shared by all workers
+
+        rotation_module (module): The rotation Lambda module providing the four step functions
+
+        max_workers (int): Maximum number of secrets rotated at the same time
+
+        per_host_limit (int): Maximum number of concurrent database steps against a single host
+
+        max_attempts (int): Attempts per step before the secret is reported as failed
+
+        base_delay (float): First retry delay in seconds, doubled on every attempt
+
+        max_delay (float): Upper bound of a retry delay in seconds
+
+    """
+
+    def __init__(self, service_client, rotation_module, max_workers=16, per_host_limit=2, max_attempts=4, base_delay=1.0, max_delay=30.0):
+        self.service_client = service_client
+        self.rotation_module = rotation_module
+        self.max_workers = max_workers
+        self.host_limiter = HostLimiter(per_host_limit)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._step_functions = {
+            'createSecret': rotation_module.create_secret,
+            'setSecret': rotation_module.set_secret,
+            'testSecret': rotation_module.test_secret,
+            'finishSecret': rotation_module.finish_secret,
+        }
+
+    def rotate_all(self, secret_ids):
+        """Rotates every secret and returns a summary report
+
+        Args:
+            secret_ids (list): Secret ARNs or names
+
+        Returns:
+            dict: The summary built by `summarize`, including the per-secret results
+
+        """
+        secret_ids = list(secret_ids)
+        results = []
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self.rotate_one, arn) for arn in secret_ids]
+            for done, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                results.append(result)
+                if result['status'] == 'succeeded':
+                    logger.info("[%d/%d] %s rotated in %.2fs (%d attempts)" % (done, len(secret_ids), result['arn'], result['duration'], result['attempts']))
+                else:
+                    logger.error("[%d/%d] %s failed at %s: %s" % (done, len(secret_ids), result['arn'], result['failed_step'], result['error']))
+        return summarize(results, time.monotonic() - started)
+
+    def rotate_one(self, arn):
+        """Runs all rotation steps for a single secret
+
+        An interrupted rotation (a version staged AWSPENDING but not AWSCURRENT) is resumed with its token instead of
+        starting over, as Secrets Manager does.
+
+        Args:
+            arn (string): The secret ARN or name
+
+        Returns:
+            dict: The result with `arn`, `status`, `token`, `attempts`, `duration`, `steps` and, on failure,
+            `failed_step` and `error`
+
+        """
+        result = {'arn': arn, 'status': 'succeeded', 'token': None, 'attempts': 0, 'steps': {}}
+        started = time.monotonic()
+        step = None
+        try:
+            token = self._pending_token(arn) or str(uuid.uuid4())
+            result['token'] = token
+            host = None
+            for step in ROTATION_STEPS:
+                if step in DATABASE_STEPS:
+                    if host is None:
+                        host = self._database_host(arn)
+                    with self.host_limiter(host):
+                        self._run_step(step, arn, token, result)
+                else:
+                    self._run_step(step, arn, token, result)
+
+            # Secrets Manager removes the AWSPENDING label once finishSecret succeeds
+            self.service_client.update_secret_version_stage(SecretId=arn, VersionStage='AWSPENDING', RemoveFromVersionId=token)
+        except Exception as err:
+            result['status'] = 'failed'
+            result['failed_step'] = step
+            result['error'] = "%s: %s" % (type(err).__name__, err)
+        result['duration'] = time.monotonic() - started
+        return result
+
+    def _run_step(self, step, arn, token, result):
+        step_function = self._step_functions[step]
+        for attempt in range(1, self.max_attempts + 1):
+            result['attempts'] += 1
+            started = time.monotonic()
+            try:
+                step_function(self.service_client, arn, token)
+                result['steps'][step] = time.monotonic() - started
+                return
+            except NON_RETRYABLE_ERRORS:
+                raise
+            except Exception as err:
+                if attempt == self.max_attempts:
+                    raise
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+                logger.warning("%s for %s failed on attempt %d, retrying in %.2fs: %s" % (step, arn, attempt, delay, err))
+                time.sleep(delay)
+
+    def _pending_token(self, arn):
+        metadata = self.service_client.describe_secret(SecretId=arn)
+        for version, stages in metadata['VersionIdsToStages'].items():
+            if 'AWSPENDING' in stages and 'AWSCURRENT' not in stages:
+                return version
+        return None
+
+    def _database_host(self, arn):
+        secret = self.service_client.get_secret_value(SecretId=arn, VersionStage='AWSCURRENT')
+        return json.loads(secret['SecretString']).get('host', '')
+
+
+def summarize(results, elapsed):
+    """Builds a summary report from per-secret rotation results
+
+    Args:
+        results (list): Results returned by `RotationOrchestrator.rotate_one`
+
+        elapsed (float): Wall-clock duration of the run in seconds
+
+    Returns:
+        dict: Totals, latency percentiles per step and for whole rotations, and the failed secrets
+
+    """
+    succeeded = [r for r in results if r['status'] == 'succeeded']
+    failed = [r for r in results if r['status'] != 'succeeded']
+    step_latencies = {}
+    for r in results:
+        for step, duration in r['steps'].items():
+            step_latencies.setdefault(step, []).append(duration)
+    return {
+        'total': len(results),
+        'succeeded': len(succeeded),
+        'failed': len(failed),
+        'elapsed': elapsed,
+        'retries': sum(max(0, r['attempts'] - len(r['steps']) - (r['status'] != 'succeeded')) for r in results),
+        'rotation_latency': percentiles([r['duration'] for r in succeeded]),
+        'step_latency': {step: percentiles(step_latencies[step]) for step in ROTATION_STEPS if step in step_latencies},
+        'failures': [{'arn': r['arn'], 'step': r['failed_step'], 'error': r['error']} for r in failed],
+        'results': results,
+    }
+
+
+def percentiles(values):
+    """Returns count, p50, p95, p99 and max of a list of durations"""
+    if not values:
+        return {'count': 0}
+    values = sorted(values)
+
+    def pick(fraction):
+        return values[min(len(values) - 1, int(fraction * len(values)))]
+
+    return {'count': len(values), 'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99), 'max': values[-1]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rotate many PostgreSQL user secrets concurrently.")
+    parser.add_argument('secret_ids', nargs='*', help="Secret ARNs or names to rotate")
+    parser.add_argument('--secret-ids-file', help="File with one secret ARN or name per line")
+    parser.add_argument('--all', action='store_true', help="With --fake-secrets, rotate every seeded secret that has a masterarn")
+    parser.add_argument('--module', default=DEFAULT_ROTATION_MODULE, help="Path to the rotation Lambda module")
+    parser.add_argument('--concurrency', type=int, default=16, help="Maximum secrets rotated at once")
+    parser.add_argument('--per-host', type=int, default=2, help="Maximum concurrent database steps per host")
+    parser.add_argument('--max-attempts', type=int, default=4, help="Attempts per step")
+    parser.add_argument('--base-delay', type=float, default=1.0, help="First retry delay in seconds")
+    parser.add_argument('--fake-secrets', help="Use an in-process Secrets Manager seeded from this JSON file")
+    parser.add_argument('--endpoint-url', help="Secrets Manager endpoint URL")
+    parser.add_argument('--region', help="AWS region")
+    parser.add_argument('--summary-json', help="Write the full summary report to this file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    if args.fake_secrets:
+        from fake_secretsmanager import FakeSecretsManager
+        service_client = FakeSecretsManager.from_file(args.fake_secrets)
+    else:
+        import boto3
+        service_client = boto3.client('secretsmanager', endpoint_url=args.endpoint_url, region_name=args.region)
+
+    secret_ids = list(args.secret_ids)
+    if args.secret_ids_file:
+        with open(args.secret_ids_file) as ids_file:
+            secret_ids.extend(line.strip() for line in ids_file if line.strip())
+    if args.all:
+        if not args.fake_secrets:
+            parser.error("--all requires --fake-secrets")
+        for entry in service_client.list_secrets()['SecretList']:
+            secret = json.loads(service_client.get_secret_value(SecretId=entry['ARN'])['SecretString'])
+            if 'masterarn' in secret:
+                secret_ids.append(entry['ARN'])
+    if not secret_ids:
+        parser.error("no secrets to rotate")
+
+    orchestrator = RotationOrchestrator(
+        service_client,
+        load_rotation_module(args.module),
+        max_workers=args.concurrency,
+        per_host_limit=args.per_host,
+        max_attempts=args.max_attempts,
+        base_delay=args.base_delay,
+    )
+    summary = orchestrator.rotate_all(secret_ids)
+
+    if args.summary_json:
+        with open(args.summary_json, 'w') as summary_file:
+            json.dump(summary, summary_file, indent=2, default=str)
+    print("Rotated %d/%d secrets in %.2fs (%d failed, %d retries)" % (summary['succeeded'], summary['total'], summary['elapsed'], summary['failed'], summary['retries']))
+    for step, stats in summary['step_latency'].items():
+        print("  %-13s n=%-5d p50=%.3fs p95=%.3fs max=%.3fs" % (step, stats['count'], stats['p50'], stats['p95'], stats['max']))
+    for failure in summary['failures']:
+        print("  FAILED %s at %s: %s" % (failure['arn'], failure['step'], failure['error']))
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
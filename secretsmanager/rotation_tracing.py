@@ -0,0 +1,251 @@
+"""Step tracing for the rotation Lambdas
+
+Times every boto3 call, database connect and `cursor.execute` made during a rotation step and, when the step ends,
+prints one CloudWatch Embedded Metric Format (EMF) record with the step duration, per-call latency, call counts,
+retries and errors. Tracing is enabled with ROTATION_TRACING=1; when it is off, spans are a shared no-op object and
+clients and connections are returned unwrapped, so the overhead is a single attribute check per call site.
+
+This module must be packaged next to the rotation Lambda that imports it.
+
+"""
+import json
+import os
+import re
+import threading
+import time
+
+TRACING_ENABLED = os.environ.get('ROTATION_TRACING', '').lower() in ('1', 'true', 'yes')
+EMF_NAMESPACE = os.environ.get('ROTATION_TRACING_NAMESPACE', 'SecretsManagerRotation')
+
+# The leading keyword of a statement, without the punctuation around it, as in 'BEGIN;' or '(SELECT ...)'
+SQL_VERB = re.compile(r'[\s(]*([A-Za-z]+)')
+
+
+class NullSpan:
+    """Span used when tracing is disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    """Times a block of code and records it on the tracer when the block exits"""
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer.record(self.name, time.perf_counter() - self.started, error=exc_type is not None)
+        return False
+
+
+class Tracer:
+    """Collects span timings for one rotation step at a time
+
+    Args:
+        enabled (boolean): Whether spans are recorded and records emitted
+
+        namespace (string): The CloudWatch namespace of the emitted metrics
+
+    """
+
+    def __init__(self, enabled=TRACING_ENABLED, namespace=EMF_NAMESPACE):
+        self.enabled = enabled
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._reset(None, None)
+
+    def _reset(self, step, secret_id):
+        self.step = step
+        self.secret_id = secret_id
+        self.step_started = time.perf_counter()
+        self.spans = {}
+
+    def start_step(self, step, secret_id=None):
+        """Starts collecting spans for a rotation step, discarding anything recorded before"""
+        if self.enabled:
+            with self._lock:
+                self._reset(step, secret_id)
+
+    def span(self, name):
+        """Returns a context manager timing the enclosed block under `name`"""
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name)
+
+    def record(self, name, duration, retries=0, error=False):
+        """Adds one call to the statistics of `name`
+
+        Args:
+            name (string): The span name, e.g. 'secretsmanager.GetSecretValue' or 'db.connect'
+
+            duration (float): The call duration in seconds
+
+            retries (int): Retries performed inside the call
+
+            error (boolean): Whether the call failed
+
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self.spans.get(name)
+            if stats is None:
+                stats = self.spans[name] = {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'retries': 0, 'errors': 0}
+            duration_ms = duration * 1000
+            stats['count'] += 1
+            stats['total_ms'] += duration_ms
+            stats['max_ms'] = max(stats['max_ms'], duration_ms)
+            stats['retries'] += retries
+            stats['errors'] += int(error)
+
+    def instrument_client(self, client):
+        """Registers timing hooks on a boto3 client
+
+        Each API call becomes a span named `<service>.<Operation>`; retries come from the response metadata. Calls
+        answered with an error response count as errors, as do calls that raise before any response.
+
+        Args:
+            client (client): A boto3 client
+
+        Returns:
+            client: The same client; stand-ins without botocore hooks, such as the benchmark fakes, are left as they are
+
+        """
+        if not self.enabled or not hasattr(client, 'meta') or getattr(client, '_rotation_traced', False):
+            return client
+        service_name = client.meta.service_model.service_name
+
+        def before_call(context, **kwargs):
+            context['rotation_trace_started'] = time.perf_counter()
+
+        def after_call(model, parsed, context, **kwargs):
+            started = context.pop('rotation_trace_started', None)
+            if started is not None:
+                retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0) if isinstance(parsed, dict) else 0
+                # after-call also fires for error responses, before botocore raises them as ClientError
+                error = isinstance(parsed, dict) and 'Error' in parsed
+                self.record("%s.%s" % (service_name, model.name), time.perf_counter() - started, retries=retries, error=error)
+
+        def after_call_error(context, event_name, **kwargs):
+            started = context.pop('rotation_trace_started', None)
+            if started is not None:
+                operation_name = event_name.rsplit('.', 1)[-1]
+                self.record("%s.%s" % (service_name, operation_name), time.perf_counter() - started, error=True)
+
+        client.meta.events.register('before-call.*.*', before_call)
+        client.meta.events.register('after-call.*.*', after_call)
+        client.meta.events.register('after-call-error.*.*', after_call_error)
+        client._rotation_traced = True
+        return client
+
+    def wrap_connection(self, conn):
+        """Wraps a DB-API connection so that every `cursor.execute` is timed
+
+        Args:
+            conn (Connection): A DB-API connection, or None
+
+        Returns:
+            Connection: A tracing proxy, or the connection itself when tracing is disabled
+
+        """
+        if not self.enabled or conn is None:
+            return conn
+        return TracedConnection(conn, self)
+
+    def emit(self):
+        """Prints the EMF record for the current step and starts a new, empty one"""
+        if not self.enabled:
+            return
+        with self._lock:
+            spans = self.spans
+            record = {
+                '_aws': {
+                    'Timestamp': int(time.time() * 1000),
+                    'CloudWatchMetrics': [{
+                        'Namespace': self.namespace,
+                        'Dimensions': [['Function', 'Step']],
+                        'Metrics': [
+                            {'Name': 'StepDuration', 'Unit': 'Milliseconds'},
+                            {'Name': 'Calls', 'Unit': 'Count'},
+                            {'Name': 'Retries', 'Unit': 'Count'},
+                            {'Name': 'Errors', 'Unit': 'Count'},
+                        ],
+                    }],
+                },
+                'Function': os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local'),
+                'Step': self.step or 'unknown',
+                'SecretId': self.secret_id,
+                'StepDuration': (time.perf_counter() - self.step_started) * 1000,
+                'Calls': sum(stats['count'] for stats in spans.values()),
+                'Retries': sum(stats['retries'] for stats in spans.values()),
+                'Errors': sum(stats['errors'] for stats in spans.values()),
+                'Spans': spans,
+            }
+            self._reset(None, None)
+        print(json.dumps(record), flush=True)
+
+
+class TracedConnection:
+    """DB-API connection proxy handing out timed cursors"""
+
+    def __init__(self, conn, tracer):
+        object.__setattr__(self, '_conn', conn)
+        object.__setattr__(self, '_tracer', tracer)
+
+    def cursor(self, *args, **kwargs):
+        return TracedCursor(self._conn.cursor(*args, **kwargs), self._tracer)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._conn.__exit__(exc_type, exc_value, traceback)
+
+
+class TracedCursor:
+    """DB-API cursor proxy recording each execute as a `sql.<VERB>` span"""
+
+    def __init__(self, cur, tracer):
+        self._cur = cur
+        self._tracer = tracer
+
+    def execute(self, operation, *args, **kwargs):
+        match = SQL_VERB.match(operation)
+        verb = match.group(1).upper() if match else 'EMPTY'
+        with self._tracer.span("sql.%s" % verb):
+            return self._cur.execute(operation, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+    def __iter__(self):
+        return iter(self._cur)
+
+    def __enter__(self):
+        self._cur.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._cur.__exit__(exc_type, exc_value, traceback)
+
+
+tracer = Tracer()
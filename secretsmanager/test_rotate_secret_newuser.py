@@ -0,0 +1,147 @@
+import collections
+import string
+
+import pytest
+
+pytest.importorskip('boto3')
+
+from rotation_orchestrator import load_rotation_module  # noqa: E402
+
+rotation = load_rotation_module()
+
+DRAWS = 3000
+
+
+class Pg8000Cursor:
+    """Cursor shaped like pg8000.dbapi.Cursor, which is not a context manager"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = []
+        self.closed = False
+
+    def execute(self, operation, args=None):
+        self.conn.executed.append(operation)
+        if operation in self.conn.failing:
+            raise RuntimeError("statement failed")
+        self.rows = self.conn.rows.get(operation, [])
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        self.closed = True
+
+
+class Pg8000Connection:
+    def __init__(self, rows=None, failing=()):
+        self.rows = rows or {}
+        self.failing = failing
+        self.executed = []
+        self.cursors = []
+        self.closed = False
+
+    def cursor(self):
+        cursor = Pg8000Cursor(self)
+        self.cursors.append(cursor)
+        return cursor
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def pg8000_driver(monkeypatch):
+    monkeypatch.setattr(rotation, 'db_driver', rotation.DatabaseDriver('pg8000', None, (RuntimeError,), False))
+
+
+def draw(**overrides):
+    policy = rotation.get_password_policy(overrides)
+    return [rotation.generate_password(policy) for _ in range(DRAWS)]
+
+
+def assert_roughly_uniform(counts, alphabet, tolerance=0.25):
+    expected = sum(counts[c] for c in alphabet) / len(alphabet)
+    for c in alphabet:
+        assert abs(counts[c] - expected) < tolerance * expected, "%r drawn %d times, expected about %d" % (c, counts[c], expected)
+
+
+def test_every_included_type_appears_when_required():
+    # Short passwords with the space class make a missing type likely, so the redraw path is exercised constantly
+    classes = rotation.get_password_character_classes(rotation.get_password_policy({'IncludeSpace': True}))
+
+    for password in draw(PasswordLength=8, IncludeSpace=True):
+        assert all(any(c in chars for c in password) for chars in classes)
+
+
+def test_excluded_characters_and_types_never_appear():
+    excluded = 'abcdefXYZ0123"\'\\'
+
+    passwords = draw(ExcludeCharacters=excluded, ExcludeUppercase=True)
+
+    drawn = set(''.join(passwords))
+    assert not drawn & set(excluded)
+    assert not drawn & set(string.ascii_uppercase)
+    assert ' ' not in drawn
+
+
+def test_characters_are_drawn_uniformly():
+    policy = {'RequireEachIncludedType': False}
+    alphabet = ''.join(rotation.get_password_character_classes(rotation.get_password_policy(policy)))
+
+    counts = collections.Counter(''.join(draw(**policy)))
+
+    assert set(counts) == set(alphabet)
+    assert_roughly_uniform(counts, alphabet)
+
+
+def test_characters_are_uniform_within_each_required_type():
+    # Redrawing candidates that miss a type favours the smaller types, but never one character over its peers
+    counts = collections.Counter(''.join(draw()))
+
+    for chars in rotation.get_password_character_classes(rotation.get_password_policy()):
+        assert_roughly_uniform(counts, chars)
+
+
+def test_run_in_transaction_closes_pg8000_cursors(pg8000_driver):
+    conn = Pg8000Connection()
+
+    rotation.run_in_transaction(conn, ["GRANT app_readers TO app"])
+
+    assert conn.executed == ["BEGIN;\nSET LOCAL lock_timeout = E'5s';\nGRANT app_readers TO app;\nCOMMIT"]
+    assert all(cursor.closed for cursor in conn.cursors)
+
+
+def test_run_in_transaction_rolls_back_on_pg8000_cursors(pg8000_driver):
+    script = "BEGIN;\nSET LOCAL lock_timeout = E'5s';\nGRANT app_readers TO app;\nCOMMIT"
+    conn = Pg8000Connection(failing={script})
+
+    with pytest.raises(RuntimeError):
+        rotation.run_in_transaction(conn, ["GRANT app_readers TO app"])
+
+    assert conn.executed == [script, "ROLLBACK"]
+    assert all(cursor.closed for cursor in conn.cursors)
+
+
+@pytest.mark.parametrize('strategy, role_exists, last_statement', [
+    (rotation.NEWUSER_STRATEGY, False, rotation.SET_SECRET_BLOCK),
+    (rotation.ALTERNATING_STRATEGY, True, "ALTER ROLE"),
+    (rotation.ALTERNATING_STRATEGY, False, rotation.SET_SECRET_BLOCK),
+], ids=['new-user', 'alternating', 'alternating-first-rotation'])
+def test_set_secret_on_a_pg8000_connection(monkeypatch, pg8000_driver, strategy, role_exists, last_statement):
+    secrets = {
+        'AWSCURRENT': {'username': 'app', 'password': 'current', 'masterarn': 'master', 'rotationstrategy': strategy},
+        'AWSPENDING': {'username': 'app_clone', 'password': 'pending', 'masterarn': 'master', 'rotationstrategy': strategy},
+    }
+    conn = Pg8000Connection(rows={rotation.ROLE_EXISTS_QUERY: [(1,)] if role_exists else []})
+    monkeypatch.setattr(rotation, 'get_secret_dict', lambda service_client, arn, stage, token=None: dict(secrets[stage]))
+    monkeypatch.setattr(rotation, 'get_master_connection', lambda service_client, current_dict: conn)
+
+    rotation.set_secret(None, 'app', 'token')
+
+    assert last_statement in conn.executed[-1]
+    assert all(cursor.closed for cursor in conn.cursors)
+    assert conn.closed
@@ -0,0 +1,117 @@
+import json
+from types import SimpleNamespace
+
+import rotated_role_sweeper
+from fake_secretsmanager import FakeSecretsManager
+
+CURRENT = 'pgsqlnewuser_1700000300_abcd'
+PREVIOUS = 'pgsqlnewuser_1700000200_bcde'
+SUPERSEDED = 'pgsqlnewuser_1700000100_cdef'
+
+
+class RecordingCursor:
+    """Answers the sweeper's queries from canned rows; like pg8000's cursors, it is not a context manager"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.result = []
+
+    def close(self):
+        pass
+
+    def execute(self, query, params=None):
+        self.result = self.rows['edges'] if query == rotated_role_sweeper.MEMBERSHIP_EDGES_QUERY else self.rows['candidates']
+
+    def fetchall(self):
+        return self.result
+
+
+class RecordingConnection:
+    def __init__(self, rows):
+        self.rows = rows
+        self.transactions = []
+
+    def cursor(self):
+        return RecordingCursor(self.rows)
+
+    def close(self):
+        pass
+
+
+def fake_rotation_module(conn):
+    return SimpleNamespace(
+        quote_identifier=lambda name: '"%s"' % name,
+        run_in_transaction=lambda conn_, statements, lock_timeout=None: conn.transactions.append(list(statements)),
+        get_secret_dict=lambda service_client, arn, stage: dict(json.loads(service_client.get_secret_value(SecretId=arn, VersionStage=stage)['SecretString']), masterarn='master'),
+        get_master_connection=lambda service_client, current_dict: conn,
+    )
+
+
+def test_three_role_chain_keeps_the_membership_inherited_through_the_dropped_role():
+    # current -> superseded -> app_readers: dropping the middle role would cut current off from app_readers
+    edges = [(CURRENT, SUPERSEDED), (SUPERSEDED, 'app_readers')]
+
+    assert rotated_role_sweeper.inherited_memberships(edges, {CURRENT}, {SUPERSEDED}) == {CURRENT: ['app_readers']}
+
+
+def test_memberships_still_reachable_without_the_dropped_roles_are_not_granted_again():
+    edges = [(CURRENT, SUPERSEDED), (SUPERSEDED, 'app_readers'), (CURRENT, 'app_readers')]
+
+    assert rotated_role_sweeper.inherited_memberships(edges, {CURRENT}, {SUPERSEDED}) == {}
+
+
+def test_memberships_behind_several_dropped_roles_are_granted_once():
+    older = 'pgsqlnewuser_1700000000_defg'
+    edges = [(CURRENT, SUPERSEDED), (SUPERSEDED, older), (older, 'app_readers'), (older, 'app_writers')]
+
+    assert rotated_role_sweeper.inherited_memberships(edges, {CURRENT}, {SUPERSEDED, older}) == {CURRENT: ['app_readers', 'app_writers']}
+
+
+def test_sweep_grants_inherited_memberships_before_dropping():
+    service_client = FakeSecretsManager()
+    service_client.create_secret(Name='app', SecretString=json.dumps({'username': CURRENT}))
+    conn = RecordingConnection({
+        'candidates': [(SUPERSEDED,)],
+        'edges': [(CURRENT, SUPERSEDED), (SUPERSEDED, 'app_readers')],
+    })
+
+    report = rotated_role_sweeper.sweep_secret(service_client, fake_rotation_module(conn), 'app', min_age=0, dry_run=False)
+
+    assert report['regranted'] == {CURRENT: ['app_readers']}
+    assert report['dropped'] == [SUPERSEDED]
+    assert conn.transactions[0] == ['GRANT "app_readers" TO "%s"' % CURRENT]
+    assert conn.transactions[1][-1] == 'DROP ROLE "%s"' % SUPERSEDED
+
+
+def test_dry_run_reports_the_grants_without_running_anything():
+    service_client = FakeSecretsManager()
+    service_client.create_secret(Name='app', SecretString=json.dumps({'username': CURRENT}))
+    conn = RecordingConnection({
+        'candidates': [(SUPERSEDED,)],
+        'edges': [(CURRENT, SUPERSEDED), (SUPERSEDED, 'app_readers')],
+    })
+
+    report = rotated_role_sweeper.sweep_secret(service_client, fake_rotation_module(conn), 'app', min_age=0)
+
+    assert report['regranted'] == {CURRENT: ['app_readers']}
+    assert conn.transactions == []
+
+
+def test_version_usernames_skip_unstaged_and_empty_versions():
+    service_client = FakeSecretsManager()
+    service_client.create_secret(Name='app', SecretString=json.dumps({'username': SUPERSEDED}))
+    for username in (PREVIOUS, CURRENT):
+        token = service_client.rotate_secret(SecretId='app')['VersionId']
+        service_client.put_secret_value(SecretId='app', ClientRequestToken=token, SecretString=json.dumps({'username': username}), VersionStages=['AWSPENDING'])
+        current = service_client.get_secret_value(SecretId='app')['VersionId']
+        service_client.update_secret_version_stage(SecretId='app', VersionStage='AWSCURRENT', MoveToVersionId=token, RemoveFromVersionId=current)
+    # A rotation that has not reached createSecret yet leaves an AWSPENDING version without a value
+    service_client.rotate_secret(SecretId='app')
+    service_client.call_counts.clear()
+
+    protected, history = rotated_role_sweeper.get_version_usernames(service_client, 'app')
+
+    # The first version lost its last label and is deprecated
+    assert protected == {CURRENT, PREVIOUS}
+    assert history == set()
+    assert service_client.call_counts['GetSecretValue'] == 3
@@ -56,6 +56,14 @@ resource "aws_iam_role_policy" "lambda_policy" {
         ]
         Resource = var.secret_arn
       },
+      {
+        Effect = "Allow"
+        Action = [
+          "rds:DescribeDBInstances",
+          "rds:DescribeDBClusters"
+        ]
+        Resource = "*"
+      },
       {
         Effect = "Allow"
         Action = [
@@ -0,0 +1,198 @@
+"""Free and used IPv4 addresses of VPC subnets
+
+Each subnet is held as a `SubnetBitmap`, one byte per address, marked with the 5 addresses AWS reserves (the network
+address, the VPC router, DNS, one for future use and the broadcast address), every private IP of the subnet's network
+interfaces and every IPv4 prefix delegated to them. Free and used blocks are then found with regular expressions over
+the bitmap, which run in C, so even a /16 is summarized in milliseconds once its interfaces are fetched.
+
+Network interfaces are paged through with `describe_network_interfaces` for all subnets concurrently, on a boto3
+session from the shared `credential_broker`.
+
+    python3 subnet_ip_inventory.py subnet-0123456789abcdef0 subnet-0fedcba9876543210 --region us-west-2
+    python3 subnet_ip_inventory.py subnet-0123456789abcdef0 --role-arn arn:aws:iam::111122223333:role/inventory-read --json
+
+"""
+import argparse
+import ipaddress
+import json
+import re
+import socket
+import struct
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from credential_broker import default_broker
+
+# Values of a bitmap byte
+FREE = 0
+RESERVED = 1
+ASSIGNED = 2
+DELEGATED = 3
+# AWS reserves the first four addresses and the last one of every subnet
+RESERVED_LOW = 4
+RESERVED_HIGH = 1
+DEFAULT_WORKERS = 8
+PAGE_SIZE = 1000
+
+FREE_RUNS = re.compile(rb'\x00+')
+USED_RUNS = re.compile(rb'[\x02\x03]+')
+
+
+def address_to_int(address):
+    """Converts a dotted IPv4 address to an integer, several times faster than ipaddress"""
+    return struct.unpack('!I', socket.inet_aton(address))[0]
+
+
+class SubnetBitmap:
+    """Allocation map of one IPv4 subnet, one byte per address
+
+    Args:
+        cidr (string): The subnet's CIDR block, e.g. '10.0.0.0/24'
+
+    """
+    __slots__ = ('network', 'base', 'addresses')
+
+    def __init__(self, cidr):
+        self.network = ipaddress.IPv4Network(cidr)
+        self.base = int(self.network.network_address)
+        size = self.network.num_addresses
+        self.addresses = bytearray(size)
+        self.addresses[:RESERVED_LOW] = bytes([RESERVED]) * min(RESERVED_LOW, size)
+        self.addresses[size - RESERVED_HIGH:] = bytes([RESERVED]) * RESERVED_HIGH
+
+    def offset(self, address):
+        """Returns the position of an address in the bitmap, or None if it is outside the subnet"""
+        offset = address_to_int(address) - self.base
+        return offset if 0 <= offset < len(self.addresses) else None
+
+    def assign(self, address):
+        offset = self.offset(address)
+        if offset is not None and self.addresses[offset] == FREE:
+            self.addresses[offset] = ASSIGNED
+
+    def delegate(self, prefix):
+        """Marks every address of a prefix delegated to an interface, e.g. '10.0.0.16/28'"""
+        network = ipaddress.IPv4Network(prefix)
+        start = max(int(network.network_address) - self.base, 0)
+        end = min(int(network.network_address) - self.base + network.num_addresses, len(self.addresses))
+        if start < end:
+            block = self.addresses[start:end]
+            # Reserved addresses keep their mark
+            self.addresses[start:end] = block.replace(bytes([FREE]), bytes([DELEGATED])).replace(bytes([ASSIGNED]), bytes([DELEGATED]))
+
+    def count(self, value):
+        return self.addresses.count(value)
+
+    def ranges(self, pattern):
+        """Returns the (first, last) address offsets of the runs the pattern matches"""
+        return [(match.start(), match.end() - 1) for match in pattern.finditer(self.addresses)]
+
+    def format_range(self, first, last):
+        start = ipaddress.IPv4Address(self.base + first)
+        return str(start) if first == last else f"{start}-{ipaddress.IPv4Address(self.base + last)}"
+
+    def summary(self):
+        """Returns the subnet's counts and its free and used blocks as address ranges"""
+        free = self.ranges(FREE_RUNS)
+        return {
+            'cidr': str(self.network),
+            'total': len(self.addresses),
+            'usable': len(self.addresses) - RESERVED_LOW - RESERVED_HIGH,
+            'assigned': self.count(ASSIGNED),
+            'delegated': self.count(DELEGATED),
+            'free': self.count(FREE),
+            'free_ranges': [self.format_range(first, last) for first, last in free],
+            'used_ranges': [self.format_range(first, last) for first, last in self.ranges(USED_RUNS)],
+        }
+
+
+def iter_network_interfaces(ec2, subnet_id):
+    """Yields every network interface of a subnet, page by page"""
+    paginator = ec2.get_paginator('describe_network_interfaces')
+    pages = paginator.paginate(Filters=[{'Name': 'subnet-id', 'Values': [subnet_id]}], PaginationConfig={'PageSize': PAGE_SIZE})
+    for page in pages:
+        yield from page['NetworkInterfaces']
+
+
+def subnet_bitmap(ec2, subnet):
+    """Builds the bitmap of a subnet as returned by describe_subnets"""
+    bitmap = SubnetBitmap(subnet['CidrBlock'])
+    for interface in iter_network_interfaces(ec2, subnet['SubnetId']):
+        for address in interface.get('PrivateIpAddresses', []):
+            bitmap.assign(address['PrivateIpAddress'])
+        for prefix in interface.get('Ipv4Prefixes', []):
+            bitmap.delegate(prefix['Ipv4Prefix'])
+    return bitmap
+
+
+def inventory(subnet_ids, region=None, role_arn=None, broker=None, max_workers=DEFAULT_WORKERS):
+    """Summarizes the IPv4 usage of subnets, fetching their network interfaces concurrently
+
+    Args:
+        subnet_ids (list): The subnet IDs
+
+        region (string): The subnets' region, defaults to the session's
+
+        role_arn (string): Role to assume, or None for the default credentials
+
+        broker (CredentialBroker): Assumes the role, defaults to the process-wide broker
+
+        max_workers (int): Subnets fetched in parallel
+
+    Returns:
+        list: One summary per subnet (see SubnetBitmap.summary), with `subnet_id` and EC2's own
+        `available_ip_address_count`, in the order given
+
+    """
+    ec2 = (broker or default_broker()).session(role_arn, region).client('ec2')
+    subnets = {}
+    for page in ec2.get_paginator('describe_subnets').paginate(SubnetIds=list(subnet_ids)):
+        for subnet in page['Subnets']:
+            subnets[subnet['SubnetId']] = subnet
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(subnets)))) as executor:
+        bitmaps = dict(zip(subnets, executor.map(lambda subnet: subnet_bitmap(ec2, subnet), subnets.values())))
+    summaries = []
+    for subnet_id in subnet_ids:
+        summary = bitmaps[subnet_id].summary()
+        summary['subnet_id'] = subnet_id
+        summary['available_ip_address_count'] = subnets[subnet_id]['AvailableIpAddressCount']
+        summaries.append(summary)
+    return summaries
+
+
+def print_summary(summary, show_used=False):
+    print(f"Subnet {summary['subnet_id']} ({summary['cidr']})")
+    print(f"  Total IPs: {summary['total']}")
+    print(f"  Usable IPs: {summary['usable']}")
+    print(f"  Available IPs (EC2): {summary['available_ip_address_count']}")
+    print(f"  Used IPs: {summary['assigned']} assigned, {summary['delegated']} in delegated prefixes")
+    if show_used:
+        for block in summary['used_ranges']:
+            print(f"    {block}")
+    print(f"  Unused IPs: {summary['free']} in {len(summary['free_ranges'])} ranges")
+    for block in summary['free_ranges']:
+        print(f"    {block}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="List the free IPv4 address ranges of VPC subnets.")
+    parser.add_argument('subnet_ids', nargs='+', metavar='SUBNET_ID', help="Subnets to inventory")
+    parser.add_argument('--region', help="Region of the subnets")
+    parser.add_argument('--role-arn', help="Role to assume")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Subnets fetched in parallel")
+    parser.add_argument('--show-used', action='store_true', help="Also list the used address ranges")
+    parser.add_argument('--json', action='store_true', help="Print the summaries as JSON")
+    args = parser.parse_args(argv)
+
+    summaries = inventory(args.subnet_ids, args.region, args.role_arn, max_workers=args.workers)
+    if args.json:
+        json.dump(summaries, sys.stdout, indent=2)
+        print()
+        return 0
+    for summary in summaries:
+        print_summary(summary, args.show_used)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
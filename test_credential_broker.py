@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+boto3 = pytest.importorskip('boto3')
+
+from credential_broker import CredentialBroker, role_arn
+
+
+class FakeSts:
+    def __init__(self):
+        self.calls = []
+
+    def assume_role(self, RoleArn, RoleSessionName, DurationSeconds):
+        self.calls.append(RoleArn)
+        return {'Credentials': {
+            'AccessKeyId': 'ASSUMED%d' % len(self.calls),
+            'SecretAccessKey': 'secret',
+            'SessionToken': 'token',
+            'Expiration': datetime.now(timezone.utc) + timedelta(hours=1),
+        }}
+
+
+def base_session():
+    return boto3.session.Session(aws_access_key_id='BASEKEY', aws_secret_access_key='basesecret', region_name='us-east-1')
+
+
+def test_base_credential_sessions_keep_their_own_region():
+    broker = CredentialBroker(base_session=base_session())
+
+    west = broker.session(None, 'us-west-2')
+    europe = broker.session(None, 'eu-west-1')
+
+    assert west.region_name == 'us-west-2'
+    assert europe.region_name == 'eu-west-1'
+    assert west.client('ec2').meta.region_name == 'us-west-2'
+    assert europe.client('ec2').meta.region_name == 'eu-west-1'
+    assert west.get_credentials().access_key == 'BASEKEY'
+    assert europe.get_credentials().access_key == 'BASEKEY'
+    assert broker.base_session.region_name == 'us-east-1'
+
+
+def test_role_sessions_share_one_assumption_across_regions():
+    broker = CredentialBroker(base_session=base_session())
+    broker.sts = FakeSts()
+    arn = role_arn('111122223333', 'inventory-read')
+
+    sessions = broker.sessions([(arn, 'us-west-2'), (arn, 'eu-west-1')])
+
+    assert broker.sts.calls == [arn]
+    assert sessions[(arn, 'us-west-2')].client('ec2').meta.region_name == 'us-west-2'
+    assert sessions[(arn, 'eu-west-1')].client('ec2').meta.region_name == 'eu-west-1'
+    assert sessions[(arn, 'us-west-2')].get_credentials().access_key == 'ASSUMED1'
+    assert sessions[(arn, 'eu-west-1')].get_credentials().access_key == 'ASSUMED1'